@@ -0,0 +1,208 @@
+"""
+Пул API ключей Poizon с отдельным rate limit для каждого ключа
+Запросы распределяются по ключу с наибольшим остатком квоты,
+ключи с повторяющимися 429/401 временно исключаются из ротации
+"""
+import hashlib
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+from rate_limiter import RateLimiter, rate_limiter
+
+logger = logging.getLogger(__name__)
+
+
+# После стольких ошибок 429/401 подряд ключ уходит в карантин
+DEFAULT_FAILURE_THRESHOLD = 3
+# Длительность карантина ключа (секунды)
+DEFAULT_QUARANTINE_SECONDS = 300
+
+
+def bucket_name(api_key: str) -> str:
+    """
+    Имя корзины rate limiter для ключа
+    
+    Зависит только от самого ключа, поэтому скорость (AIMD) и токены SQLite
+    остаются за ключом при смене порядка в POIZON_API_KEYS, а пулы разных
+    скраперов с одним ключом делят одну корзину.
+    """
+    return f"key-{hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:8]}"
+
+
+def mask_key(api_key: str) -> str:
+    """Возвращает ключ для логов без раскрытия целиком (abae…aabe8)"""
+    if len(api_key) <= 10:
+        return api_key[:2] + '…'
+    return f"{api_key[:4]}…{api_key[-5:]}"
+
+
+class ApiKey:
+    """Состояние одного API ключа в пуле"""
+    
+    def __init__(self, api_key: str, bucket: str):
+        """
+        Args:
+            api_key: API ключ
+            bucket: Имя корзины rate limiter для этого ключа
+        """
+        self.api_key = api_key
+        self.bucket = bucket
+        self.label = mask_key(api_key)
+        self.requests = 0
+        self.successes = 0
+        self.rate_limited = 0
+        self.unauthorized = 0
+        self.consecutive_failures = 0
+        self.quarantines = 0
+        self.quarantined_until = 0.0
+    
+    def is_active(self, now: float) -> bool:
+        """Ключ не в карантине"""
+        return now >= self.quarantined_until
+
+
+class ApiKeyPool:
+    """
+    Пул API ключей
+    
+    Каждый ключ получает свою корзину в rate limiter, поэтому суммарная
+    скорость растет пропорционально количеству ключей.
+    """
+    
+    def __init__(self, api_keys: List[str], limiter: RateLimiter = rate_limiter,
+                 requests_per_second: Optional[float] = None, burst: Optional[int] = None,
+                 failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+                 quarantine_seconds: float = DEFAULT_QUARANTINE_SECONDS):
+        """
+        Args:
+            api_keys: Список API ключей
+            limiter: Rate limiter, в котором создаются корзины ключей
+            requests_per_second: Скорость на один ключ (по умолчанию как у limiter)
+            burst: Burst на один ключ (по умолчанию как у limiter)
+            failure_threshold: Сколько 429/401 подряд переводят ключ в карантин
+            quarantine_seconds: Длительность карантина в секундах
+        """
+        unique_keys = list(dict.fromkeys(k.strip() for k in api_keys if k and k.strip()))
+        if not unique_keys:
+            raise ValueError("Пул API ключей пуст")
+        
+        self.limiter = limiter
+        self.failure_threshold = failure_threshold
+        self.quarantine_seconds = quarantine_seconds
+        
+        rps = requests_per_second or limiter.requests_per_second
+        key_burst = burst or limiter.burst
+        
+        self.keys: List[ApiKey] = []
+        for api_key in unique_keys:
+            key = ApiKey(api_key, bucket=bucket_name(api_key))
+            # Корзина уже создана другим пулом - не сбрасываем ее токены и скорость
+            if not limiter.has_bucket(key.bucket):
+                limiter.configure_bucket(key.bucket, rps, key_burst)
+            self.keys.append(key)
+        
+        self._by_bucket: Dict[str, ApiKey] = {key.bucket: key for key in self.keys}
+        logger.info(f"🔑 Пул API ключей: {len(self.keys)} шт. по {rps} req/sec")
+    
+    def __len__(self) -> int:
+        return len(self.keys)
+    
+    def _candidates(self) -> List[ApiKey]:
+        """Ключи, доступные для запроса (если все в карантине - ближайший к выходу)"""
+        now = time.time()
+        active = [key for key in self.keys if key.is_active(now)]
+        if active:
+            return active
+        
+        key = min(self.keys, key=lambda k: k.quarantined_until)
+        logger.warning(f"⚠️ Все API ключи в карантине, используем {key.label}")
+        return [key]
+    
+    def has_alternative(self, key: ApiKey) -> bool:
+        """Есть ли другой ключ вне карантина"""
+        now = time.time()
+        return any(k is not key and k.is_active(now) for k in self.keys)
+    
+    async def acquire(self) -> ApiKey:
+        """
+        Выбирает ключ с наибольшим остатком квоты и ждет его слот rate limiter
+        
+        Returns:
+            ApiKey: Ключ для запроса
+        """
+        bucket = await self.limiter.acquire_best([key.bucket for key in self._candidates()])
+        key = self._by_bucket[bucket]
+        key.requests += 1
+        return key
+    
+    def record_success(self, key: ApiKey):
+        """Учитывает успешный ответ по ключу"""
+        key.successes += 1
+        key.consecutive_failures = 0
+        self.limiter.record_success(key.bucket)
+    
+    def record_rate_limit(self, key: ApiKey):
+        """Учитывает 429 по ключу"""
+        key.rate_limited += 1
+        self.limiter.record_rate_limit(key.bucket)
+        self._record_failure(key, "429")
+    
+    def record_unauthorized(self, key: ApiKey):
+        """Учитывает 401/403 по ключу"""
+        key.unauthorized += 1
+        self._record_failure(key, "401")
+    
+    def _record_failure(self, key: ApiKey, reason: str):
+        """Переводит ключ в карантин после failure_threshold ошибок подряд"""
+        now = time.time()
+        if not key.is_active(now):
+            # Ответы на запросы, отправленные до карантина
+            return
+        
+        key.consecutive_failures += 1
+        if key.consecutive_failures >= self.failure_threshold:
+            key.consecutive_failures = 0
+            key.quarantines += 1
+            key.quarantined_until = now + self.quarantine_seconds
+            logger.warning(f"🚫 API ключ {key.label} в карантине на {self.quarantine_seconds:.0f} сек "
+                           f"(повторные ошибки {reason})")
+    
+    def get_stats(self) -> List[Dict]:
+        """Возвращает статистику по каждому ключу"""
+        now = time.time()
+        return [
+            {
+                "key": key.label,
+                "requests": key.requests,
+                "successful_requests": key.successes,
+                "rate_limited_requests": key.rate_limited,
+                "unauthorized_requests": key.unauthorized,
+                "quarantines": key.quarantines,
+                "quarantined": not key.is_active(now)
+            }
+            for key in self.keys
+        ]
+
+
+def key_pool_from_env(default_key: Optional[str] = None) -> Optional[ApiKeyPool]:
+    """
+    Создает пул из POIZON_API_KEYS (ключи через запятую)
+    
+    Args:
+        default_key: Ключ, переданный клиенту явно (добавляется в пул первым)
+    
+    Returns:
+        Optional[ApiKeyPool]: Пул, если ключей больше одного, иначе None
+            (один ключ работает как раньше - через корзины endpoint'ов)
+    """
+    keys = [k for k in os.getenv('POIZON_API_KEYS', '').split(',') if k.strip()]
+    if default_key:
+        keys.insert(0, default_key)
+    
+    if len(set(k.strip() for k in keys)) < 2:
+        return None
+    
+    key_rate = os.getenv('POIZON_KEY_RATE_LIMIT')
+    return ApiKeyPool(keys, requests_per_second=float(key_rate) if key_rate else None)
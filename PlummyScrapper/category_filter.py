@@ -3,11 +3,64 @@
 """
 import json
 import logging
-from typing import List, Tuple
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, Hashable, List, Tuple
 
 logger = logging.getLogger(__name__)
 
 
+# Сколько различных наборов категорий помнит кэш (у товаров их несколько сотен)
+MEMO_SIZE = 1024
+
+# Признак отсутствия значения в кэше
+_MISSING = object()
+
+
+class LruMemo:
+    """Ограниченный LRU-кэш результатов со счетчиками попаданий"""
+    
+    def __init__(self, maxsize: int = MEMO_SIZE):
+        """
+        Args:
+            maxsize: Максимальное количество записей
+        """
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key: Hashable) -> Any:
+        """Возвращает значение или _MISSING"""
+        value = self._data.get(key, _MISSING)
+        if value is _MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._data.move_to_end(key)
+        return value
+    
+    def put(self, key: Hashable, value: Any):
+        """Сохраняет значение, вытесняя самое давнее"""
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+    
+    def clear(self):
+        """Очищает кэш (счетчики сохраняются)"""
+        self._data.clear()
+    
+    def get_stats(self) -> Dict:
+        """Возвращает статистику кэша"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate_percent": (self.hits / lookups * 100) if lookups else 0.0
+        }
+
+
 class CategoryFilter:
     """Фильтр категорий по размерам товара"""
     
@@ -45,16 +98,26 @@ class CategoryFilter:
         self.categories_file = categories_file
         self.categories_tree = []
         self.categories_flat = {}  # {id: {name, slug, parent, ...}}
+        self.ancestors: Dict[int, FrozenSet[int]] = {}  # {id: все предки категории}
+        # Результаты filter_categories и get_size_attribute_id по наборам категорий
+        self.filter_memo = LruMemo()
+        self.size_attribute_memo = LruMemo()
         self.load_categories()
     
     def load_categories(self):
         """Загружает категории из файла"""
+        # Запомненные результаты зависят от дерева категорий
+        self.filter_memo.clear()
+        self.size_attribute_memo.clear()
+        
         try:
             with open(self.categories_file, 'r', encoding='utf-8') as f:
                 self.categories_tree = json.load(f)
             
-            # Создаем плоский словарь категорий
+            # Создаем плоский словарь категорий (заново - при перезагрузке старые не остаются)
+            self.categories_flat = {}
             self._flatten_categories(self.categories_tree)
+            self.ancestors = self._build_ancestors()
             
             logger.info(f"✅ Загружено {len(self.categories_flat)} категорий для фильтрации")
             
@@ -62,10 +125,12 @@ class CategoryFilter:
             logger.warning(f"⚠️  Файл {self.categories_file} не найден")
             self.categories_tree = []
             self.categories_flat = {}
+            self.ancestors = {}
         except Exception as e:
             logger.error(f"❌ Ошибка загрузки категорий: {e}")
             self.categories_tree = []
             self.categories_flat = {}
+            self.ancestors = {}
     
     def _flatten_categories(self, cats, result=None):
         """Рекурсивно создает плоский словарь категорий"""
@@ -83,6 +148,40 @@ class CategoryFilter:
         
         return result
     
+    def _build_ancestors(self) -> Dict[int, FrozenSet[int]]:
+        """
+        Строит транзитивное замыкание дерева: для каждой категории - множество всех предков
+        
+        Цепочка родителей идет до корня (0 входит в предков) или до родителя, которого
+        нет в файле (он входит в предков, дальше цепочка обрывается). Цикл в дереве
+        обрывает цепочку на повторной категории.
+        
+        Returns:
+            Dict[int, FrozenSet[int]]: {id категории: предки}
+        """
+        ancestors = {}
+        for category_id in self.categories_flat:
+            chain = []
+            current = category_id
+            while True:
+                if current in ancestors:
+                    # Предки дальше по цепочке уже посчитаны
+                    chain_set = set(chain) | ancestors[current]
+                    break
+                parent = self.categories_flat[current]['parent']
+                if parent == category_id or parent in chain:
+                    logger.warning(f"⚠️  Цикл в дереве категорий на категории {current}")
+                    chain_set = set(chain)
+                    chain_set.add(parent)
+                    break
+                chain.append(parent)
+                if parent == 0 or parent not in self.categories_flat:
+                    chain_set = set(chain)
+                    break
+                current = parent
+            ancestors[category_id] = frozenset(chain_set)
+        return ancestors
+    
     def is_child_of(self, category_id: int, parent_id: int) -> bool:
         """
         Проверяет является ли категория ребенком указанного родителя
@@ -94,19 +193,8 @@ class CategoryFilter:
         Returns:
             bool: True если category_id является ребенком parent_id
         """
-        if category_id not in self.categories_flat:
-            return False
-        
-        # Проверяем прямого родителя
-        cat = self.categories_flat[category_id]
-        if cat['parent'] == parent_id:
-            return True
-        
-        # Проверяем родителя родителя (рекурсивно)
-        if cat['parent'] != 0:
-            return self.is_child_of(cat['parent'], parent_id)
-        
-        return False
+        ancestors = self.ancestors.get(category_id)
+        return ancestors is not None and parent_id in ancestors
     
     def is_shoe_category(self, category_id: int) -> bool:
         """
@@ -118,10 +206,11 @@ class CategoryFilter:
         Returns:
             bool: True если это категория обуви (дочерняя для 101 или 102)
         """
-        return self.is_child_of(category_id, self.MEN_PARENT_ID) or \
-               self.is_child_of(category_id, self.WOMEN_PARENT_ID) or \
-               category_id == self.MEN_PARENT_ID or \
-               category_id == self.WOMEN_PARENT_ID
+        if category_id == self.MEN_PARENT_ID or category_id == self.WOMEN_PARENT_ID:
+            return True
+        ancestors = self.ancestors.get(category_id)
+        return ancestors is not None and \
+            (self.MEN_PARENT_ID in ancestors or self.WOMEN_PARENT_ID in ancestors)
     
     def is_one_size_category(self, category_id: int) -> bool:
         """
@@ -157,6 +246,17 @@ class CategoryFilter:
         Returns:
             int: 4 для обуви (pa_shoe_size), 5 для одежды (pa_clothing_size)
         """
+        key = tuple(category_ids)
+        cached = self.size_attribute_memo.get(key)
+        if cached is not _MISSING:
+            return cached
+        
+        attribute_id = self._compute_size_attribute_id(category_ids)
+        self.size_attribute_memo.put(key, attribute_id)
+        return attribute_id
+    
+    def _compute_size_attribute_id(self, category_ids: List[int]) -> int:
+        """Определяет ID атрибута размера без кэша (см. get_size_attribute_id)"""
         # Проверяем является ли хотя бы одна категория обувной
         for cat_id in category_ids:
             if self.is_shoe_category(cat_id):
@@ -219,6 +319,20 @@ class CategoryFilter:
             logger.info(f"ℹ️  Товар не обувь (type={size_type}), фильтрация категорий пропущена")
             return category_ids
         
+        # Результат зависит только от набора категорий и того, есть ли женские/мужские размеры
+        has_women, has_men = self.analyze_sizes(sizes)
+        key = (tuple(category_ids), size_type, has_women, has_men)
+        cached = self.filter_memo.get(key)
+        if cached is not _MISSING:
+            logger.debug(f"📂 Категории {category_ids} → {cached} (из кэша)")
+            return list(cached)
+        
+        result = self._compute_filtered_categories(category_ids, has_women, has_men)
+        self.filter_memo.put(key, tuple(result))
+        return result
+    
+    def _compute_filtered_categories(self, category_ids: List[int], has_women: bool, has_men: bool) -> List[int]:
+        """Фильтрует категории обуви по результату analyze_sizes без кэша (см. filter_categories)"""
         # Разделяем категории на группы
         men_categories = []      # Дети категории 101 (Обувь мужская)
         women_categories = []    # Дети категории 102 (Обувь женская)
@@ -232,9 +346,6 @@ class CategoryFilter:
             else:
                 other_categories.append(cat_id)
         
-        # Анализируем размеры
-        has_women, has_men = self.analyze_sizes(sizes)
-        
         logger.info(f"📏 Анализ размеров: женские≤39={has_women}, мужские≥39.5={has_men}")
         logger.info(f"📂 Категории: мужские(101)={len(men_categories)}, женские(102)={len(women_categories)}, остальные={len(other_categories)}")
         
@@ -268,6 +379,13 @@ class CategoryFilter:
             logger.info(f"⚠️  Нет числовых размеров для анализа, оставляем все категории")
         
         return result
+    
+    def get_cache_stats(self) -> Dict:
+        """Возвращает статистику кэшей filter_categories и get_size_attribute_id"""
+        return {
+            "filter_categories": self.filter_memo.get_stats(),
+            "size_attribute": self.size_attribute_memo.get_stats()
+        }
 
 
 # Глобальный экземпляр фильтра
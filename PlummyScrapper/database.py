@@ -2,11 +2,14 @@
 Модель базы данных для PlummyScraper
 Центральное хранилище товаров с SQLAlchemy
 """
-from sqlalchemy import create_engine, Column, Integer, String, Text, Boolean, DECIMAL, DateTime, ForeignKey, Enum, JSON, Index
+from sqlalchemy import create_engine, Column, Integer, String, Text, Boolean, DECIMAL, DateTime, ForeignKey, Enum, JSON, Index, inspect, text
+from sqlalchemy import select, insert, update, delete, bindparam
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm.attributes import flag_modified
 from datetime import datetime
-from typing import Optional, Dict
+from decimal import Decimal
+from typing import Optional, Dict, List, Tuple
 import enum
 import logging
 
@@ -14,6 +17,9 @@ logger = logging.getLogger(__name__)
 
 Base = declarative_base()
 
+# Товаров в одной транзакции пакетной записи
+BULK_CHUNK_SIZE = 500
+
 
 class SizeType(enum.Enum):
     """Тип размера"""
@@ -61,10 +67,13 @@ class Product(Base):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     is_active = Column(Boolean, default=True)
     data_loaded = Column(Boolean, default=False)  # Флаг: загружены ли данные из API
+    payload_hash = Column(String(64))  # Отпечаток ответа API, по которому записаны данные (payload_fingerprint)
     
     # Связи
     variants = relationship("ProductVariant", back_populates="product", cascade="all, delete-orphan")
     sync_logs = relationship("WpSyncLog", back_populates="product", cascade="all, delete-orphan")
+    wp_mapping = relationship("ProductWpMapping", back_populates="product", uselist=False,
+                              cascade="all, delete-orphan")
     
     def __repr__(self):
         sku_part = f", sku={self.reference_sku_id}" if self.reference_sku_id else ""
@@ -82,6 +91,7 @@ class ProductVariant(Base):
     size_type = Column(Enum(SizeType), nullable=False)
     price_cny = Column(DECIMAL(10, 2))  # Цена в юанях
     price_rub = Column(DECIMAL(10, 2))  # Цена в рублях
+    formula_version = Column(String(16))  # Версия набора формул, по которой посчитана price_rub
     is_available = Column(Boolean, default=True)
     stock_status = Column(Integer, default=1)  # 1 = в наличии
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -129,6 +139,131 @@ class WpSyncLog(Base):
         return f"<WpSyncLog(id={self.id}, product_id={self.product_id}, action={self.action}, status={self.sync_status})>"
 
 
+class ProductWpMapping(Base):
+    """
+    Текущий товар WordPress для товара БД (по последней успешной синхронизации)
+    
+    Поддерживается вместе с wp_sync_log в add_sync_log, чтобы поиск WP ID не
+    зависел от размера истории синхронизаций.
+    """
+    __tablename__ = 'product_wp_mapping'
+    
+    product_id = Column(Integer, ForeignKey('products.id'), primary_key=True)
+    wp_product_id = Column(Integer, index=True)  # ID товара в WordPress
+    synced_hash = Column(String(64))  # payload_hash товара на момент синхронизации
+    synced_at = Column(DateTime, default=datetime.utcnow)
+    
+    # Связь с товаром
+    product = relationship("Product", back_populates="wp_mapping")
+    
+    def __repr__(self):
+        return f"<ProductWpMapping(product_id={self.product_id}, wp_product_id={self.wp_product_id})>"
+
+
+# Поля варианта, которые приходят из разбора (ProductProcessor) и сравниваются при сверке
+VARIANT_FIELDS = ('sku_id', 'size_eu', 'size_type', 'price_cny', 'price_rub', 'is_available', 'stock_status')
+
+
+def _money(value) -> Optional[Decimal]:
+    """Цена в том виде, в каком ее хранит DECIMAL(10, 2)"""
+    if value is None:
+        return None
+    return Decimal(f"{float(value):.2f}")
+
+
+def _variant_values(variant_data: dict) -> Dict:
+    """Значения полей варианта из разобранных данных (как в add_product)"""
+    sku_id = variant_data.get('sku_id')
+    return {
+        'sku_id': str(sku_id) if sku_id is not None else None,
+        'size_eu': variant_data['size_eu'],
+        'size_type': SizeType(variant_data['size_type']),
+        'price_cny': variant_data.get('price_cny'),
+        'price_rub': variant_data['price_rub'],
+        'formula_version': variant_data.get('formula_version'),
+        'is_available': variant_data.get('is_available', True),
+        'stock_status': variant_data.get('stock_status', 1)
+    }
+
+
+def _changed_fields(current, values: Dict) -> Dict:
+    """Поля, значения которых у существующего варианта отличаются от новых"""
+    changed = {}
+    for name in VARIANT_FIELDS:
+        old, new = getattr(current, name), values[name]
+        if name in ('price_cny', 'price_rub'):
+            differs = _money(old) != _money(new)
+        elif name in ('sku_id', 'size_eu'):
+            differs = (str(old) if old is not None else None) != (str(new) if new is not None else None)
+        else:
+            differs = old != new
+        if differs:
+            changed[name] = new
+    return changed
+
+
+def diff_variants(current: list, new_variants: List[Dict]) -> Tuple[List[Tuple], List[Dict], list, List[Tuple]]:
+    """
+    Сопоставляет варианты из БД с новыми: по sku_id, а оставшиеся новые варианты -
+    по size_eu со старыми строками без sku_id
+    
+    Версия формул (formula_version) изменением варианта не считается: если отличается
+    только она, вариант попадает в retagged.
+    
+    Args:
+        current: Существующие варианты (ProductVariant или строки с теми же полями и id)
+        new_variants: Варианты из parse_product_detail
+        
+    Returns:
+        Tuple: (changed - [(вариант, {поле: новое значение})], added - [значения полей новых
+            вариантов], removed - [варианты, которых больше нет], retagged - [(вариант,
+            новая версия формул)])
+    """
+    by_sku, by_size = {}, {}
+    for variant in current:
+        if variant.sku_id:
+            by_sku.setdefault(str(variant.sku_id), []).append(variant)
+        else:
+            # По размеру сопоставляются только старые строки без sku_id
+            by_size.setdefault(str(variant.size_eu), []).append(variant)
+    
+    matched = set()
+    
+    def take(candidates):
+        for variant in candidates or ():
+            if variant.id not in matched:
+                matched.add(variant.id)
+                return variant
+        return None
+    
+    # Сначала все новые варианты сопоставляются по sku_id, затем оставшиеся - по size_eu
+    # (иначе новый SKU мог бы занять по размеру строку SKU, который идет в списке позже)
+    new_values = [_variant_values(variant_data) for variant_data in new_variants]
+    pairs = [take(by_sku.get(values['sku_id'])) if values['sku_id'] is not None else None
+             for values in new_values]
+    pairs = [variant if variant is not None else take(by_size.get(str(values['size_eu'])))
+             for values, variant in zip(new_values, pairs)]
+    
+    changed, added, retagged = [], [], []
+    for values, variant in zip(new_values, pairs):
+        if variant is None:
+            added.append(values)
+            continue
+        fields = _changed_fields(variant, values)
+        version = values['formula_version']
+        version_differs = version is not None and variant.formula_version != version
+        if 'price_rub' in fields or (fields and version_differs):
+            # Цена посчитана заново - версия та, по которой она посчитана (None - неизвестна)
+            fields['formula_version'] = version
+        if fields:
+            changed.append((variant, fields))
+        elif version_differs:
+            retagged.append((variant, version))
+    
+    removed = [variant for variant in current if variant.id not in matched]
+    return changed, added, removed, retagged
+
+
 class Database:
     """Класс для работы с базой данных"""
     
@@ -147,9 +282,74 @@ class Database:
     
     def create_tables(self):
         """Создает все таблицы в базе данных"""
+        existing_tables = set(inspect(self.engine).get_table_names())
         Base.metadata.create_all(self.engine)
+        self._ensure_columns()
+        if ProductWpMapping.__tablename__ not in existing_tables and WpSyncLog.__tablename__ in existing_tables:
+            self._backfill_wp_mapping()
         logger.info("Таблицы базы данных созданы")
     
+    def _ensure_columns(self):
+        """
+        Добавляет в существующие таблицы колонки, появившиеся в моделях позже
+        
+        create_all создает только отсутствующие таблицы, поэтому новые
+        nullable-колонки добавляются через ALTER TABLE ... ADD COLUMN.
+        """
+        inspector = inspect(self.engine)
+        existing_tables = set(inspector.get_table_names())
+        
+        with self.engine.begin() as conn:
+            for table in Base.metadata.sorted_tables:
+                if table.name not in existing_tables:
+                    continue
+                
+                existing_columns = {c['name'] for c in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name in existing_columns or not column.nullable:
+                        continue
+                    
+                    column_type = column.type.compile(dialect=self.engine.dialect)
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                    logger.info(f"🛠️  Добавлена колонка {table.name}.{column.name} ({column_type})")
+    
+    def _backfill_wp_mapping(self):
+        """
+        Заполняет product_wp_mapping по истории wp_sync_log (один раз, при создании таблицы)
+        
+        Для каждого товара берется последняя успешная синхронизация, как раньше
+        в get_wp_id_for_product.
+        """
+        session = self.get_session()
+        try:
+            product_ids = {row.id for row in session.execute(select(Product.id))}
+            mapping = {}
+            for log in session.execute(
+                select(WpSyncLog.product_id, WpSyncLog.wp_product_id, WpSyncLog.synced_at)
+                .where(WpSyncLog.sync_status == SyncStatus.success)
+                .order_by(WpSyncLog.synced_at, WpSyncLog.id)
+            ):
+                if log.product_id not in product_ids:
+                    continue
+                previous = mapping.get(log.product_id)
+                mapping[log.product_id] = {
+                    'product_id': log.product_id,
+                    # Успех без WP ID не затирает известный ID
+                    'wp_product_id': log.wp_product_id if log.wp_product_id is not None
+                    else (previous['wp_product_id'] if previous else None),
+                    'synced_at': log.synced_at
+                }
+            
+            if mapping:
+                session.execute(insert(ProductWpMapping.__table__), list(mapping.values()))
+            session.commit()
+            logger.info(f"🛠️  Таблица product_wp_mapping заполнена по истории синхронизаций: {len(mapping)} товаров")
+        except Exception as e:
+            session.rollback()
+            logger.error(f"❌ Ошибка заполнения product_wp_mapping: {e}")
+        finally:
+            session.close()
+    
     def get_session(self):
         """Возвращает новую сессию базы данных"""
         return self.Session()
@@ -276,7 +476,48 @@ class Database:
         finally:
             session.close()
     
-    def add_product(self, product_data: dict, reference_sku_id: str = None, category_ids: list = None):
+    def get_payload_hash(self, spu_id: str, reference_sku_id: str = None) -> Optional[str]:
+        """
+        Возвращает отпечаток ответа API, по которому записаны данные товара
+        
+        Args:
+            spu_id: SPU ID товара
+            reference_sku_id: SKU ID товара (опционально)
+            
+        Returns:
+            Optional[str]: Отпечаток или None (товара нет, данные не загружены или
+                записаны без отпечатка)
+        """
+        session = self.get_session()
+        try:
+            row = session.query(Product.payload_hash).filter(
+                Product.spu_id == spu_id,
+                Product.reference_sku_id == (reference_sku_id or None),
+                Product.data_loaded == True
+            ).first()
+            return row.payload_hash if row else None
+        finally:
+            session.close()
+    
+    def is_payload_unchanged(self, spu_id: str, reference_sku_id: str, payload_hash: str) -> bool:
+        """
+        Проверяет, записан ли товар по ответу API с тем же отпечатком
+        
+        Если да, разбор и запись в БД можно пропустить: updated_at не меняется,
+        и товар не попадает в get_products_needing_sync.
+        
+        Args:
+            spu_id: SPU ID товара
+            reference_sku_id: SKU ID товара (опционально)
+            payload_hash: Отпечаток нового ответа API (payload_fingerprint)
+            
+        Returns:
+            bool: True - данные товара не изменились
+        """
+        return payload_hash is not None and self.get_payload_hash(spu_id, reference_sku_id) == payload_hash
+    
+    def add_product(self, product_data: dict, reference_sku_id: str = None, category_ids: list = None,
+                    payload_hash: str = None):
         """
         Добавляет новый товар в базу данных
         
@@ -284,11 +525,12 @@ class Database:
             product_data: Данные товара
             reference_sku_id: SKU ID для идентификации конкретного варианта (цвета)
             category_ids: Список ID категорий WooCommerce для фильтрации
+            payload_hash: Отпечаток ответа API, из которого получены данные
         
         Returns:
             Product: Созданный товар
         """
-        from category_filter import CategoryFilter
+        from category_filter import filter_categories_by_sizes
         
         session = self.get_session()
         try:
@@ -304,8 +546,7 @@ class Database:
                 
                 if size_type == 'shoes' and sizes:
                     # Применяем фильтр только для обуви
-                    filter = CategoryFilter()
-                    filtered_category_ids = filter.filter_categories(category_ids, sizes, size_type)
+                    filtered_category_ids = filter_categories_by_sizes(category_ids, sizes, size_type)
                     
                     if filtered_category_ids != category_ids:
                         logger.info(f"📂 Категории отфильтрованы по размерам:")
@@ -329,7 +570,8 @@ class Database:
                 main_image_url=product_data.get('main_image_url'),
                 images=product_data.get('images', []),
                 is_active=product_data.get('is_active', True),
-                data_loaded=True  # Данные загружены из API
+                data_loaded=True,  # Данные загружены из API
+                payload_hash=payload_hash
             )
             
             # Добавляем варианты (размеры)
@@ -340,6 +582,7 @@ class Database:
                     size_type=SizeType(variant_data['size_type']),
                     price_cny=variant_data.get('price_cny'),
                     price_rub=variant_data['price_rub'],
+                    formula_version=variant_data.get('formula_version'),
                     is_available=variant_data.get('is_available', True),
                     stock_status=variant_data.get('stock_status', 1)
                 )
@@ -362,18 +605,55 @@ class Database:
         finally:
             session.close()
     
-    def load_product_data(self, product_id: int, product_data: dict):
+    def _reconcile_variants(self, session, product: 'Product', new_variants: List[Dict]) -> Dict[str, int]:
+        """
+        Приводит варианты товара к новым данным без удаления и повторной вставки всех строк
+        
+        Изменившиеся варианты обновляются на месте (их updated_at меняется только
+        при реальном изменении), новые добавляются, исчезнувшие удаляются.
+        
+        Args:
+            session: Сессия, в которой загружен product
+            product: Товар
+            new_variants: Варианты из parse_product_detail
+            
+        Returns:
+            Dict[str, int]: {'updated': int, 'added': int, 'removed': int, 'unchanged': int}
+        """
+        current = session.query(ProductVariant).filter_by(product_id=product.id).all()
+        changed, added, removed, retagged = diff_variants(current, new_variants)
+        
+        for variant, fields in changed:
+            for name, value in fields.items():
+                setattr(variant, name, value)
+        for variant, version in retagged:
+            # Цена та же, но уже посчитана по текущим формулам - товар не считается измененным
+            variant.formula_version = version
+        for values in added:
+            session.add(ProductVariant(product_id=product.id, **values))
+        for variant in removed:
+            session.delete(variant)
+        
+        return {
+            'updated': len(changed),
+            'added': len(added),
+            'removed': len(removed),
+            'unchanged': len(current) - len(changed) - len(removed)
+        }
+    
+    def load_product_data(self, product_id: int, product_data: dict, payload_hash: str = None):
         """
         Загружает данные для товара-заглушки (где data_loaded=False)
         
         Args:
             product_id: ID товара в БД
             product_data: Полные данные товара из API
+            payload_hash: Отпечаток ответа API, из которого получены данные
             
         Returns:
             bool: True если успешно, False если ошибка
         """
-        from category_filter import CategoryFilter
+        from category_filter import filter_categories_by_sizes
         
         session = self.get_session()
         try:
@@ -395,10 +675,9 @@ class Database:
                 size_type = product_data['variants'][0].get('size_type', 'shoes')
                 
                 if size_type == 'shoes' and sizes:
-                    filter = CategoryFilter()
                     # Передаем category_ids как int
                     category_ids_int = [int(cid) for cid in product.category_ids]
-                    filtered_category_ids = filter.filter_categories(category_ids_int, sizes, size_type)
+                    filtered_category_ids = filter_categories_by_sizes(category_ids_int, sizes, size_type)
                     
                     if filtered_category_ids != product.category_ids:
                         logger.info(f"📂 Категории отфильтрованы по размерам для товара {product.spu_id}:")
@@ -417,25 +696,14 @@ class Database:
             product.images = product_data.get('images', [])
             product.is_active = product_data.get('is_active', True)
             product.data_loaded = True  # ✅ Данные загружены!
+            product.payload_hash = payload_hash
             
-            # Удаляем старые варианты (если были) и добавляем новые
-            session.query(ProductVariant).filter_by(product_id=product.id).delete()
-            
-            for variant_data in product_data.get('variants', []):
-                variant = ProductVariant(
-                    product_id=product.id,
-                    sku_id=variant_data.get('sku_id'),  # Сохраняем SKU ID
-                    size_eu=variant_data['size_eu'],
-                    size_type=SizeType(variant_data['size_type']),
-                    price_cny=variant_data.get('price_cny'),
-                    price_rub=variant_data['price_rub'],
-                    is_available=variant_data.get('is_available', True),
-                    stock_status=variant_data.get('stock_status', 1)
-                )
-                session.add(variant)
+            # Сверяем варианты (если были) с новыми
+            counts = self._reconcile_variants(session, product, product_data.get('variants', []))
             
             session.commit()
-            logger.info(f"✅ Данные загружены для товара {product.spu_id} (ID: {product.id})")
+            logger.info(f"✅ Данные загружены для товара {product.spu_id} (ID: {product.id}), варианты: "
+                        f"+{counts['added']} ~{counts['updated']} -{counts['removed']}")
             return True
             
         except Exception as e:
@@ -447,14 +715,19 @@ class Database:
         finally:
             session.close()
     
-    def update_product(self, spu_id: str, product_data: dict, reference_sku_id: str = None):
+    def update_product(self, spu_id: str, product_data: dict, reference_sku_id: str = None,
+                       payload_hash: str = None):
         """
         Обновляет существующий товар
         
+        updated_at товара меняется только если изменились его поля или варианты.
+        
         Args:
             spu_id: SPU ID товара
             product_data: Новые данные товара
             reference_sku_id: SKU ID для идентификации (если None, берется из product_data)
+            payload_hash: Отпечаток ответа API, из которого получены данные
+                (None - отпечаток сбрасывается, следующее обновление товара будет полным)
         """
         session = self.get_session()
         try:
@@ -478,32 +751,35 @@ class Database:
                 logger.warning(f"Товар {spu_id}{sku_info} не найден в БД")
                 return None
             
-            # Обновляем поля товара (НЕ обновляем category_ids - они установлены при добавлении!)
+            # Обновляем поля товара (НЕ обновляем category_ids и category_id - это категории
+            # WooCommerce, они установлены при добавлении; в product_data category_id - категория Dewu!)
+            # Присваивание того же значения не считается изменением
             for key, value in product_data.items():
-                if key not in ['variants', 'spu_id', 'reference_sku_id', 'category_ids']:
+                if key not in ['variants', 'spu_id', 'reference_sku_id', 'category_ids', 'category_id']:
                     setattr(product, key, value)
+            changed = session.is_modified(product)
             
-            product.updated_at = datetime.utcnow()
-            
-            # Удаляем старые варианты и добавляем новые
+            # Сверяем варианты с новыми
             if 'variants' in product_data:
-                session.query(ProductVariant).filter_by(product_id=product.id).delete()
-                
-                for variant_data in product_data['variants']:
-                    variant = ProductVariant(
-                        product_id=product.id,
-                        sku_id=variant_data.get('sku_id'),  # Сохраняем SKU ID
-                        size_eu=variant_data['size_eu'],
-                        size_type=SizeType(variant_data['size_type']),
-                        price_cny=variant_data.get('price_cny'),
-                        price_rub=variant_data['price_rub'],
-                        is_available=variant_data.get('is_available', True),
-                        stock_status=variant_data.get('stock_status', 1)
-                    )
-                    session.add(variant)
+                counts = self._reconcile_variants(session, product, product_data['variants'])
+                changed = changed or counts['updated'] or counts['added'] or counts['removed']
+            else:
+                counts = None
+            
+            if changed:
+                product.updated_at = datetime.utcnow()
+            product.payload_hash = payload_hash
+            if not changed and session.is_modified(product):
+                # Изменился только отпечаток - сохраняем прежний updated_at (иначе сработает
+                # onupdate), чтобы товар не ушел в синхронизацию
+                flag_modified(product, 'updated_at')
             
             session.commit()
-            logger.info(f"Товар обновлен в БД: {spu_id}")
+            if counts:
+                logger.info(f"Товар обновлен в БД: {spu_id}, варианты: +{counts['added']} "
+                            f"~{counts['updated']} -{counts['removed']} ={counts['unchanged']}")
+            else:
+                logger.info(f"Товар обновлен в БД: {spu_id}")
             return product
             
         except Exception as e:
@@ -513,6 +789,277 @@ class Database:
         finally:
             session.close()
     
+    def _upsert_statement(self, table, update_columns: List[str]):
+        """
+        INSERT ... ON CONFLICT (spu_id, reference_sku_id) DO UPDATE для SQLite/PostgreSQL
+        
+        Для других СУБД возвращает обычный INSERT (конфликтов нет - строки отобраны
+        по предварительной выборке существующих).
+        """
+        dialect = self.engine.dialect.name
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        elif dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            return insert(table)
+        
+        stmt = dialect_insert(table)
+        return stmt.on_conflict_do_update(
+            index_elements=['spu_id', 'reference_sku_id'],
+            set_={name: stmt.excluded[name] for name in update_columns}
+        )
+    
+    @staticmethod
+    def _variant_rows(product_id: int, variants: List[Dict], now: datetime) -> List[Dict]:
+        """Строки product_variants для executemany (те же поля, что в add_product)"""
+        return [{**_variant_values(variant_data), 'product_id': product_id, 'created_at': now, 'updated_at': now}
+                for variant_data in variants]
+    
+    def bulk_upsert_products(self, products: List[Dict], chunk_size: int = BULK_CHUNK_SIZE) -> Dict[str, int]:
+        """
+        Записывает много разобранных товаров пачками: одна транзакция на пачку
+        
+        Существующие товары (в том числе заглушки) обновляются по первичному ключу
+        одним executemany, новые вставляются INSERT ... ON CONFLICT (spu_id, reference_sku_id).
+        Варианты сверяются с существующими (diff_variants) и пишутся executemany на пачку.
+        Товары без изменений не пишутся, их updated_at не меняется.
+        
+        Поля как в add_product / load_product_data: категории обуви фильтруются по
+        размерам для новых товаров и заглушек; у уже загруженных товаров category_ids
+        и category_id не меняются (как в update_product).
+        
+        Args:
+            products: Результаты parse_product_detail; дополнительно могут содержать
+                'reference_sku_id', 'category_ids' (для новых товаров) и 'payload_hash'
+            chunk_size: Товаров в одной транзакции
+            
+        Returns:
+            Dict[str, int]: {'inserted', 'updated', 'unchanged', 'variants_added',
+                'variants_updated', 'variants_removed'}
+        """
+        from category_filter import filter_categories_by_sizes
+        
+        stats = {'inserted': 0, 'updated': 0, 'unchanged': 0,
+                 'variants_added': 0, 'variants_updated': 0, 'variants_removed': 0}
+        compared_columns = ['title', 'brand', 'category', 'category_id', 'category_ids', 'description',
+                            'article_number', 'main_image_url', 'images', 'is_active', 'data_loaded']
+        product_columns = compared_columns + ['payload_hash', 'updated_at']
+        variants_table = ProductVariant.__table__
+        
+        session = self.get_session()
+        try:
+            for start in range(0, len(products), chunk_size):
+                chunk = products[start:start + chunk_size]
+                now = datetime.utcnow()
+                
+                # Одна выборка существующих товаров пачки
+                existing = {}
+                spu_ids = list({str(p['spu_id']) for p in chunk})
+                for row in session.execute(
+                    select(Product.id, Product.spu_id, Product.reference_sku_id, Product.payload_hash,
+                           Product.updated_at, *(getattr(Product, name) for name in compared_columns))
+                    .where(Product.spu_id.in_(spu_ids))
+                ):
+                    existing[(row.spu_id, row.reference_sku_id)] = row
+                
+                # Одна выборка вариантов существующих товаров
+                current_variants = {}
+                if existing:
+                    for variant in session.execute(
+                        select(ProductVariant.id, ProductVariant.product_id, ProductVariant.formula_version,
+                               *(getattr(ProductVariant, name) for name in VARIANT_FIELDS))
+                        .where(ProductVariant.product_id.in_([row.id for row in existing.values()]))
+                    ):
+                        current_variants.setdefault(variant.product_id, []).append(variant)
+                
+                updates, inserts, new_variants = [], {}, {}
+                variant_updates, variant_inserts, variant_deletes, variant_retags = [], [], [], []
+                for product_data in chunk:
+                    # spu_id / SKU из API бывают числами, в БД - строки
+                    sku_id = product_data.get('reference_sku_id')
+                    sku_id = str(sku_id) if sku_id else None
+                    key = (str(product_data['spu_id']), sku_id)
+                    row = existing.get(key)
+                    variants = product_data.get('variants', [])
+                    
+                    if row is not None and row.data_loaded:
+                        # Уже загруженный товар - категории не трогаем (как в update_product)
+                        category_ids = row.category_ids or []
+                        category_id = row.category_id
+                    else:
+                        if row is not None:
+                            category_ids = [int(cid) for cid in (row.category_ids or [])]
+                        else:
+                            category_ids = product_data.get('category_ids') or []
+                        if category_ids and variants:
+                            sizes = [v['size_eu'] for v in variants]
+                            size_type = variants[0].get('size_type', 'shoes')
+                            if size_type == 'shoes' and sizes:
+                                category_ids = filter_categories_by_sizes(category_ids, sizes, size_type)
+                        category_id = category_ids[0] if category_ids else product_data.get('category_id')
+                    
+                    values = {
+                        'title': product_data['title'],
+                        'brand': product_data.get('brand'),
+                        'category': product_data.get('category'),
+                        'category_id': category_id,
+                        'category_ids': category_ids,
+                        'description': product_data.get('description'),
+                        'article_number': product_data.get('article_number'),
+                        'main_image_url': product_data.get('main_image_url'),
+                        'images': product_data.get('images', []),
+                        'is_active': product_data.get('is_active', True),
+                        'data_loaded': True,
+                        'payload_hash': product_data.get('payload_hash'),
+                        'updated_at': now
+                    }
+                    
+                    if row is None:
+                        # Повтор одного товара в пачке - остается последняя версия
+                        values.update({'spu_id': key[0], 'reference_sku_id': sku_id, 'created_at': now})
+                        inserts[key] = values
+                        new_variants[key] = variants
+                        continue
+                    
+                    changed, added, removed, retagged = diff_variants(current_variants.get(row.id, []), variants)
+                    for variant, fields in changed:
+                        variant_values = {name: fields.get(name, getattr(variant, name))
+                                          for name in VARIANT_FIELDS + ('formula_version',)}
+                        variant_values.update({'_id': variant.id, 'updated_at': now})
+                        variant_updates.append(variant_values)
+                    variant_retags.extend({'_id': variant.id, 'formula_version': version}
+                                          for variant, version in retagged)
+                    variant_inserts.extend({**v, 'product_id': row.id, 'created_at': now, 'updated_at': now}
+                                           for v in added)
+                    variant_deletes.extend(variant.id for variant in removed)
+                    
+                    product_changed = changed or added or removed or \
+                        any(getattr(row, name) != values[name] for name in compared_columns)
+                    if product_changed:
+                        stats['updated'] += 1
+                    elif row.payload_hash != values['payload_hash']:
+                        # Изменился только отпечаток - updated_at оставляем прежним
+                        values['updated_at'] = row.updated_at
+                    else:
+                        stats['unchanged'] += 1
+                        continue
+                    values['_id'] = row.id
+                    updates.append(values)
+                
+                if updates:
+                    session.execute(
+                        update(Product.__table__).where(Product.__table__.c.id == bindparam('_id'))
+                        .values({name: bindparam(name) for name in product_columns}),
+                        updates
+                    )
+                if inserts:
+                    session.execute(self._upsert_statement(Product.__table__, product_columns),
+                                    list(inserts.values()))
+                    # id вставленных товаров - одной выборкой
+                    for row in session.execute(
+                        select(Product.id, Product.spu_id, Product.reference_sku_id)
+                        .where(Product.spu_id.in_(list({key[0] for key in inserts})))
+                    ):
+                        key = (row.spu_id, row.reference_sku_id)
+                        if key in new_variants:
+                            variant_inserts.extend(self._variant_rows(row.id, new_variants[key], now))
+                
+                # Изменения вариантов: по одному executemany на обновление, вставку и удаление
+                if variant_updates:
+                    session.execute(
+                        update(variants_table).where(variants_table.c.id == bindparam('_id'))
+                        .values({name: bindparam(name)
+                                 for name in VARIANT_FIELDS + ('formula_version', 'updated_at')}),
+                        variant_updates
+                    )
+                if variant_retags:
+                    # Только версия формул (цена не изменилась) - товар измененным не считается
+                    session.execute(
+                        update(variants_table).where(variants_table.c.id == bindparam('_id'))
+                        .values(formula_version=bindparam('formula_version')),
+                        variant_retags
+                    )
+                if variant_inserts:
+                    session.execute(insert(variants_table), variant_inserts)
+                if variant_deletes:
+                    session.execute(delete(variants_table).where(variants_table.c.id.in_(variant_deletes)))
+                
+                session.commit()
+                stats['inserted'] += len(inserts)
+                stats['variants_added'] += len(variant_inserts)
+                stats['variants_updated'] += len(variant_updates)
+                stats['variants_removed'] += len(variant_deletes)
+            
+            logger.info(f"💾 Пакетная запись: новых товаров {stats['inserted']}, обновлено {stats['updated']}, "
+                        f"без изменений {stats['unchanged']}; варианты +{stats['variants_added']} "
+                        f"~{stats['variants_updated']} -{stats['variants_removed']}")
+            return stats
+            
+        except Exception as e:
+            session.rollback()
+            logger.error(f"❌ Ошибка пакетной записи товаров: {e}")
+            raise
+        finally:
+            session.close()
+    
+    def bulk_add_product_stubs(self, stubs: List[Tuple[str, Optional[str], Optional[list]]],
+                               chunk_size: int = BULK_CHUNK_SIZE) -> int:
+        """
+        Создает много заглушек товаров (как add_product_stub), пропуская существующие
+        
+        Args:
+            stubs: Список (spu_id, reference_sku_id, category_ids)
+            chunk_size: Заглушек в одной транзакции
+            
+        Returns:
+            int: Количество созданных заглушек
+        """
+        created = 0
+        session = self.get_session()
+        try:
+            for start in range(0, len(stubs), chunk_size):
+                chunk = stubs[start:start + chunk_size]
+                now = datetime.utcnow()
+                
+                # Существующие товары отсеиваем выборкой: ON CONFLICT не срабатывает
+                # при reference_sku_id = NULL (NULL не равен NULL в уникальном индексе)
+                existing = {(row.spu_id, row.reference_sku_id) for row in session.execute(
+                    select(Product.spu_id, Product.reference_sku_id)
+                    .where(Product.spu_id.in_(list({str(spu_id) for spu_id, _, _ in chunk})))
+                )}
+                
+                rows = {}
+                for spu_id, reference_sku_id, category_ids in chunk:
+                    key = (str(spu_id), str(reference_sku_id) if reference_sku_id else None)
+                    if key in existing or key in rows:
+                        continue
+                    rows[key] = {
+                        'spu_id': key[0],
+                        'reference_sku_id': key[1],
+                        'title': f"SPU {spu_id} (данные загружаются...)",
+                        'category_ids': category_ids or [],
+                        'data_loaded': False,
+                        'is_active': True,
+                        'created_at': now,
+                        'updated_at': now
+                    }
+                
+                if rows:
+                    session.execute(insert(Product.__table__), list(rows.values()))
+                session.commit()
+                created += len(rows)
+            
+            logger.info(f"Создано заглушек товаров: {created} из {len(stubs)}")
+            return created
+            
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Ошибка создания заглушек товаров: {e}")
+            raise
+        finally:
+            session.close()
+    
     def get_all_active_products(self):
         """Получает все активные товары с вариантами"""
         from sqlalchemy.orm import joinedload
@@ -535,33 +1082,59 @@ class Database:
             session.close()
     
     def get_products_needing_sync(self):
-        """Получает товары, которые нужно синхронизировать"""
+        """
+        Получает товары, которые нужно синхронизировать
+        
+        Состояние берется из product_wp_mapping (последняя успешная синхронизация),
+        история wp_sync_log не читается. Товар нужно синхронизировать, если он ни разу
+        не синхронизирован успешно, изменился после синхронизации или его отпечаток
+        отличается от синхронизированного (неизвестный отпечаток - NULL - не учитывается).
+        """
         session = self.get_session()
         try:
-            # Товары без успешной синхронизации или с обновлениями
             return session.query(Product).filter(
                 Product.is_active == True
-            ).outerjoin(WpSyncLog).filter(
-                (WpSyncLog.id.is_(None)) | 
-                (WpSyncLog.sync_status != SyncStatus.success) |
-                (Product.updated_at > WpSyncLog.synced_at)
+            ).outerjoin(ProductWpMapping).filter(
+                (ProductWpMapping.product_id.is_(None)) |
+                (Product.updated_at > ProductWpMapping.synced_at) |
+                (Product.payload_hash != ProductWpMapping.synced_hash)
             ).all()
         finally:
             session.close()
     
     def add_sync_log(self, product_id: int, wp_product_id: int, action: SyncAction, 
                      status: SyncStatus, error_message: str = None):
-        """Добавляет запись в лог синхронизации"""
+        """
+        Добавляет запись в лог синхронизации
+        
+        При успехе в той же транзакции обновляется product_wp_mapping.
+        """
         session = self.get_session()
         try:
+            now = datetime.utcnow()
             sync_log = WpSyncLog(
                 product_id=product_id,
                 wp_product_id=wp_product_id,
                 action=action,
                 sync_status=status,
-                error_message=error_message
+                error_message=error_message,
+                synced_at=now
             )
             session.add(sync_log)
+            
+            if status == SyncStatus.success:
+                mapping = session.get(ProductWpMapping, product_id)
+                if mapping is None:
+                    mapping = ProductWpMapping(product_id=product_id)
+                    session.add(mapping)
+                # Успех без WP ID не затирает известный ID
+                if wp_product_id is not None:
+                    mapping.wp_product_id = wp_product_id
+                mapping.synced_hash = session.execute(
+                    select(Product.payload_hash).where(Product.id == product_id)
+                ).scalar()
+                mapping.synced_at = now
+            
             session.commit()
             logger.debug(f"Лог синхронизации добавлен: product_id={product_id}, action={action}, status={status}")
         except Exception as e:
@@ -592,7 +1165,7 @@ class Database:
             }
         finally:
             session.close()
-
+    
     # ==================== НОВЫЕ МЕТОДЫ ДЛЯ CLI ====================
     
     def add_article(self, article_id: int, spu_id: str, sku_id: str, categories: list):
@@ -640,15 +1213,10 @@ class Database:
             }
             
             # Получаем WP ID если есть
-            wp_log = session.query(WpSyncLog).filter(
-                WpSyncLog.product_id == product.id,
-                WpSyncLog.sync_status == SyncStatus.success
-            ).first()
+            if product.wp_mapping:
+                info['wp_id'] = product.wp_mapping.wp_product_id
             
-            if wp_log:
-                info['wp_id'] = wp_log.wp_product_id
-            
-            # Удаляем товар (каскадное удаление вариантов и логов)
+            # Удаляем товар (каскадное удаление вариантов, логов и связи с WP)
             session.delete(product)
             session.commit()
             
@@ -673,12 +1241,8 @@ class Database:
         """Проверяет синхронизацию с WP"""
         session = self.Session()
         try:
-            # Проверяем наличие записи в wp_sync_log со статусом success
-            log = session.query(WpSyncLog).filter(
-                WpSyncLog.product_id == article_id,
-                WpSyncLog.sync_status == SyncStatus.success
-            ).first()
-            return log is not None
+            # Товар синхронизирован, если была успешная синхронизация
+            return session.get(ProductWpMapping, article_id) is not None
         finally:
             session.close()
     
@@ -709,9 +1273,7 @@ class Database:
         """Возвращает количество синхронизированных товаров"""
         session = self.Session()
         try:
-            return session.query(WpSyncLog).filter(
-                WpSyncLog.sync_status == SyncStatus.success
-            ).distinct(WpSyncLog.product_id).count()
+            return session.query(ProductWpMapping).count()
         finally:
             session.close()
     
@@ -727,9 +1289,7 @@ class Database:
         session = self.Session()
         try:
             # Получаем товары, у которых нет успешной синхронизации
-            synced_product_ids = session.query(WpSyncLog.product_id).filter(
-                WpSyncLog.sync_status == SyncStatus.success
-            ).distinct()
+            synced_product_ids = session.query(ProductWpMapping.product_id)
             
             # Используем joinedload для загрузки variants вместе с Product
             # Это предотвращает ошибку lazy loading после закрытия сессии
@@ -754,9 +1314,7 @@ class Database:
         
         session = self.Session()
         try:
-            synced_product_ids = session.query(WpSyncLog.product_id).filter(
-                WpSyncLog.sync_status == SyncStatus.success
-            ).distinct()
+            synced_product_ids = session.query(ProductWpMapping.product_id)
             
             # Используем joinedload для загрузки variants вместе с Product
             products = session.query(Product).options(
@@ -778,12 +1336,8 @@ class Database:
         """Возвращает WP ID для товара"""
         session = self.Session()
         try:
-            log = session.query(WpSyncLog).filter(
-                WpSyncLog.product_id == product_id,
-                WpSyncLog.sync_status == SyncStatus.success
-            ).order_by(WpSyncLog.synced_at.desc()).first()
-            
-            return log.wp_product_id if log else None
+            mapping = session.get(ProductWpMapping, product_id)
+            return mapping.wp_product_id if mapping else None
         finally:
             session.close()
     
@@ -791,12 +1345,11 @@ class Database:
         """Возвращает Product ID по WP ID"""
         session = self.Session()
         try:
-            log = session.query(WpSyncLog).filter(
-                WpSyncLog.wp_product_id == wp_id,
-                WpSyncLog.sync_status == SyncStatus.success
-            ).order_by(WpSyncLog.synced_at.desc()).first()
+            mapping = session.query(ProductWpMapping).filter(
+                ProductWpMapping.wp_product_id == wp_id
+            ).order_by(ProductWpMapping.synced_at.desc()).first()
             
-            return log.product_id if log else None
+            return mapping.product_id if mapping else None
         finally:
             session.close()
     
@@ -1005,6 +1558,11 @@ class Database:
             # Создаем маппинг текущих вариантов: sku_id -> variant
             current_variants = {str(v.sku_id): v for v in product.variants if v.sku_id}
             
+            # Все цены товара считаем по одному набору формул (он может смениться при перезагрузке)
+            from price_calculator import price_calculator
+            formula_set = price_calculator.formula_set
+            primary_category = product.category_ids[0] if product.category_ids else None
+            
             # Обрабатываем новые цены
             new_sku_ids = set()
             
@@ -1036,15 +1594,14 @@ class Database:
                 
                 # Применяем формулу для расчета RUB
                 # Используем primary_category товара
-                from price_calculator import price_calculator
-                primary_category = product.category_ids[0] if product.category_ids else None
-                price_rub = price_calculator.calculate_price(price_cny, primary_category, "21-26 дней")
+                price_rub = formula_set.calculate_price(price_cny, primary_category, "21-26 дней")
                 
                 # Если вариант уже существует - обновляем
                 if sku_id_str in current_variants:
                     variant = current_variants[sku_id_str]
                     variant.price_cny = price_cny
                     variant.price_rub = price_rub
+                    variant.formula_version = formula_set.version
                     variant.is_available = True
                     updated_count += 1
                 else:
@@ -1059,6 +1616,12 @@ class Database:
                     session.delete(variant)
                     removed_count += 1
             
+            # Варианты изменены не по полному ответу - следующий update-db должен разобрать товар заново
+            if updated_count or removed_count:
+                product.payload_hash = None
+                # updated_at товара при этом не меняется (иначе сработает onupdate)
+                flag_modified(product, 'updated_at')
+            
             session.commit()
             
             result = {
@@ -1078,6 +1641,164 @@ class Database:
         finally:
             session.close()
     
+    def update_prices_batch(self, items: List[Tuple[str, dict, Optional[str]]],
+                            chunk_size: int = BULK_CHUNK_SIZE) -> Dict[Tuple[str, Optional[str]], Optional[Dict]]:
+        """
+        Пакетный вариант update_product_prices_only для сотен товаров
+        
+        На пачку товаров: одна выборка товаров, одна выборка вариантов (по product_id, sku_id),
+        расчет цен одним вызовом calculate_prices_batch и один executemany UPDATE
+        изменившихся вариантов. Логика та же: цены обновляются у вариантов с sku_id,
+        варианты, которых нет в priceInfo, удаляются, новые не добавляются.
+        
+        Args:
+            items: Список (spu_id, price_info, reference_sku_id) - как аргументы
+                update_product_prices_only
+            chunk_size: Товаров в одной транзакции
+            
+        Returns:
+            Dict: {(spu_id, reference_sku_id): {'updated': int, 'added': int, 'removed': int,
+                'changed': int} или None, если товар не найден или пачка не записана}
+        """
+        from price_calculator import price_calculator
+        
+        # Повтор одного товара - остается последний priceInfo
+        requests = {}
+        for spu_id, price_info, reference_sku_id in items:
+            requests[(str(spu_id), str(reference_sku_id) if reference_sku_id else None)] = price_info
+        keys = list(requests)
+        
+        results: Dict[Tuple[str, Optional[str]], Optional[Dict]] = {}
+        variants_table = ProductVariant.__table__
+        session = self.get_session()
+        try:
+            for start in range(0, len(keys), chunk_size):
+                chunk = keys[start:start + chunk_size]
+                now = datetime.utcnow()
+                # Все цены пачки считаем по одному набору формул
+                formula_set = price_calculator.formula_set
+                
+                try:
+                    products = {}
+                    for row in session.execute(
+                        select(Product.id, Product.spu_id, Product.reference_sku_id, Product.category_ids)
+                        .where(Product.spu_id.in_(list({spu_id for spu_id, _ in chunk})))
+                    ):
+                        products[(row.spu_id, row.reference_sku_id)] = row
+                    
+                    variants_by_product = {}
+                    if products:
+                        for variant in session.execute(
+                            select(ProductVariant.id, ProductVariant.product_id, ProductVariant.sku_id,
+                                   ProductVariant.price_cny, ProductVariant.price_rub,
+                                   ProductVariant.formula_version, ProductVariant.is_available)
+                            .where(ProductVariant.product_id.in_([row.id for row in products.values()]))
+                        ):
+                            variants_by_product.setdefault(variant.product_id, []).append(variant)
+                    
+                    # Сопоставляем цены из priceInfo с вариантами по (product_id, sku_id)
+                    pending = []  # (key, вариант, price_cny, категория)
+                    deletes, touched_products = [], set()
+                    chunk_results = {}
+                    for key in chunk:
+                        product = products.get(key)
+                        if product is None:
+                            logger.warning(f"Товар {key[0]} не найден в БД")
+                            chunk_results[key] = None
+                            continue
+                        
+                        counts = {'updated': 0, 'added': 0, 'removed': 0, 'changed': 0}
+                        chunk_results[key] = counts
+                        price_skus = requests[key].get('skus', {})
+                        if not price_skus:
+                            logger.warning(f"Нет данных о ценах для {key[0]}")
+                            continue
+                        
+                        product_variants = variants_by_product.get(product.id, [])
+                        current_variants = {str(v.sku_id): v for v in product_variants if v.sku_id}
+                        if not current_variants and product_variants:
+                            logger.warning(f"Товар {key[0]} имеет варианты без sku_id - используйте update-db")
+                            continue
+                        
+                        primary_category = product.category_ids[0] if product.category_ids else None
+                        new_sku_ids = set()
+                        for sku_id_str, sku_data in price_skus.items():
+                            if not isinstance(sku_data, dict):
+                                continue
+                            sku_id_str = str(sku_id_str)
+                            new_sku_ids.add(sku_id_str)
+                            
+                            # Первая положительная цена; API возвращает цены в фенях
+                            price_raw = 0
+                            for price_obj in sku_data.get('prices') or []:
+                                if isinstance(price_obj, dict) and (price_obj.get('price') or 0) > 0:
+                                    price_raw = price_obj['price']
+                                    break
+                            
+                            # Новые SKU не добавляем - нет информации о размере
+                            if price_raw > 0 and sku_id_str in current_variants:
+                                pending.append((key, current_variants[sku_id_str], price_raw / 100, primary_category))
+                        
+                        for sku_id_str, variant in current_variants.items():
+                            if sku_id_str not in new_sku_ids:
+                                deletes.append(variant.id)
+                                counts['removed'] += 1
+                                touched_products.add(product.id)
+                    
+                    # Цены всей пачки - одним вызовом
+                    prices_rub = formula_set.calculate_prices_batch(
+                        [price_cny for _, _, price_cny, _ in pending],
+                        [category for _, _, _, category in pending],
+                        "21-26 дней"
+                    ) if pending else []
+                    
+                    updates = []
+                    for (key, variant, price_cny, _), price_rub in zip(pending, prices_rub):
+                        counts = chunk_results[key]
+                        counts['updated'] += 1
+                        if _money(variant.price_cny) == _money(price_cny) and \
+                                _money(variant.price_rub) == _money(price_rub) and \
+                                variant.formula_version == formula_set.version and variant.is_available:
+                            continue
+                        counts['changed'] += 1
+                        touched_products.add(variant.product_id)
+                        updates.append({'_id': variant.id, 'price_cny': price_cny, 'price_rub': price_rub,
+                                        'formula_version': formula_set.version, 'is_available': True,
+                                        'updated_at': now})
+                    
+                    if updates:
+                        session.execute(
+                            update(variants_table).where(variants_table.c.id == bindparam('_id'))
+                            .values({name: bindparam(name) for name in
+                                     ('price_cny', 'price_rub', 'formula_version', 'is_available', 'updated_at')}),
+                            updates
+                        )
+                    if deletes:
+                        session.execute(delete(variants_table).where(variants_table.c.id.in_(deletes)))
+                    if touched_products:
+                        # Варианты изменены не по полному ответу - следующий update-db разберет товар
+                        # заново; updated_at товара при этом не меняется (как раньше)
+                        session.execute(
+                            update(Product.__table__).where(Product.__table__.c.id.in_(list(touched_products)))
+                            .values(payload_hash=None, updated_at=Product.__table__.c.updated_at)
+                        )
+                    
+                    session.commit()
+                    results.update(chunk_results)
+                    
+                except Exception as e:
+                    session.rollback()
+                    logger.error(f"❌ Ошибка пакетного обновления цен ({len(chunk)} товаров): {e}")
+                    results.update({key: None for key in chunk})
+            
+            changed = sum(r['changed'] for r in results.values() if r)
+            removed = sum(r['removed'] for r in results.values() if r)
+            logger.info(f"💰 Пакетное обновление цен: товаров {len(keys)}, изменено вариантов {changed}, "
+                        f"удалено {removed}")
+            return results
+        finally:
+            session.close()
+    
     def update_product_field(self, product_id: int, field: str, value):
         """Обновляет одно поле товара"""
         session = self.Session()
@@ -40,6 +40,11 @@ class PlummyShell(cmd.Cmd):
         super().__init__()
         self.ruler = '─'
         self.pending_links = []  # Буфер для накопления ссылок
+        
+        # Формулы цен перечитываются автоматически при изменении price_formulas.json
+        if os.getenv('PRICE_FORMULAS_WATCH', '1').lower() not in ('0', 'false', 'no'):
+            from price_calculator import price_calculator
+            price_calculator.start_watcher(float(os.getenv('PRICE_FORMULAS_WATCH_INTERVAL', '2')))
     
     # ==================== УПРАВЛЕНИЕ АРТИКУЛАМИ ====================
     
@@ -481,6 +486,65 @@ class PlummyShell(cmd.Cmd):
             traceback.print_exc()
     
     
+    def do_reprice(self, arg):
+        """
+        Пересчитывает цены только там, где изменились формулы.
+        
+        ЧТО ДЕЛАЕТ:
+        - Перечитывает price_formulas.json
+        - Сравнивает формулы с последними примененными (price_formulas.applied.json)
+        - Определяет категории и сроки доставки, где цена действительно изменилась
+        - Обновляет price_rub в БД только для товаров этих категорий
+        - Обновляет на сайте только цены изменившихся вариаций (без пересоздания)
+        
+        ИСПОЛЬЗОВАНИЕ:
+          reprice
+        
+        КОГДА ИСПОЛЬЗОВАТЬ:
+        - После правки price_formulas.json вместо update-prices-full
+        
+        ПРИМЕЧАНИЯ:
+        - Не обращается к Dewu API (используются цены CNY из БД)
+        - При первом запуске только запоминает текущие формулы
+        """
+        try:
+            from repricing import run_reprice
+            run_reprice()
+        except KeyboardInterrupt:
+            print("\n⚠️  Прервано пользователем")
+        except Exception as e:
+            print(f"❌ Ошибка: {e}")
+            import traceback
+            traceback.print_exc()
+    
+    def do_compact_sync_log(self, arg):
+        """
+        Сжимает историю синхронизаций (wp_sync_log) по политике хранения.
+        
+        ЧТО ДЕЛАЕТ:
+        - Оставляет последние SYNC_LOG_KEEP_LAST записей каждого товара
+        - Ошибки синхронизации хранит SYNC_LOG_KEEP_FAILED_DAYS дней
+        - Остальные записи переносит в архив SYNC_LOG_ARCHIVE_DIR (gzip JSONL)
+        - Удаляет их из БД небольшими пачками (без долгой блокировки БД)
+        
+        ИСПОЛЬЗОВАНИЕ:
+          compact-sync-log            # Сжать историю
+          compact-sync-log --dry-run  # Только посчитать записи к удалению
+        
+        ПРИМЕЧАНИЯ:
+        - WP ID товаров хранятся отдельно (product_wp_mapping) и не теряются
+        - Рекомендуется запускать периодически (например, раз в неделю)
+        """
+        try:
+            from sync_log_retention import run_compact_sync_log
+            run_compact_sync_log(dry_run='--dry-run' in arg.split())
+        except KeyboardInterrupt:
+            print("\n⚠️  Прервано пользователем")
+        except Exception as e:
+            print(f"❌ Ошибка: {e}")
+            import traceback
+            traceback.print_exc()
+    
     # ==================== УПРАВЛЕНИЕ ТОВАРАМИ ====================
     def do_product_info(self, arg):
         """
@@ -0,0 +1,191 @@
+"""
+Параллельный разбор ответов Poizon API в пуле процессов
+parse_product_detail нагружает CPU; в отдельных процессах он не блокирует
+event loop, который в это время продолжает выполнять HTTP запросы
+"""
+import asyncio
+import logging
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple
+
+from price_calculator import CalculatorFormula, FormulaSet, price_calculator
+from product_processor import ProductProcessor
+
+logger = logging.getLogger(__name__)
+
+
+# Процессор внутри процесса-воркера (создается в _init_worker)
+_worker_processor: Optional[ProductProcessor] = None
+# Набор формул воркера: (версия набора основного процесса, собранный набор)
+_worker_formula: Optional[Tuple[str, FormulaSet]] = None
+
+
+def parse_workers_from_env() -> int:
+    """
+    Количество процессов разбора из PARSE_WORKERS
+    
+    Returns:
+        int: 0 - разбор в основном процессе, "auto" - по числу ядер
+    """
+    value = os.getenv('PARSE_WORKERS', '0').strip().lower()
+    if value == 'auto':
+        return os.cpu_count() or 1
+    try:
+        return max(0, int(value))
+    except ValueError:
+        logger.warning(f"⚠️ Некорректное значение PARSE_WORKERS={value!r}, разбор в основном процессе")
+        return 0
+
+
+def _init_worker(price_formula):
+    """Инициализация процесса-воркера: свой ProductProcessor на весь срок жизни процесса"""
+    global _worker_processor
+    _worker_processor = ProductProcessor(price_formula=price_formula)
+
+
+def _parse_in_worker(product_data: dict, reference_sku_id: Optional[str], category_ids: Optional[List[int]],
+                     formula_version: Optional[str], formula_config: Optional[Dict]) -> Tuple[Optional[Dict], Dict]:
+    """
+    Разбирает товар в процессе-воркере
+    
+    Args:
+        formula_version: Версия набора формул основного процесса (None - формулы не нужны)
+        formula_config: Тот же набор в формате price_formulas.json
+    
+    Returns:
+        Tuple[Optional[Dict], Dict]: (результат parse_product_detail, приращение статистики)
+    """
+    global _worker_formula
+    
+    # Набор пересобирается только при смене версии в основном процессе;
+    # цены и их версия берутся из этого же набора
+    formula_set = None
+    if formula_version is not None:
+        if _worker_formula is None or _worker_formula[0] != formula_version:
+            _worker_formula = (formula_version, FormulaSet.from_config(formula_config))
+        formula_set = _worker_formula[1]
+    
+    processor = _worker_processor
+    processor.reset_stats()
+    result = processor.parse_product_detail(product_data, reference_sku_id, category_ids, formula_set)
+    return result, processor.get_stats()
+
+
+class ParsePool:
+    """
+    Пул процессов для parse_product_detail
+    
+    Статистика (processed_count, valid_count, invalid_reasons) из воркеров
+    суммируется в processor основного процесса, поэтому get_stats() и отчеты
+    работают так же, как при разборе в основном процессе.
+    """
+    
+    def __init__(self, processor: ProductProcessor, workers: Optional[int] = None):
+        """
+        Args:
+            processor: Процессор основного процесса (его price_formula передается воркерам,
+                в его счетчики собирается статистика)
+            workers: Количество процессов (по умолчанию PARSE_WORKERS; 0 или 1 - без пула)
+        """
+        self.processor = processor
+        self.workers = parse_workers_from_env() if workers is None else workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # Набор формул, переданный воркерам последним: (версия, конфигурация)
+        self._formula_config: Optional[Tuple[str, Dict]] = None
+        
+        if self.workers > 1 and processor.price_formula is not None:
+            try:
+                pickle.dumps(processor.price_formula)
+            except (pickle.PicklingError, AttributeError, TypeError) as e:
+                logger.warning(f"⚠️ price_formula нельзя передать в процесс ({e}), разбор в основном процессе "
+                               f"(для формул из price_formulas.json используйте CalculatorFormula)")
+                self.workers = 0
+        
+        if self.workers > 1:
+            logger.info(f"🧮 Разбор товаров в {self.workers} процессах")
+    
+    @property
+    def enabled(self) -> bool:
+        """Разбор идет в пуле процессов"""
+        return self.workers > 1
+    
+    def _get_formula_config(self, formula_set: FormulaSet) -> Tuple[str, Dict]:
+        """Версия и конфигурация набора для воркеров (FormulaSet в процесс не передается)"""
+        if self._formula_config is None or self._formula_config[0] != formula_set.version:
+            self._formula_config = (formula_set.version, formula_set.to_config())
+        return self._formula_config
+    
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """Запускает процессы при первом обращении"""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_worker,
+                initargs=(self.processor.price_formula,)
+            )
+        return self._executor
+    
+    async def parse(self, product_data: dict, reference_sku_id: Optional[str] = None,
+                    category_ids: Optional[List[int]] = None) -> Optional[Dict]:
+        """
+        Разбирает товар (аналог ProductProcessor.parse_product_detail)
+        
+        Args:
+            product_data: Данные товара от API
+            reference_sku_id: Опциональный SKU ID для определения цвета
+            category_ids: Опциональный список ID категорий WooCommerce
+        
+        Returns:
+            Optional[Dict]: Обработанные данные или None
+        """
+        # Набор формул фиксируется на время разбора товара (как и без пула)
+        formula_set = price_calculator.formula_set
+        if not self.enabled:
+            return self.processor.parse_product_detail(product_data, reference_sku_id, category_ids, formula_set)
+        
+        formula_version, formula_config = None, None
+        if isinstance(self.processor.price_formula, CalculatorFormula):
+            formula_version, formula_config = self._get_formula_config(formula_set)
+        
+        loop = asyncio.get_running_loop()
+        try:
+            result, stats = await loop.run_in_executor(
+                self._get_executor(), _parse_in_worker,
+                product_data, reference_sku_id, category_ids, formula_version, formula_config
+            )
+        except BrokenProcessPool as e:
+            # Воркер упал (например, нехватка памяти) - дальше разбираем в основном процессе
+            logger.warning(f"⚠️ Пул процессов разбора недоступен ({e}), разбор в основном процессе")
+            self.close()
+            self.workers = 0
+            return self.processor.parse_product_detail(product_data, reference_sku_id, category_ids, formula_set)
+        
+        self.processor.merge_stats(stats)
+        return result
+    
+    async def parse_many(self, items: List[Tuple[dict, Optional[str], Optional[List[int]]]]) -> List[Optional[Dict]]:
+        """
+        Разбирает несколько товаров параллельно
+        
+        Args:
+            items: Список (product_data, reference_sku_id, category_ids)
+        
+        Returns:
+            List[Optional[Dict]]: Результаты в порядке входных данных
+        """
+        return await asyncio.gather(*(self.parse(*item) for item in items))
+    
+    def close(self):
+        """Останавливает процессы"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+    
+    def __enter__(self) -> 'ParsePool':
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,110 @@
+"""
+Отпечаток (хеш) ответа Poizon API для пропуска неизменившихся товаров
+В хеш попадают только поля, которые читает ProductProcessor (структуры из
+response_decoder), в нормализованном виде: порядок ключей и лишние поля ответа
+(счетчики продаж, рекомендации и т.п.) на отпечаток не влияют
+"""
+import hashlib
+import json
+from typing import Any, Callable, List, Optional, Union, get_args, get_origin, get_type_hints, is_typeddict
+
+from response_decoder import PriceInfoResponse, ProductDetailResponse
+
+# Версия разбора: увеличивается при изменении parse_product_detail или полей, которые
+# сохраняются в БД, - тогда все товары при следующем обновлении разбираются заново
+PARSER_VERSION = "1"
+
+
+def _compile_projector(tp) -> Callable[[Any], Any]:
+    """
+    Компилирует структуру ответа в функцию, оставляющую в значении только объявленные поля
+    
+    Значения, не совпадающие со структурой по типу, возвращаются как есть.
+    """
+    if is_typeddict(tp):
+        fields = {name: _compile_projector(hint) for name, hint in get_type_hints(tp).items()}
+        
+        def project_dict(value):
+            if not isinstance(value, dict):
+                return value
+            return {name: fields[name](value[name]) for name in fields if name in value}
+        return project_dict
+    
+    origin = get_origin(tp)
+    if origin is Union:
+        # Optional[X] / Union[...] - проецируем по первой вложенной структуре
+        for arg in get_args(tp):
+            if arg is not type(None):
+                projector = _compile_projector(arg)
+                if projector is not _identity:
+                    return projector
+        return _identity
+    
+    if origin is list:
+        item = _compile_projector(get_args(tp)[0])
+        if item is _identity:
+            return _identity
+        return lambda value: [item(v) for v in value] if isinstance(value, list) else value
+    
+    if origin is dict:
+        item = _compile_projector(get_args(tp)[1])
+        if item is _identity:
+            return _identity
+        return lambda value: {k: item(v) for k, v in value.items()} if isinstance(value, dict) else value
+    
+    return _identity
+
+
+def _identity(value):
+    return value
+
+
+_project_product = _compile_projector(ProductDetailResponse)
+_project_price_info = _compile_projector(PriceInfoResponse)
+
+
+def normalize_payload(product_data: dict) -> dict:
+    """
+    Оставляет в ответе productDetail (+ priceInfo) только поля, влияющие на разбор
+    
+    Args:
+        product_data: Данные товара от API
+    
+    Returns:
+        dict: Нормализованные данные
+    """
+    normalized = _project_product(product_data)
+    if 'priceInfo' in product_data:
+        normalized['priceInfo'] = _project_price_info(product_data['priceInfo'])
+    return normalized
+
+
+def payload_fingerprint(product_data: dict, reference_sku_id: Optional[str] = None,
+                        category_ids: Optional[List[int]] = None,
+                        formula_version: Optional[str] = None) -> str:
+    """
+    Считает отпечаток товара
+    
+    Кроме ответа API в отпечаток входит все, от чего зависит результат разбора:
+    reference_sku_id (цвет), category_ids (фильтр категорий и формула цены),
+    версия набора формул и PARSER_VERSION.
+    
+    Args:
+        product_data: Данные товара от API
+        reference_sku_id: SKU ID для определения цвета
+        category_ids: Список ID категорий WooCommerce (порядок важен - первая основная)
+        formula_version: Версия набора формул (price_calculator.version)
+    
+    Returns:
+        str: sha256 в hex (64 символа)
+    """
+    envelope = [
+        PARSER_VERSION,
+        formula_version,
+        str(reference_sku_id) if reference_sku_id else None,
+        [int(c) for c in category_ids] if category_ids else [],
+        normalize_payload(product_data),
+    ]
+    encoded = json.dumps(envelope, sort_keys=True, ensure_ascii=False,
+                         separators=(',', ':'), default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
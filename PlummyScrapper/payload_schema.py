@@ -0,0 +1,183 @@
+"""
+Декларативная схема извлечения полей товара из ответов Poizon API
+Для каждого поля задан список путей в порядке приоритета. Схема один раз
+компилируется в функции-аксессоры, которые возвращают значение и номер
+сработавшего пути - по ним собирается статистика изменений формата API
+"""
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# Номер пути, если ни один путь не дал значения
+MISSING = -1
+
+
+class Field:
+    """Поле схемы: пути-кандидаты в порядке приоритета"""
+    
+    def __init__(self, paths: Sequence[str], default: Any = None, skip_empty: bool = True):
+        """
+        Args:
+            paths: Пути вида "detail.title" или "brandRootInfo.brandItemList.0.brandName"
+                (число - индекс в списке)
+            default: Значение, если ни один путь не сработал
+            skip_empty: True - пустое значение ('' / None / []) не считается найденным
+                и поиск идет дальше; False - достаточно наличия ключа
+        """
+        self.paths = list(paths)
+        self.default = default
+        self.skip_empty = skip_empty
+
+
+# Поля товара из productDetail / productDetailWithPrice
+PRODUCT_SCHEMA: Dict[str, Field] = {
+    'title': Field([
+        'title', 'name', 'productName', 'spuName',
+        'detail.title', 'detail.name', 'detail.productName', 'detail.spuName',
+        'detail.desc', 'detail.description',
+        'basicParam.title', 'basicParam.name', 'basicParam.productName', 'basicParam.spuName',
+        'detailModel.title', 'detailModel.name', 'detailModel.productName',
+    ]),
+    'logo_url': Field(['detail.logoUrl']),
+    'images': Field(['image.spuImage.images'], default=[]),
+    'brand': Field(['brandRootInfo.brandItemList.0.brandName'], default=''),
+    'article_number': Field(['detail.articleNumber'], default='', skip_empty=False),
+    'category_id': Field(['detail.categoryId'], skip_empty=False),
+    'category_name': Field(['detail.categoryName'], default='', skip_empty=False),
+}
+
+
+def _parse_path(path: str) -> Tuple:
+    """'a.0.b' → ('a', 0, 'b')"""
+    return tuple(int(part) if part.isdigit() else part for part in path.split('.'))
+
+
+def _compile_path(keys: Tuple) -> Callable[[dict], Tuple[bool, Any]]:
+    """
+    Компилирует путь в функцию data → (найден ли ключ, значение)
+    
+    Промежуточные значения должны быть словарями (или списками для индексов),
+    иначе путь считается отсутствующим.
+    """
+    *parents, last = keys
+    
+    if not parents and isinstance(last, str):
+        # Самый частый случай - ключ верхнего уровня
+        def accessor(data):
+            return (last in data), data.get(last)
+        return accessor
+    
+    def accessor(data):
+        node = data
+        for key in parents:
+            if isinstance(key, int):
+                if not isinstance(node, list) or key >= len(node):
+                    return False, None
+                node = node[key]
+            else:
+                if not isinstance(node, dict):
+                    return False, None
+                node = node.get(key)
+        
+        if isinstance(last, int):
+            if isinstance(node, list) and last < len(node):
+                return True, node[last]
+            return False, None
+        if isinstance(node, dict) and last in node:
+            return True, node[last]
+        return False, None
+    
+    return accessor
+
+
+def compile_field(field: Field) -> Callable[[dict], Tuple[Any, int]]:
+    """
+    Компилирует поле схемы в функцию data → (значение, номер пути или MISSING)
+    
+    Args:
+        field: Поле схемы
+    
+    Returns:
+        Callable: Аксессор поля
+    """
+    accessors = [_compile_path(_parse_path(path)) for path in field.paths]
+    default = field.default
+    
+    if field.skip_empty:
+        def extract(data):
+            for index, accessor in enumerate(accessors):
+                found, value = accessor(data)
+                if value:
+                    return value, index
+            return default, MISSING
+    else:
+        def extract(data):
+            for index, accessor in enumerate(accessors):
+                found, value = accessor(data)
+                if found:
+                    return value, index
+            return default, MISSING
+    
+    return extract
+
+
+class CompiledSchema:
+    """Скомпилированная схема: аксессоры полей и подписи путей для статистики"""
+    
+    def __init__(self, schema: Dict[str, Field]):
+        """
+        Args:
+            schema: Поля схемы {имя: Field}
+        """
+        self.fields = dict(schema)
+        self._extractors = {name: compile_field(field) for name, field in schema.items()}
+    
+    def extract(self, name: str, data: dict) -> Tuple[Any, int]:
+        """
+        Извлекает поле из ответа API
+        
+        Args:
+            name: Имя поля схемы
+            data: Ответ API (словарь товара)
+        
+        Returns:
+            Tuple[Any, int]: (значение, номер сработавшего пути или MISSING)
+        """
+        return self._extractors[name](data)
+    
+    def path_label(self, name: str, index: int) -> str:
+        """Путь по номеру (для статистики); MISSING → 'missing'"""
+        if index == MISSING:
+            return 'missing'
+        return self.fields[name].paths[index]
+
+
+def merge_path_stats(target: Dict[str, Dict[str, int]], source: Dict[str, Dict[str, int]]):
+    """Суммирует статистику путей {поле: {путь: количество}} в target"""
+    for name, paths in source.items():
+        field_stats = target.setdefault(name, {})
+        for path, count in paths.items():
+            field_stats[path] = field_stats.get(path, 0) + count
+
+
+def drifted_paths(path_stats: Dict[str, Dict[str, int]], schema: Optional[CompiledSchema] = None) -> List[Tuple[str, str, int]]:
+    """
+    Возвращает случаи, когда поле нашлось не по основному пути или не нашлось вовсе
+    
+    Args:
+        path_stats: Статистика путей {поле: {путь: количество}}
+        schema: Схема (по умолчанию product_schema)
+    
+    Returns:
+        List[Tuple[str, str, int]]: [(поле, путь, количество)] по убыванию количества
+    """
+    schema = schema or product_schema
+    result = []
+    for name, paths in path_stats.items():
+        primary = schema.fields[name].paths[0] if name in schema.fields else None
+        for path, count in paths.items():
+            if path != primary:
+                result.append((name, path, count))
+    return sorted(result, key=lambda item: item[2], reverse=True)
+
+
+# Схема товара, скомпилированная при импорте
+product_schema = CompiledSchema(PRODUCT_SCHEMA)
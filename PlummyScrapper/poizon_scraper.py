@@ -5,34 +5,161 @@ API клиент для Poizon (dewu)
 import aiohttp
 import asyncio
 import logging
-from typing import List, Dict, Optional
+import os
+import random
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import List, Dict, Optional, Tuple
+from api_key_pool import ApiKey, ApiKeyPool, key_pool_from_env
+from rate_limiter import rate_limiter
+from response_cache import ResponseCache, response_cache
+from response_decoder import ResponseDecoder, decoder_from_env
 
 logger = logging.getLogger(__name__)
 
+# Количество параллельных воркеров загрузки (реальный темп всё равно задаёт rate_limiter)
+DEFAULT_MAX_WORKERS = int(os.getenv('POIZON_MAX_WORKERS', '4'))
+
+# Использовать ли постоянный кэш ответов (см. response_cache.py)
+CACHE_ENABLED = os.getenv('POIZON_CACHE_ENABLED', '1').lower() not in ('0', 'false', 'no')
+
+# Верхняя граница ожидания по заголовку Retry-After (защита от некорректных значений)
+MAX_RETRY_AFTER = 300
+
+
+class RetryPolicy:
+    """
+    Политика повторов для одного класса ошибок
+    
+    Задержка растет экспоненциально (base_delay * 2^attempt, не больше max_delay)
+    со случайным разбросом (equal jitter), чтобы параллельные запросы
+    не повторялись одновременно.
+    """
+    
+    def __init__(self, max_attempts: int, base_delay: float, max_delay: float,
+                 respect_retry_after: bool = True):
+        """
+        Args:
+            max_attempts: Максимум попыток (включая первую)
+            base_delay: Базовая задержка в секундах
+            max_delay: Максимальная задержка в секундах
+            respect_retry_after: Учитывать ли заголовок Retry-After от сервера
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.respect_retry_after = respect_retry_after
+    
+    def get_delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """
+        Вычисляет задержку перед следующей попыткой
+        
+        Args:
+            attempt: Номер неудачной попытки (с 0)
+            retry_after: Значение Retry-After от сервера в секундах (если было)
+        
+        Returns:
+            float: Задержка в секундах
+        """
+        if retry_after is not None and self.respect_retry_after:
+            # Подсказка сервера важнее расчета, но добавляем разброс против синхронных волн
+            return min(retry_after, MAX_RETRY_AFTER) + random.uniform(0, 1)
+        
+        cap = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return cap / 2 + random.uniform(0, cap / 2)
+
+
+# Политики повторов по HTTP статусам (остальные ошибки не повторяем)
+RETRY_POLICIES = {
+    429: RetryPolicy(max_attempts=4, base_delay=5, max_delay=60),
+    500: RetryPolicy(max_attempts=3, base_delay=2, max_delay=20),
+    502: RetryPolicy(max_attempts=3, base_delay=2, max_delay=20),
+    503: RetryPolicy(max_attempts=3, base_delay=3, max_delay=30),
+    504: RetryPolicy(max_attempts=3, base_delay=3, max_delay=30),
+}
+
+# Ключ отклонен (401/403): повторяем сразу, но только если в пуле есть другой ключ
+AUTH_STATUSES = (401, 403)
+AUTH_RETRY_POLICY = RetryPolicy(max_attempts=3, base_delay=0, max_delay=0, respect_retry_after=False)
+
+# Политика для сетевых ошибок и таймаутов
+NETWORK_RETRY_POLICY = RetryPolicy(max_attempts=3, base_delay=2, max_delay=15, respect_retry_after=False)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Разбирает заголовок Retry-After (секунды или HTTP-дата)
+    
+    Args:
+        value: Значение заголовка
+    
+    Returns:
+        Optional[float]: Задержка в секундах или None
+    """
+    if not value:
+        return None
+    
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    
+    try:
+        retry_at = parsedate_to_datetime(value)
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
 
 class PoizonScraper:
     """Клиент для работы с Poizon API"""
     
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, max_workers: Optional[int] = None,
+                 cache: Optional[ResponseCache] = None, bypass_cache: bool = False,
+                 key_pool: Optional[ApiKeyPool] = None, decoder: Optional[ResponseDecoder] = None):
         """
         Инициализация клиента
         
         Args:
             api_key: API ключ для доступа к Poizon API
+            max_workers: Количество параллельных воркеров для пакетной загрузки
+                         (по умолчанию POIZON_MAX_WORKERS из .env или 4)
+            cache: Кэш ответов (по умолчанию глобальный response_cache,
+                   если POIZON_CACHE_ENABLED не выключен)
+            bypass_cache: Не читать из кэша (свежие ответы все равно сохраняются)
+            key_pool: Пул API ключей (по умолчанию из POIZON_API_KEYS, если там
+                      несколько ключей; иначе все запросы идут с api_key)
+            decoder: Быстрый декодер ответов (по умолчанию из POIZON_FAST_DECODE;
+                     без него ответы декодирует aiohttp)
         """
         self.api_key = api_key
+        self.key_pool = key_pool if key_pool is not None else key_pool_from_env(api_key)
         self.base_url = "https://poizon-api.com"
+        self.max_workers = max(1, max_workers or DEFAULT_MAX_WORKERS)
+        self.cache = cache if cache is not None else (response_cache if CACHE_ENABLED else None)
+        self.bypass_cache = bypass_cache
+        self.decoder = decoder if decoder is not None else decoder_from_env()
         self.api_requests = 0
         self.successful_requests = 0
+        self.rate_limited_requests = 0
+        self.retry_wait_seconds = 0.0
+        self.coalesced_requests = 0
+        
+        # Запросы "в полете": (endpoint, spuId) -> задача, которую ждут все вызывающие
+        self._inflight: Dict[Tuple[str, str], asyncio.Task] = {}
         
-    def get_headers(self, include_content_type: bool = False) -> dict:
+    def get_headers(self, include_content_type: bool = False, api_key: Optional[str] = None) -> dict:
         """Возвращает заголовки для API запросов
         
         Args:
             include_content_type: Включить ли Content-Type (для POST запросов)
+            api_key: Ключ из пула (по умолчанию self.api_key)
         """
         headers = {
-            "x-api-key": self.api_key,
+            "x-api-key": api_key or self.api_key,
             "Accept": "application/json"
         }
         
@@ -41,6 +168,187 @@ class PoizonScraper:
         
         return headers
     
+    async def _request(self, session: aiohttp.ClientSession, endpoint: str,
+                       params: Dict, description: str, max_attempts: Optional[int] = None,
+                       timeout: int = 20, cache_key: Optional[str] = None) -> Optional[Dict]:
+        """
+        Единый исполнитель GET запросов к Poizon API
+        
+        Все endpoint'ы проходят через этот метод:
+        - каждая попытка (включая повторы) ждет разрешения rate_limiter
+          (корзина с именем endpoint'а, если она настроена; при пуле ключей -
+          корзина ключа с наибольшим остатком квоты)
+        - при 401/403 запрос повторяется с другим ключом пула
+        - повторы по политикам RETRY_POLICIES с экспоненциальным backoff и jitter
+        - заголовок Retry-After от сервера имеет приоритет над расчетной задержкой
+        - ответы с cache_key читаются из кэша и сохраняются в него (TTL по endpoint'у)
+        - одновременные запросы с одинаковым (endpoint, cache_key) объединяются
+          в один HTTP запрос (single-flight)
+        
+        Каждый вызывающий получает свою поверхностную копию ответа, поэтому
+        добавление ключей верхнего уровня (priceInfo, spuId) не влияет на других.
+        
+        Args:
+            session: aiohttp сессия
+            endpoint: Имя endpoint'а (например, "productDetail")
+            params: Параметры запроса
+            description: Описание запроса для логов (например, "spuId=123")
+            max_attempts: Ограничение числа попыток (по умолчанию - из политики)
+            timeout: Таймаут запроса в секундах
+            cache_key: Ключ кэша и объединения запросов (spuId); None - без кэша
+        
+        Returns:
+            Optional[Dict]: JSON ответ (dict) или None
+        """
+        if cache_key is None:
+            return await self._execute_request(session, endpoint, params, description,
+                                               max_attempts, timeout, cache_key)
+        
+        key = (endpoint, cache_key)
+        task = self._inflight.get(key)
+        
+        if task is None:
+            task = asyncio.ensure_future(self._execute_request(session, endpoint, params, description,
+                                                               max_attempts, timeout, cache_key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._release_inflight(key, done))
+        else:
+            self.coalesced_requests += 1
+            logger.info(f"🔗 {endpoint} ({description}): ожидаем уже выполняющийся запрос")
+        
+        # shield: отмена одного вызывающего не отменяет общий запрос для остальных
+        data = await asyncio.shield(task)
+        return dict(data) if data is not None else None
+    
+    def _release_inflight(self, key: Tuple[str, str], task: asyncio.Task):
+        """Удаляет завершенную задачу из реестра запросов в полете"""
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+    
+    async def _execute_request(self, session: aiohttp.ClientSession, endpoint: str,
+                               params: Dict, description: str, max_attempts: Optional[int],
+                               timeout: int, cache_key: Optional[str]) -> Optional[Dict]:
+        """
+        Выполняет запрос: кэш, rate limit, повторы (см. _request)
+        
+        Args:
+            session: aiohttp сессия
+            endpoint: Имя endpoint'а (например, "productDetail")
+            params: Параметры запроса
+            description: Описание запроса для логов (например, "spuId=123")
+            max_attempts: Ограничение числа попыток (по умолчанию - из политики)
+            timeout: Таймаут запроса в секундах
+            cache_key: Ключ кэша (spuId); None - не использовать кэш
+        
+        Returns:
+            Optional[Dict]: JSON ответ (dict) или None
+        """
+        use_cache = self.cache is not None and cache_key is not None
+        namespace = self.decoder.cache_namespace(endpoint) if self.decoder is not None else None
+        if use_cache and namespace:
+            cache_key = f"{cache_key}#{namespace}"
+        
+        if use_cache and not self.bypass_cache:
+            cached = self.cache.get(endpoint, cache_key)
+            if cached is not None:
+                logger.info(f"🗄️  {endpoint} ({description}): из кэша")
+                return cached
+        
+        url = f"{self.base_url}/api/dewu/{endpoint}"
+        attempt = 0
+        
+        while True:
+            retry_after = None
+            policy = None
+            status = None
+            key: Optional[ApiKey] = None
+            
+            try:
+                if self.key_pool is not None:
+                    key = await self.key_pool.acquire()
+                else:
+                    await rate_limiter.acquire(endpoint)
+                self.api_requests += 1
+                
+                if attempt > 0:
+                    logger.info(f"🔄 Повторная попытка {attempt + 1} для {endpoint} ({description})")
+                else:
+                    logger.info(f"🌐 API запрос ({endpoint}): {description}")
+                
+                async with session.get(url, params=params,
+                                      headers=self.get_headers(api_key=key.api_key if key else None),  # Content-Type не нужен для GET запросов
+                                      timeout=timeout, ssl=False) as response:
+                    if response.status == 200:
+                        if self.decoder is not None:
+                            data = self.decoder.decode(endpoint, await response.read())
+                        else:
+                            data = await response.json()
+                        
+                        if isinstance(data, dict):
+                            self.successful_requests += 1
+                            if key is not None:
+                                self.key_pool.record_success(key)
+                            else:
+                                rate_limiter.record_success(endpoint)
+                            if use_cache:
+                                self.cache.set(endpoint, cache_key, data)
+                            return data
+                        
+                        logger.error(f"❌ Неожиданная структура ответа {endpoint} ({description}): {type(data)}")
+                        return None
+                    
+                    if response.status == 404:
+                        logger.warning(f"⚠️ {endpoint} ({description}): не найдено")
+                        return None
+                    
+                    status = response.status
+                    error_text = await response.text()
+                    policy = RETRY_POLICIES.get(status)
+                    
+                    if status in AUTH_STATUSES and key is not None:
+                        self.key_pool.record_unauthorized(key)
+                        if self.key_pool.has_alternative(key):
+                            policy = AUTH_RETRY_POLICY
+                    
+                    if policy is None:
+                        logger.error(f"❌ Ошибка API {endpoint} {response.status} ({description}): {error_text[:200]}")
+                        return None
+                    
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                    logger.warning(f"⚠️ HTTP {response.status} для {endpoint} ({description}): {error_text[:100]}")
+                    
+                    if response.status == 429:
+                        self.rate_limited_requests += 1
+                        if key is not None:
+                            self.key_pool.record_rate_limit(key)
+                        else:
+                            rate_limiter.record_rate_limit(endpoint)
+            
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                policy = NETWORK_RETRY_POLICY
+                logger.error(f"❌ Сетевая ошибка {endpoint} ({description}): {type(e).__name__}: {e}")
+            except Exception as e:
+                logger.error(f"❌ Ошибка запроса {endpoint} ({description}): {e}")
+                return None
+            
+            limit = policy.max_attempts if max_attempts is None else min(max_attempts, policy.max_attempts)
+            if attempt + 1 >= limit:
+                logger.error(f"❌ Превышено количество попыток для {endpoint} ({description})")
+                if status == 429:
+                    logger.error(f"💡 СОВЕТ: API Poizon возвращает ошибку 429 'Очередь переполнена'")
+                    logger.error(f"   Это может означать:")
+                    logger.error(f"   1. Слишком частые запросы - уменьшите requests_per_second")
+                    logger.error(f"   2. API перегружен - попробуйте позже")
+                    logger.error(f"   3. Проблема с API ключом - проверьте ключ")
+                return None
+            
+            wait_time = policy.get_delay(attempt, retry_after)
+            self.retry_wait_seconds += wait_time
+            source = " (Retry-After)" if retry_after is not None and policy.respect_retry_after else ""
+            logger.info(f"⏳ Ожидание {wait_time:.1f} сек перед повтором{source}...")
+            await asyncio.sleep(wait_time)
+            attempt += 1
+    
     async def search_products(self, session: aiohttp.ClientSession, 
                              keyword: str = "nike", 
                              page: int = 1, 
@@ -57,42 +365,25 @@ class PoizonScraper:
         Returns:
             List[Dict]: Список товаров
         """
-        try:
-            self.api_requests += 1
-            
-            url = f"{self.base_url}/api/dewu/searchProducts"
-            params = {
-                "keyword": keyword,
-                "limit": limit,
-                "page": page
-            }
-            
-            logger.info(f"🌐 API запрос: поиск товаров (keyword={keyword}, page={page}, limit={limit})")
-            
-            async with session.get(url, params=params, headers=self.get_headers(),  # Content-Type не нужен для GET запросов 
-                                  timeout=30, ssl=False) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    
-                    if isinstance(data, dict) and 'productList' in data:
-                        products = data['productList']
-                        total = data.get('total', 0)
-                        
-                        self.successful_requests += 1
-                        logger.info(f"✅ Получено {len(products)} товаров (всего: {total})")
-                        
-                        return products
-                    else:
-                        logger.error(f"❌ Неожиданная структура ответа: {type(data)}")
-                        return []
-                else:
-                    error_text = await response.text()
-                    logger.error(f"❌ Ошибка API {response.status}: {error_text[:200]}")
-                    return []
-                    
-        except Exception as e:
-            logger.error(f"❌ Ошибка поиска товаров: {e}")
+        params = {
+            "keyword": keyword,
+            "limit": limit,
+            "page": page
+        }
+        
+        data = await self._request(session, "searchProducts", params,
+                                   f"keyword={keyword}, page={page}, limit={limit}", timeout=30)
+        
+        if data is None:
             return []
+        
+        if 'productList' not in data:
+            logger.error(f"❌ Неожиданная структура ответа поиска: {list(data.keys())[:10]}")
+            return []
+        
+        products = data['productList']
+        logger.info(f"✅ Получено {len(products)} товаров (всего: {data.get('total', 0)})")
+        return products
     
     async def get_price_info(self, session: aiohttp.ClientSession,
                              spu_id: str, max_retries: int = 3) -> Optional[Dict]:
@@ -102,65 +393,16 @@ class PoizonScraper:
         Args:
             session: aiohttp сессия
             spu_id: ID товара (SPU)
-            max_retries: Максимум попыток при ошибке 429
+            max_retries: Максимум попыток при временных ошибках
             
         Returns:
             Optional[Dict]: Данные о ценах или None
         """
-        for attempt in range(max_retries):
-            try:
-                self.api_requests += 1
-                
-                url = f"{self.base_url}/api/dewu/priceInfo"
-                params = {"spuId": spu_id}
-                
-                if attempt > 0:
-                    logger.info(f"🔄 Повторная попытка {attempt + 1}/{max_retries} для priceInfo {spu_id}")
-                else:
-                    logger.info(f"🌐 API запрос (priceInfo): цены для spuId={spu_id}")
-                
-                async with session.get(url, params=params, headers=self.get_headers(),  # Content-Type не нужен для GET запросов
-                                      timeout=20, ssl=False) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        
-                        if isinstance(data, dict):
-                            self.successful_requests += 1
-                            logger.info(f"✅ Получены цены для товара {spu_id} через priceInfo")
-                            return data
-                        else:
-                            logger.error(f"❌ Неожиданная структура ответа priceInfo для {spu_id}")
-                            return None
-                            
-                    elif response.status == 404:
-                        logger.warning(f"⚠️ Цены для {spu_id} не найдены")
-                        return None
-                        
-                    elif response.status == 429:
-                        error_text = await response.text()
-                        logger.warning(f"⚠️ Rate limit (429) для priceInfo {spu_id}: {error_text[:100]}")
-                        
-                        if attempt < max_retries - 1:
-                            wait_time = 5 + (attempt * 5)
-                            logger.info(f"⏳ Ожидание {wait_time} сек перед повтором...")
-                            await asyncio.sleep(wait_time)
-                            continue
-                        else:
-                            logger.error(f"❌ Превышено количество попыток для priceInfo {spu_id}")
-                            return None
-                    else:
-                        error_text = await response.text()
-                        logger.error(f"❌ Ошибка API priceInfo {response.status} для {spu_id}: {error_text[:200]}")
-                        return None
-                        
-            except Exception as e:
-                logger.error(f"❌ Ошибка получения priceInfo для {spu_id}: {e}")
-                if attempt < max_retries - 1:
-                    await asyncio.sleep(2)
-                    continue
-                return None
-        
-        return None
+        data = await self._request(session, "priceInfo", {"spuId": spu_id},
+                                   f"spuId={spu_id}", max_attempts=max_retries, cache_key=str(spu_id))
+        if data is not None:
+            logger.info(f"✅ Получены цены для товара {spu_id} через priceInfo")
+        return data
     
     async def get_product_detail_with_price(self, session: aiohttp.ClientSession,
                                             spu_id: str, max_retries: int = 3) -> Optional[Dict]:
@@ -171,65 +413,16 @@ class PoizonScraper:
         Args:
             session: aiohttp сессия
             spu_id: ID товара (SPU)
-            max_retries: Максимум попыток при ошибке 429
+            max_retries: Максимум попыток при временных ошибках
             
         Returns:
             Optional[Dict]: Данные товара с детальными ценами или None
         """
-        for attempt in range(max_retries):
-            try:
-                self.api_requests += 1
-                
-                url = f"{self.base_url}/api/dewu/productDetailWithPrice"
-                params = {"spuId": spu_id}
-                
-                if attempt > 0:
-                    logger.info(f"🔄 Повторная попытка {attempt + 1}/{max_retries} для {spu_id}")
-                else:
-                    logger.info(f"🌐 API запрос (с ценами): детали товара (spuId={spu_id})")
-                
-                async with session.get(url, params=params, headers=self.get_headers(),  # Content-Type не нужен для GET запросов
-                                      timeout=20, ssl=False) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        
-                        if isinstance(data, dict):
-                            self.successful_requests += 1
-                            logger.info(f"✅ Получены детали товара {spu_id} с ценами")
-                            return data
-                        else:
-                            logger.error(f"❌ Неожиданная структура ответа для {spu_id}")
-                            return None
-                            
-                    elif response.status == 404:
-                        logger.warning(f"⚠️ Товар {spu_id} не найден")
-                        return None
-                        
-                    elif response.status == 429:
-                        error_text = await response.text()
-                        logger.warning(f"⚠️ Rate limit (429) для {spu_id}: {error_text[:100]}")
-                        
-                        if attempt < max_retries - 1:
-                            wait_time = 5 + (attempt * 5)
-                            logger.info(f"⏳ Ожидание {wait_time} сек перед повтором...")
-                            await asyncio.sleep(wait_time)
-                            continue
-                        else:
-                            logger.error(f"❌ Превышено количество попыток для {spu_id}")
-                            return None
-                    else:
-                        error_text = await response.text()
-                        logger.error(f"❌ Ошибка API {response.status} для {spu_id}: {error_text[:200]}")
-                        return None
-                        
-            except Exception as e:
-                logger.error(f"❌ Ошибка получения деталей товара {spu_id}: {e}")
-                if attempt < max_retries - 1:
-                    await asyncio.sleep(2)
-                    continue
-                return None
-        
-        return None
+        data = await self._request(session, "productDetailWithPrice", {"spuId": spu_id},
+                                   f"spuId={spu_id}", max_attempts=max_retries, cache_key=str(spu_id))
+        if data is not None:
+            logger.info(f"✅ Получены детали товара {spu_id} с ценами")
+        return data
     
     async def get_product_detail(self, session: aiohttp.ClientSession, 
                                  spu_id: str, max_retries: int = 3) -> Optional[Dict]:
@@ -239,118 +432,97 @@ class PoizonScraper:
         Args:
             session: aiohttp сессия
             spu_id: ID товара (SPU)
-            max_retries: Максимум попыток при ошибке 429
+            max_retries: Максимум попыток при временных ошибках
             
         Returns:
             Optional[Dict]: Данные товара или None
         """
-        for attempt in range(max_retries):
-            try:
-                self.api_requests += 1
-                
-                url = f"{self.base_url}/api/dewu/productDetail"
-                params = {"spuId": spu_id}
-                
-                if attempt > 0:
-                    logger.info(f"🔄 Повторная попытка {attempt + 1}/{max_retries} для {spu_id}")
-                else:
-                    logger.info(f"🌐 API запрос: детали товара (spuId={spu_id})")
-                
-                async with session.get(url, params=params, headers=self.get_headers(),  # Content-Type не нужен для GET запросов
-                                      timeout=20, ssl=False) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        
-                        if isinstance(data, dict):
-                            self.successful_requests += 1
-                            logger.info(f"✅ Получены детали товара {spu_id}")
-                            return data
-                        else:
-                            logger.error(f"❌ Неожиданная структура ответа для {spu_id}")
-                            return None
-                            
-                    elif response.status == 404:
-                        logger.warning(f"⚠️ Товар {spu_id} не найден")
-                        return None
-                        
-                    elif response.status == 429:
-                        error_text = await response.text()
-                        logger.warning(f"⚠️ Rate limit (429) для {spu_id}: {error_text[:100]}")
-                        
-                        if attempt < max_retries - 1:
-                            wait_time = 5 + (attempt * 5)  # 5, 10, 15 секунд
-                            logger.info(f"⏳ Ожидание {wait_time} сек перед повтором...")
-                            await asyncio.sleep(wait_time)
-                            continue
-                        else:
-                            logger.error(f"❌ Превышено количество попыток для {spu_id}")
-                            logger.error(f"💡 СОВЕТ: API Poizon возвращает ошибку 429 'Очередь переполнена'")
-                            logger.error(f"   Это может означать:")
-                            logger.error(f"   1. Слишком частые запросы - увеличьте задержки")
-                            logger.error(f"   2. API перегружен - попробуйте позже")
-                            logger.error(f"   3. Проблема с API ключом - проверьте ключ")
-                            return None
-                    else:
-                        error_text = await response.text()
-                        logger.error(f"❌ Ошибка API {response.status} для {spu_id}: {error_text[:200]}")
-                        return None
-                        
-            except Exception as e:
-                logger.error(f"❌ Ошибка получения деталей товара {spu_id}: {e}")
-                if attempt < max_retries - 1:
-                    await asyncio.sleep(2)
-                    continue
-                return None
+        data = await self._request(session, "productDetail", {"spuId": spu_id},
+                                   f"spuId={spu_id}", max_attempts=max_retries, cache_key=str(spu_id))
+        if data is not None:
+            logger.info(f"✅ Получены детали товара {spu_id}")
+        return data
+    
+    async def _fetch_product_with_prices(self, session: aiohttp.ClientSession,
+                                         spu_id: str, index: int, total: int) -> Optional[Dict]:
+        """
+        Загружает детали товара и его цены (productDetail + priceInfo)
         
-        return None
+        Каждый запрос проходит через _request и глобальный rate_limiter,
+        поэтому параллельные воркеры не превышают лимит API.
+        
+        Args:
+            session: aiohttp сессия
+            spu_id: ID товара (SPU)
+            index: Порядковый номер товара (для логов)
+            total: Общее количество товаров (для логов)
+        
+        Returns:
+            Optional[Dict]: Данные товара с priceInfo или None
+        """
+        logger.info(f"🎯 Товар {index}/{total}: {spu_id}")
+        
+        # Шаг 1: Получаем базовые детали товара
+        product_detail = await self.get_product_detail(session, spu_id)
+        
+        if not product_detail:
+            logger.warning(f"⚠️ Товар {spu_id} пропущен - нет базовых данных")
+            return None
+        
+        # Шаг 2: Получаем детальную информацию о ценах через /priceInfo
+        price_info = await self.get_price_info(session, spu_id)
+        
+        if price_info:
+            # Объединяем данные о ценах с основными данными
+            # priceInfo возвращает структуру {"skus": {...}}
+            logger.info(f"🔗 Объединяем данные товара и цен для {spu_id}")
+            product_detail['priceInfo'] = price_info
+        else:
+            logger.warning(f"⚠️ Для товара {spu_id} не удалось получить детальные цены")
+        
+        # Добавляем SPU ID для удобства
+        product_detail['spuId'] = spu_id
+        return product_detail
     
     async def get_products_by_article_list(self, session: aiohttp.ClientSession,
-                                          article_list: List[str]) -> List[Dict]:
+                                          article_list: List[str],
+                                          max_workers: Optional[int] = None) -> List[Dict]:
         """
         Получение товаров по списку артикулов
         
+        Товары загружаются параллельно несколькими воркерами. Темп запросов
+        определяет rate_limiter, а не фиксированные паузы, поэтому скорость
+        растет вместе с квотой API. Порядок результатов совпадает с порядком
+        article_list (пропущенные товары исключаются).
+        
         Args:
             session: aiohttp сессия
             article_list: Список SPU ID для загрузки
+            max_workers: Количество параллельных воркеров (по умолчанию self.max_workers)
             
         Returns:
             List[Dict]: Список товаров с деталями
         """
-        products = []
+        total = len(article_list)
+        workers = min(max(1, max_workers or self.max_workers), total) if total else 0
+        results: List[Optional[Dict]] = [None] * total
         
-        logger.info(f"📋 Загрузка {len(article_list)} товаров по артикулам")
+        logger.info(f"📋 Загрузка {total} товаров по артикулам ({workers} воркеров)")
         
-        for i, spu_id in enumerate(article_list, 1):
-            logger.info(f"🎯 Товар {i}/{len(article_list)}: {spu_id}")
-            
-            # Шаг 1: Получаем базовые детали товара
-            product_detail = await self.get_product_detail(session, spu_id)
-            
-            if not product_detail:
-                logger.warning(f"⚠️ Товар {spu_id} пропущен - нет базовых данных")
-                await asyncio.sleep(1.5)
-                continue
-            
-            # Шаг 2: Получаем детальную информацию о ценах через /priceInfo
-            await asyncio.sleep(0.5)  # Небольшая пауза между запросами
-            price_info = await self.get_price_info(session, spu_id)
-            
-            if price_info:
-                # Объединяем данные о ценах с основными данными
-                # priceInfo возвращает структуру {"skus": {...}}
-                logger.info(f"🔗 Объединяем данные товара и цен для {spu_id}")
-                product_detail['priceInfo'] = price_info
-            else:
-                logger.warning(f"⚠️ Для товара {spu_id} не удалось получить детальные цены")
-            
-            # Добавляем SPU ID для удобства
-            product_detail['spuId'] = spu_id
-            products.append(product_detail)
-            
-            # Увеличенная пауза между товарами для избежания rate limit
-            await asyncio.sleep(1.5)
+        # Общий итератор: каждый воркер берет следующий SPU, пока список не закончится
+        pending = iter(enumerate(article_list))
         
-        logger.info(f"✅ Загружено {len(products)}/{len(article_list)} товаров")
+        async def worker():
+            for idx, spu_id in pending:
+                try:
+                    results[idx] = await self._fetch_product_with_prices(session, spu_id, idx + 1, total)
+                except Exception as e:
+                    logger.error(f"❌ Ошибка загрузки товара {spu_id}: {e}")
+        
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        
+        products = [product for product in results if product]
+        logger.info(f"✅ Загружено {len(products)}/{total} товаров")
         return products
     
     def get_efficiency(self) -> float:
@@ -360,11 +532,25 @@ class PoizonScraper:
         return (self.successful_requests / self.api_requests) * 100
     
     def get_stats(self) -> Dict:
-        """Возвращает статистику API запросов"""
-        return {
+        """Возвращает статистику API запросов (и кэша, если он включен)"""
+        stats = {
             "total_requests": self.api_requests,
             "successful_requests": self.successful_requests,
             "failed_requests": self.api_requests - self.successful_requests,
-            "efficiency_percent": self.get_efficiency()
+            "efficiency_percent": self.get_efficiency(),
+            "rate_limited_requests": self.rate_limited_requests,
+            "retry_wait_seconds": round(self.retry_wait_seconds, 1),
+            "coalesced_requests": self.coalesced_requests
         }
+        
+        if self.cache is not None:
+            stats.update(self.cache.get_stats())
+        
+        if self.key_pool is not None:
+            stats["api_keys"] = self.key_pool.get_stats()
+        
+        if self.decoder is not None:
+            stats.update(self.decoder.get_stats())
+        
+        return stats
 
@@ -1,13 +1,519 @@
 """
 Калькулятор цен с поддержкой формул для разных категорий и сроков доставки
 """
+import ast
+import copy
+import hashlib
 import json
 import logging
-from typing import Dict, Tuple
+import math
+import os
+import threading
+from types import MappingProxyType
+from typing import Callable, Dict, List, Mapping, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # NumPy необязателен: без него пакетный расчет идет поэлементно
+    np = None
+
+from category_filter import category_filter
 
 logger = logging.getLogger(__name__)
 
 
+# Функции, разрешенные в формулах
+ALLOWED_FUNCTIONS = {
+    "round": round,
+    "min": min,
+    "max": max,
+    "abs": abs,
+    "ceil": math.ceil,
+    "floor": math.floor,
+}
+
+# Разрешенные узлы AST (всё остальное - атрибуты, индексы, лямбды и т.п. - запрещено)
+ALLOWED_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Call, ast.Name, ast.Load, ast.Constant,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+    ast.UAdd, ast.USub,
+)
+
+# Формула на случай, если для срока доставки нет даже формулы по умолчанию
+FALLBACK_FORMULA = "(x * a + 400) * b"
+
+
+class FormulaError(ValueError):
+    """Некорректная формула цены в конфигурации"""
+    pass
+
+
+def compile_formula(formula_str: str, parameters: Dict[str, float]) -> Callable[[float], float]:
+    """
+    Компилирует формулу цены в функцию f(x)
+    
+    Формула разбирается в AST один раз, проверяется по белому списку узлов,
+    параметры (a, b, c, ...) подставляются как константы. Получившаяся функция
+    выполняется без доступа к builtins.
+    
+    Args:
+        formula_str: Формула, например "(x*a+1500)*b"
+        parameters: Параметры формулы {"a": 12, "b": 1.2, ...}
+    
+    Returns:
+        Callable[[float], float]: Функция от цены в CNY
+    
+    Raises:
+        FormulaError: Синтаксическая ошибка, неизвестное имя или запрещенная операция
+    """
+    try:
+        tree = ast.parse(formula_str.strip(), mode='eval')
+    except (SyntaxError, AttributeError) as e:
+        raise FormulaError(f"Синтаксическая ошибка в формуле '{formula_str}': {e}")
+    
+    # Имена в позиции вызываемой функции (round(...)) проверяются отдельно от переменных
+    call_targets = {id(node.func) for node in ast.walk(tree) if isinstance(node, ast.Call)}
+    
+    for node in ast.walk(tree):
+        if not isinstance(node, ALLOWED_NODES):
+            raise FormulaError(f"Недопустимая операция {type(node).__name__} в формуле '{formula_str}'")
+        
+        if isinstance(node, ast.Constant) and (isinstance(node.value, bool)
+                                               or not isinstance(node.value, (int, float))):
+            raise FormulaError(f"Недопустимая константа {node.value!r} в формуле '{formula_str}'")
+        
+        if isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in ALLOWED_FUNCTIONS or node.keywords:
+                raise FormulaError(f"Недопустимый вызов функции в формуле '{formula_str}'")
+        elif isinstance(node, ast.Name) and id(node) not in call_targets \
+                and node.id != 'x' and node.id not in parameters:
+            raise FormulaError(f"Неизвестное имя '{node.id}' в формуле '{formula_str}'")
+    
+    used_parameters = {
+        node.id: parameters[node.id] for node in ast.walk(tree)
+        if isinstance(node, ast.Name) and id(node) not in call_targets and node.id != 'x' and node.id in parameters
+    }
+    
+    class _Substitute(ast.NodeTransformer):
+        def visit_Name(self, node):
+            if id(node) not in call_targets and node.id != 'x' and node.id in parameters:
+                return ast.copy_location(ast.Constant(parameters[node.id]), node)
+            return node
+    
+    body = _Substitute().visit(tree).body
+    func_tree = ast.Expression(body=ast.Lambda(
+        args=ast.arguments(posonlyargs=[], args=[ast.arg(arg='x')], kwonlyargs=[],
+                           kw_defaults=[], defaults=[]),
+        body=body
+    ))
+    ast.fix_missing_locations(func_tree)
+    
+    code = compile(func_tree, f"<formula {formula_str}>", 'eval')
+    formula = eval(code, {"__builtins__": {}, **ALLOWED_FUNCTIONS})
+    # Формулы из одной арифметики можно вычислять сразу над массивом NumPy
+    formula.vectorizable = not call_targets
+    formula.source = formula_str
+    # Параметры, от которых зависит формула (для сравнения наборов формул)
+    formula.parameters = used_parameters
+    return formula
+
+
+def compile_formulas(parameters: Dict, default_formula: Dict[str, str],
+                     formulas: Dict[str, Dict]) -> Tuple[Dict[str, Callable], Dict[str, Dict[str, Callable]]]:
+    """
+    Компилирует весь набор формул конфигурации
+    
+    Args:
+        parameters: Параметры формул
+        default_formula: Формулы по умолчанию {срок_доставки: формула}
+        formulas: Формулы категорий {category_id: {срок_доставки: формула, "name": ...}}
+    
+    Returns:
+        Tuple: (формулы по умолчанию, формулы категорий) в скомпилированном виде
+    
+    Raises:
+        FormulaError: Если хотя бы одна формула или параметр некорректны
+    """
+    for name, value in parameters.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise FormulaError(f"Параметр '{name}' должен быть числом, получено {value!r}")
+    
+    # Одинаковые формулы компилируются один раз (и потом группируются в пакетном расчете)
+    cache: Dict[str, Callable] = {}
+    
+    def compile_cached(formula_str: str) -> Callable:
+        if formula_str not in cache:
+            cache[formula_str] = compile_formula(formula_str, parameters)
+        return cache[formula_str]
+    
+    compiled_default = {
+        delivery_days: compile_cached(formula_str)
+        for delivery_days, formula_str in default_formula.items()
+        if delivery_days in PriceCalculator.DELIVERY_OPTIONS
+    }
+    
+    compiled_categories = {}
+    for category_key, category_formulas in formulas.items():
+        compiled_categories[category_key] = {}
+        for delivery_days in PriceCalculator.DELIVERY_OPTIONS:
+            if delivery_days in category_formulas:
+                try:
+                    compiled_categories[category_key][delivery_days] = compile_cached(
+                        category_formulas[delivery_days]
+                    )
+                except FormulaError as e:
+                    raise FormulaError(f"Категория {category_key}, {delivery_days}: {e}")
+    
+    return compiled_default, compiled_categories
+
+
+def category_parents_from_filter() -> Dict[int, int]:
+    """Возвращает дерево категорий WooCommerce {category_id: parent_id} из plummy_categories.json"""
+    return {category_id: info['parent'] for category_id, info in category_filter.categories_flat.items()}
+
+
+def resolve_category_formulas(compiled_default: Dict[str, Callable],
+                              compiled_categories: Dict[str, Dict[str, Callable]],
+                              category_parents: Mapping[int, int]) -> Dict[str, Dict[int, Callable]]:
+    """
+    Разворачивает наследование формул по дереву категорий в плоскую таблицу
+    
+    Для каждой категории и срока доставки берется формула самой категории,
+    иначе ближайшего предка, у которого она задана, иначе формула по умолчанию.
+    
+    Args:
+        compiled_default: Скомпилированные формулы по умолчанию {срок_доставки: формула}
+        compiled_categories: Скомпилированные формулы категорий {category_id: {срок_доставки: формула}}
+        category_parents: Дерево категорий {category_id: parent_id} (0 - корень)
+    
+    Returns:
+        Dict[str, Dict[int, Callable]]: {срок_доставки: {category_id: формула}}
+    """
+    explicit: Dict[int, Dict[str, Callable]] = {}
+    for category_key, category_formulas in compiled_categories.items():
+        try:
+            explicit[int(category_key)] = category_formulas
+        except (TypeError, ValueError):
+            logger.warning(f"⚠️  Категория '{category_key}' в формулах не является ID и будет пропущена")
+    
+    category_ids = set(category_parents) | set(explicit)
+    resolved: Dict[str, Dict[int, Callable]] = {}
+    for delivery_days, default in compiled_default.items():
+        table = resolved[delivery_days] = {}
+        for category_id in category_ids:
+            formula = default
+            current, visited = category_id, set()
+            # Поднимаемся к корню; visited защищает от циклов в дереве
+            while current and current not in visited:
+                visited.add(current)
+                own = explicit.get(current)
+                if own and delivery_days in own:
+                    formula = own[delivery_days]
+                    break
+                current = category_parents.get(current)
+            table[category_id] = formula
+    
+    return resolved
+
+
+class FormulaSet:
+    """
+    Неизменяемый версионированный набор формул
+    (параметры + формулы по умолчанию + формулы категорий)
+    
+    Все формулы компилируются в конструкторе; некорректный набор не создается.
+    Подкатегории без своих формул наследуют формулы ближайшего предка в дереве
+    категорий - наследование разворачивается один раз в плоскую таблицу.
+    Версия - хэш от параметров и формул, поэтому одинаковые наборы имеют
+    одинаковую версию в любом процессе и после перезапуска.
+    """
+    
+    def __init__(self, parameters: Dict, default_formula: Dict[str, str], formulas: Dict[str, Dict],
+                 category_parents: Optional[Mapping[int, int]] = None):
+        """
+        Args:
+            parameters: Параметры формул {"a": 12, "b": 1.2, ...}
+            default_formula: Формулы по умолчанию {срок_доставки: формула}
+            formulas: Формулы категорий {category_id: {срок_доставки: формула, "name": ...}}
+            category_parents: Дерево категорий {category_id: parent_id}
+                (по умолчанию - из plummy_categories.json через category_filter)
+        
+        Raises:
+            FormulaError: Если хотя бы одна формула или параметр некорректны
+        """
+        # Копии, чтобы изменение исходных словарей не меняло набор
+        parameters = copy.deepcopy(parameters)
+        default_formula = copy.deepcopy(default_formula)
+        formulas = copy.deepcopy(formulas)
+        
+        compiled_default, compiled = compile_formulas(parameters, default_formula, formulas)
+        
+        # Для сроков без формулы по умолчанию - запасная формула
+        for delivery_days in PriceCalculator.DELIVERY_OPTIONS:
+            if delivery_days not in compiled_default:
+                compiled_default[delivery_days] = compile_formula(FALLBACK_FORMULA, parameters)
+        
+        if category_parents is None:
+            category_parents = category_parents_from_filter()
+        resolved = resolve_category_formulas(compiled_default, compiled, category_parents)
+        
+        object.__setattr__(self, 'parameters', MappingProxyType(parameters))
+        object.__setattr__(self, 'default_formula', MappingProxyType(default_formula))
+        object.__setattr__(self, 'formulas', MappingProxyType(
+            {key: MappingProxyType(value) for key, value in formulas.items()}
+        ))
+        object.__setattr__(self, '_compiled_default', MappingProxyType(compiled_default))
+        object.__setattr__(self, '_compiled', MappingProxyType(
+            {key: MappingProxyType(value) for key, value in compiled.items()}
+        ))
+        object.__setattr__(self, '_resolved', MappingProxyType(
+            {key: MappingProxyType(value) for key, value in resolved.items()}
+        ))
+        object.__setattr__(self, 'version', self._make_version())
+    
+    def __setattr__(self, name, value):
+        raise AttributeError("FormulaSet неизменяем - создайте новый набор")
+    
+    def _make_version(self) -> str:
+        """Хэш от параметров и действующих формул (названия категорий не учитываются)"""
+        canonical = {
+            "parameters": dict(self.parameters),
+            "default": {d: f.source for d, f in self._compiled_default.items()},
+            "categories": {key: {d: f.source for d, f in value.items()}
+                           for key, value in self._compiled.items() if value}
+        }
+        # Формулы, унаследованные от предков: версия меняется и при изменении дерева категорий
+        inherited = {}
+        for delivery_days, table in self._resolved.items():
+            for category_id, formula in table.items():
+                own = self._compiled.get(str(category_id), {})
+                if delivery_days not in own and formula is not self._compiled_default[delivery_days]:
+                    inherited.setdefault(delivery_days, {})[str(category_id)] = formula.source
+        if inherited:
+            canonical["inherited"] = inherited
+        payload = json.dumps(canonical, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:12]
+    
+    @classmethod
+    def from_config(cls, config: Dict, category_parents: Optional[Mapping[int, int]] = None) -> 'FormulaSet':
+        """
+        Создает набор из конфигурации в формате price_formulas.json
+        
+        Raises:
+            FormulaError: Если конфигурация некорректна
+        """
+        formulas_config = config.get('formulas', {})
+        return cls(config.get('parameters', {}),
+                   formulas_config.get('default', {}),
+                   formulas_config.get('categories', {}),
+                   category_parents)
+    
+    def to_config(self) -> Dict:
+        """Возвращает набор в формате price_formulas.json"""
+        return {
+            "parameters": dict(self.parameters),
+            "formulas": {
+                "default": dict(self.default_formula),
+                "categories": {key: dict(value) for key, value in self.formulas.items()}
+            }
+        }
+    
+    def get_formula(self, category_id: int, delivery_days: str) -> str:
+        """
+        Получает формулу для категории и срока доставки
+        
+        Args:
+            category_id: ID категории WooCommerce
+            delivery_days: Срок доставки ("21-26 дней" или "10-14 дней")
+        
+        Returns:
+            str: Формула в виде строки (своя, унаследованная от предка или по умолчанию)
+        """
+        return self.get_compiled_formula(category_id, delivery_days).source
+    
+    def get_compiled_formula(self, category_id: int, delivery_days: str) -> Callable[[float], float]:
+        """
+        Получает скомпилированную формулу для категории и срока доставки
+        
+        Один поиск в таблице, где наследование по дереву категорий уже развернуто.
+        
+        Args:
+            category_id: ID категории WooCommerce
+            delivery_days: Срок доставки
+        
+        Returns:
+            Callable[[float], float]: Функция от цены в CNY
+        """
+        table = self._resolved.get(delivery_days)
+        if table is None:
+            return compile_formula(FALLBACK_FORMULA, self.parameters)
+        
+        formula = table.get(category_id)
+        if formula is None and category_id is not None and not isinstance(category_id, int):
+            # ID категории из JSON/БД может прийти строкой
+            try:
+                formula = table.get(int(category_id))
+            except (TypeError, ValueError):
+                pass
+        return formula if formula is not None else self._compiled_default[delivery_days]
+    
+    def calculate_price(self, price_cny: float, category_id: int, delivery_days: str) -> float:
+        """
+        Вычисляет цену по формуле
+        
+        Args:
+            price_cny: Цена в CNY
+            category_id: ID категории WooCommerce
+            delivery_days: Срок доставки
+        
+        Returns:
+            float: Цена в RUB
+        
+        Raises:
+            FormulaError: Ошибка вычисления (например, деление на ноль)
+        """
+        formula = self.get_compiled_formula(category_id, delivery_days)
+        
+        try:
+            # Конвертируем в float на случай если пришел Decimal
+            price_rub = formula(float(price_cny))
+        except (ArithmeticError, ValueError, TypeError) as e:
+            formula_str = self.get_formula(category_id, delivery_days)
+            logger.error(f"❌ Ошибка вычисления формулы '{formula_str}': {e}")
+            raise FormulaError(f"Ошибка вычисления формулы '{formula_str}' для {price_cny} CNY: {e}")
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"💰 Цена: {price_cny} CNY → {price_rub:.0f} RUB")
+            logger.debug(f"   Категория: {category_id}, Доставка: {delivery_days}")
+            logger.debug(f"   Формула: {self.get_formula(category_id, delivery_days)}")
+        
+        return round(price_rub, 2)
+    
+    def calculate_prices_batch(self, prices_cny: Sequence[float], category_ids: Sequence[int],
+                               delivery: str) -> List[float]:
+        """
+        Вычисляет цены для множества вариантов за один вызов
+        
+        Входы группируются по формуле; каждая группа арифметических формул
+        считается одним выражением над массивом NumPy. Результат совпадает
+        с calculate_price поэлементно (то же округление до 2 знаков).
+        Без NumPy и для формул с функциями (round, ceil, ...) расчет поэлементный.
+        
+        Args:
+            prices_cny: Цены в CNY
+            category_ids: ID категорий WooCommerce (по одному на цену)
+            delivery: Срок доставки
+        
+        Returns:
+            List[float]: Цены в RUB в порядке входных данных
+        
+        Raises:
+            ValueError: Если длины prices_cny и category_ids различаются
+            FormulaError: Ошибка вычисления формулы
+        """
+        if len(prices_cny) != len(category_ids):
+            raise ValueError(f"Разная длина prices_cny ({len(prices_cny)}) и category_ids ({len(category_ids)})")
+        
+        # Группируем позиции по скомпилированной формуле (формула ищется один раз на категорию)
+        formula_by_category: Dict[int, Callable] = {}
+        groups: Dict[int, Tuple[Callable, List[int]]] = {}
+        for index, category_id in enumerate(category_ids):
+            formula = formula_by_category.get(category_id)
+            if formula is None:
+                formula = formula_by_category[category_id] = self.get_compiled_formula(category_id, delivery)
+            groups.setdefault(id(formula), (formula, []))[1].append(index)
+        
+        all_prices = np.asarray(prices_cny, dtype=np.float64) if np is not None else None
+        
+        results: List[float] = [0.0] * len(prices_cny)
+        for formula, indexes in groups.values():
+            try:
+                if np is not None and formula.vectorizable:
+                    x = all_prices[np.asarray(indexes, dtype=np.intp)]
+                    # Деление на ноль и переполнение - ошибка, как в скалярном расчете
+                    with np.errstate(all='raise'):
+                        values = np.broadcast_to(np.asarray(formula(x), dtype=np.float64), x.shape)
+                    values = _round_array(values)
+                else:
+                    values = [round(formula(float(prices_cny[i])), 2) for i in indexes]
+            except (ArithmeticError, ValueError, TypeError) as e:
+                logger.error(f"❌ Ошибка вычисления формулы '{formula.source}': {e}")
+                raise FormulaError(f"Ошибка вычисления формулы '{formula.source}': {e}")
+            
+            for index, value in zip(indexes, values):
+                results[index] = value
+        
+        return results
+
+
+class FormulaDiff:
+    """
+    Разница между двумя наборами формул
+    
+    Формула для (категория, срок доставки) считается измененной, если поменялась
+    действующая для нее формула или значение параметра, который в ней используется.
+    Действующая формула берется с учетом наследования по дереву категорий,
+    поэтому изменение формулы родителя затрагивает и его подкатегории.
+    """
+    
+    def __init__(self, old: FormulaSet, new: FormulaSet):
+        """
+        Args:
+            old: Набор формул, по которому посчитаны текущие цены
+            new: Новый набор формул
+        """
+        self.old = old
+        self.new = new
+        self._changed: Dict[str, Tuple[str, ...]] = {}
+    
+    @staticmethod
+    def _signature(formula_set: FormulaSet, category_id, delivery_days: str) -> Tuple:
+        formula = formula_set.get_compiled_formula(category_id, delivery_days)
+        return formula.source, tuple(sorted(formula.parameters.items()))
+    
+    def changed_options(self, category_id) -> Tuple[str, ...]:
+        """
+        Возвращает сроки доставки, цены которых изменились для категории
+        
+        Args:
+            category_id: ID категории WooCommerce (None - формулы по умолчанию)
+        
+        Returns:
+            Tuple[str, ...]: Измененные сроки доставки (пусто - категория не затронута)
+        """
+        key = str(category_id)
+        if key not in self._changed:
+            self._changed[key] = tuple(
+                delivery_days for delivery_days in PriceCalculator.DELIVERY_OPTIONS
+                if self._signature(self.old, category_id, delivery_days)
+                != self._signature(self.new, category_id, delivery_days)
+            )
+        return self._changed[key]
+    
+    def is_affected(self, category_id, delivery_days: Optional[str] = None) -> bool:
+        """Изменилась ли цена для категории (и срока доставки, если указан)"""
+        changed = self.changed_options(category_id)
+        return bool(changed) if delivery_days is None else delivery_days in changed
+    
+    def changed_categories(self) -> Dict[str, Tuple[str, ...]]:
+        """
+        Возвращает категории с явными формулами, цены которых изменились
+        (ключ "default" - формулы по умолчанию для всех остальных категорий)
+        """
+        result = {}
+        if self.changed_options(None):
+            result["default"] = self.changed_options(None)
+        for category_key in sorted(set(self.old.formulas) | set(self.new.formulas)):
+            if self.changed_options(category_key):
+                result[category_key] = self.changed_options(category_key)
+        return result
+    
+    @property
+    def is_empty(self) -> bool:
+        """Наборы дают одинаковые цены во всех категориях"""
+        return not self.changed_categories()
+
+
 class PriceCalculator:
     """Калькулятор цен с формулами по категориям"""
     
@@ -21,41 +527,86 @@ class PriceCalculator:
             config_file: Путь к файлу конфигурации формул
         """
         self.config_file = config_file
-        self.parameters = {}
-        self.formulas = {}
-        self.default_formula = {}
+        # Текущий набор формул. Заменяется целиком одним присваиванием, поэтому
+        # расчет, взявший набор в начале прохода, не увидит половину нового
+        self.formula_set: Optional[FormulaSet] = None
+        self._reload_lock = threading.Lock()
+        self._watcher: Optional['FormulaWatcher'] = None
         self.load_config()
     
+    @property
+    def version(self) -> str:
+        """Версия текущего набора формул"""
+        return self.formula_set.version
+    
+    @property
+    def parameters(self) -> Dict:
+        return self.formula_set.parameters
+    
+    @property
+    def formulas(self) -> Dict:
+        return self.formula_set.formulas
+    
+    @property
+    def default_formula(self) -> Dict:
+        return self.formula_set.default_formula
+    
     def load_config(self):
-        """Загружает конфигурацию формул из файла"""
+        """
+        Загружает конфигурацию формул из файла и компилирует формулы
+        
+        Если в файле есть некорректная формула, конфигурация отклоняется целиком:
+        остаются ранее загруженные формулы (при первой загрузке - по умолчанию).
+        Новый набор полностью собирается и компилируется до замены текущего.
+        """
+        with self._reload_lock:
+            self._load_config()
+    
+    def _load_config(self):
+        """Загрузка конфигурации (вызывается под _reload_lock)"""
         try:
             with open(self.config_file, 'r', encoding='utf-8') as f:
                 config = json.load(f)
             
-            self.parameters = config.get('parameters', {})
-            formulas_config = config.get('formulas', {})
+            formula_set = FormulaSet.from_config(config)
+            previous = self.formula_set
+            self.formula_set = formula_set
             
-            self.default_formula = formulas_config.get('default', {})
-            self.formulas = formulas_config.get('categories', {})
+            if previous is not None and previous.version == formula_set.version:
+                logger.debug(f"Формулы не изменились (версия {formula_set.version})")
+                return
             
-            logger.info(f"✅ Загружены формулы для {len(self.formulas)} категорий")
+            logger.info(f"✅ Загружены формулы для {len(self.formulas)} категорий (версия {formula_set.version})")
             logger.info(f"   Параметры: a={self.parameters.get('a')}, b={self.parameters.get('b')}, c={self.parameters.get('c')}")
-            
+        
+        except FormulaError as e:
+            logger.error(f"❌ Конфигурация {self.config_file} отклонена: {e}")
+            if self.formula_set is not None:
+                logger.warning("⚠️  Продолжаем с ранее загруженными формулами")
+            else:
+                self._set_defaults()
         except FileNotFoundError:
+            if self.formula_set is not None:
+                logger.warning(f"⚠️  Файл {self.config_file} не найден, продолжаем с ранее загруженными формулами")
+                return
             logger.warning(f"⚠️  Файл {self.config_file} не найден, используются формулы по умолчанию")
             self._set_defaults()
         except Exception as e:
             logger.error(f"❌ Ошибка загрузки конфигурации: {e}")
-            self._set_defaults()
+            # Например, файл прочитан в момент записи - не теряем рабочие формулы
+            if self.formula_set is None:
+                self._set_defaults()
     
     def _set_defaults(self):
         """Устанавливает формулы по умолчанию"""
-        self.parameters = {"a": 12, "b": 1.2, "c": 6}
-        self.default_formula = {
-            "21-26 дней": "(x * a + 400) * b",
-            "10-14 дней": "(x * a + 400) * b + 600"
-        }
-        self.formulas = {}
+        self.formula_set = FormulaSet(
+            {"a": 12, "b": 1.2, "c": 6},
+            {
+                "21-26 дней": "(x * a + 400) * b",
+                "10-14 дней": "(x * a + 400) * b + 600"
+            },
+            {}
+        )
     
     def get_formula(self, category_id: int, delivery_days: str) -> str:
         """
@@ -64,20 +615,24 @@ class PriceCalculator:
         Args:
             category_id: ID категории WooCommerce
             delivery_days: Срок доставки ("21-26 дней" или "10-14 дней")
-            
+        
         Returns:
             str: Формула в виде строки
         """
-        # Проверяем есть ли формула для конкретной категории
-        category_key = str(category_id)
+        return self.formula_set.get_formula(category_id, delivery_days)
+    
+    def get_compiled_formula(self, category_id: int, delivery_days: str) -> Callable[[float], float]:
+        """
+        Получает скомпилированную формулу для категории и срока доставки
         
-        if category_key in self.formulas:
-            category_formulas = self.formulas[category_key]
-            if delivery_days in category_formulas:
-                return category_formulas[delivery_days]
+        Args:
+            category_id: ID категории WooCommerce
+            delivery_days: Срок доставки
         
-        # Возвращаем формулу по умолчанию
-        return self.default_formula.get(delivery_days, "(x * a + 400) * b")
+        Returns:
+            Callable[[float], float]: Функция от цены в CNY
+        """
+        return self.formula_set.get_compiled_formula(category_id, delivery_days)
     
     def calculate_price(self, price_cny: float, category_id: int, delivery_days: str) -> float:
         """
@@ -87,33 +642,47 @@ class PriceCalculator:
             price_cny: Цена в CNY
             category_id: ID категории WooCommerce
             delivery_days: Срок доставки
-            
+        
         Returns:
             float: Цена в RUB
+        
+        Raises:
+            FormulaError: Ошибка вычисления (например, деление на ноль)
         """
-        formula_str = self.get_formula(category_id, delivery_days)
+        return self.formula_set.calculate_price(price_cny, category_id, delivery_days)
+    
+    def calculate_prices_batch(self, prices_cny: Sequence[float], category_ids: Sequence[int],
+                               delivery: str) -> List[float]:
+        """
+        Вычисляет цены для множества вариантов за один вызов (см. FormulaSet.calculate_prices_batch)
         
-        # Подготавливаем переменные для eval
-        # Конвертируем в float на случай если пришел Decimal
-        x = float(price_cny)
-        a = self.parameters.get('a', 12)
-        b = self.parameters.get('b', 1.2)
-        c = self.parameters.get('c', 6)
+        Args:
+            prices_cny: Цены в CNY
+            category_ids: ID категорий WooCommerce (по одному на цену)
+            delivery: Срок доставки
         
-        try:
-            # Вычисляем формулу
-            price_rub = eval(formula_str)
-            
-            logger.debug(f"💰 Цена: {price_cny} CNY → {price_rub:.0f} RUB")
-            logger.debug(f"   Категория: {category_id}, Доставка: {delivery_days}")
-            logger.debug(f"   Формула: {formula_str}")
-            
-            return round(price_rub, 2)
-            
-        except Exception as e:
-            logger.error(f"❌ Ошибка вычисления формулы '{formula_str}': {e}")
-            # Fallback на простую формулу
-            return round(float(price_cny) * 2.5, 2)
+        Returns:
+            List[float]: Цены в RUB в порядке входных данных
+        """
+        return self.formula_set.calculate_prices_batch(prices_cny, category_ids, delivery)
+    
+    def start_watcher(self, interval: float = 2.0):
+        """
+        Запускает фоновое отслеживание изменений файла формул
+        
+        Args:
+            interval: Период проверки файла в секундах
+        """
+        if self._watcher is not None and self._watcher.is_alive():
+            return
+        self._watcher = FormulaWatcher(self, interval)
+        self._watcher.start()
+    
+    def stop_watcher(self):
+        """Останавливает фоновое отслеживание файла формул"""
+        if self._watcher is not None:
+            self._watcher.stop()
+            self._watcher = None
     
     def calculate_prices_for_variant(self, price_cny: float, category_id: int) -> Dict[str, float]:
         """
@@ -122,14 +691,16 @@ class PriceCalculator:
         Args:
             price_cny: Цена в CNY
             category_id: ID категории WooCommerce
-            
+        
         Returns:
             Dict[str, float]: Словарь {срок_доставки: цена_rub}
         """
         prices = {}
+        # Все сроки доставки считаем по одному набору формул
+        formula_set = self.formula_set
         
         for delivery_days in self.DELIVERY_OPTIONS:
-            prices[delivery_days] = self.calculate_price(price_cny, category_id, delivery_days)
+            prices[delivery_days] = formula_set.calculate_price(price_cny, category_id, delivery_days)
         
         return prices
     
@@ -138,6 +709,104 @@ class PriceCalculator:
         return self.DELIVERY_OPTIONS.copy()
 
 
+def _round_array(values) -> List[float]:
+    """
+    Округляет массив до 2 знаков так же, как round(value, 2)
+    
+    np.round считает через value*100 и может ошибиться на значениях вида ...xx5,
+    которые не представимы точно в двоичном виде. Такие пограничные элементы
+    пересчитываются обычным round().
+    """
+    scaled = values * 100
+    rounded = np.round(values, 2)
+    ambiguous = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    result = rounded.tolist()
+    for index in np.flatnonzero(ambiguous).tolist():
+        result[index] = round(float(values[index]), 2)
+    return result
+
+
+class FormulaWatcher(threading.Thread):
+    """
+    Фоновый поток, перечитывающий файл формул при его изменении
+    
+    Изменение определяется по времени модификации и размеру файла. Сборка
+    и компиляция нового набора идут в этом потоке, а расчеты продолжают
+    пользоваться старым набором до момента замены.
+    """
+    
+    def __init__(self, calculator: PriceCalculator, interval: float = 2.0):
+        """
+        Args:
+            calculator: Калькулятор, формулы которого нужно обновлять
+            interval: Период проверки файла в секундах
+        """
+        super().__init__(name="FormulaWatcher", daemon=True)
+        self.calculator = calculator
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._last_stat = self._stat()
+    
+    def _stat(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self.calculator.config_file)
+            return st.st_mtime_ns, st.st_size
+        except OSError:
+            return None
+    
+    def run(self):
+        logger.info(f"👀 Отслеживание изменений {self.calculator.config_file} (каждые {self.interval} сек)")
+        while not self._stop_event.wait(self.interval):
+            current = self._stat()
+            if current is None or current == self._last_stat:
+                continue
+            self._last_stat = current
+            logger.info(f"🔄 Файл {self.calculator.config_file} изменен - перечитываем формулы")
+            self.calculator.load_config()
+    
+    def stop(self):
+        """Останавливает поток"""
+        self._stop_event.set()
+
+
+class CalculatorFormula:
+    """
+    Формула цены для ProductProcessor по формулам глобального калькулятора
+    
+    Цены, посчитанные через нее, помечаются версией набора формул и попадают
+    в инкрементальный пересчет (reprice). Сам набор в объекте не хранится,
+    поэтому объект можно передать в процесс-воркер (см. parse_pool).
+    """
+    
+    def __init__(self, category_id: int = 103, delivery_days: str = PriceCalculator.DELIVERY_OPTIONS[0]):
+        """
+        Args:
+            category_id: Категория по умолчанию (если у товара категория не известна)
+            delivery_days: Срок доставки, по формуле которого считается цена
+        """
+        self.category_id = category_id
+        self.delivery_days = delivery_days
+    
+    def __call__(self, price_cny: float, formula_set: Optional[FormulaSet] = None,
+                 category_id: Optional[int] = None) -> float:
+        """
+        Рассчитывает цену в рублях
+        
+        Args:
+            price_cny: Цена в CNY
+            formula_set: Набор формул (по умолчанию текущий набор price_calculator)
+            category_id: ID категории товара (по умолчанию category_id формулы)
+        
+        Returns:
+            float: Цена в рублях
+        """
+        formula_set = formula_set or price_calculator.formula_set
+        return formula_set.calculate_price(price_cny, category_id or self.category_id, self.delivery_days)
+    
+    def __repr__(self):
+        return f"<CalculatorFormula(category_id={self.category_id}, delivery_days={self.delivery_days!r})>"
+
+
 # Глобальный экземпляр калькулятора
 price_calculator = PriceCalculator()
 
@@ -4,11 +4,42 @@
 """
 import logging
 import re
-from typing import Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
+
+from payload_schema import merge_path_stats, product_schema
+from price_calculator import CalculatorFormula, FormulaSet, price_calculator
 
 logger = logging.getLogger(__name__)
 
 
+# Допустимые типы цен в порядке приоритета (остальные типы - 3, 4, 95 и др. - пропускаем):
+# 2 - обычная цена (только с быстрой доставкой), 12 - спец. цена, 0 - неизвестный тип,
+# 8 - скидочная цена, 11 - новинка/спец. предложение
+PRICE_TYPE_PRIORITY = (2, 12, 0, 8, 11)
+# Типы, для которых берется первая цена без проверки срока доставки
+FALLBACK_PRICE_TYPES = PRICE_TYPE_PRIORITY[1:]
+FALLBACK_PRICE_TYPES_SET = frozenset(FALLBACK_PRICE_TYPES)
+
+PRICE_TYPE_LOG = {
+    2: "найдена обычная цена (type=2)",
+    12: "найдена спец. цена (type=12)",
+    0: "найдена цена type=0 (неизвестный тип)",
+    8: "найдена скидочная цена (type=8)",
+    11: "найдена цена новинки (type=11)",
+}
+
+# Заглушка для цены без timeDelivery (не изменяется)
+_NO_DELIVERY: Dict = {}
+
+# Обозначения ширины обуви в level=2 свойствах SKU (D, E, 2E, W, 宽 - широкие, 窄 - узкие)
+SHOE_WIDTH_INDICATORS = frozenset(['D', 'E', 'W', 'EE', 'EEE', '2E', '3E', '4E', 'D宽', 'E宽', '2E宽', '宽', '窄'])
+# Каждое обозначение содержит один из этих символов, поэтому поиск подстроки сводится к ним
+SHOE_WIDTH_CHARS = re.compile(r'[DEW宽窄]')
+
+# Обозначения ширины при поиске размера среди любых свойств SKU
+FALLBACK_WIDTH_VALUES = frozenset(['D', 'E', 'W', 'EE', 'EEE', '2E', '3E', '4E', 'D宽', 'E宽', '2E宽'])
+
+
 class ProductProcessor:
     """Процессор для обработки данных товаров"""
     
@@ -27,12 +58,15 @@ class ProductProcessor:
         Инициализация процессора
         
         Args:
-            price_formula: Функция для расчета цены (опционально)
+            price_formula: Функция для расчета цены (опционально). Цены помечаются версией
+                формул, только если это CalculatorFormula
         """
         self.price_formula = price_formula
         self.processed_count = 0
         self.valid_count = 0
         self.invalid_reasons = {}
+        # Какой путь схемы сработал для каждого поля: {поле: {путь: количество}}
+        self.field_paths: Dict[str, Dict[str, int]] = {}
     
     def clean_title(self, title: str) -> str:
         """
@@ -138,7 +172,87 @@ class ProductProcessor:
         
         return False
     
-    def parse_product_detail(self, product_data: dict, reference_sku_id: Optional[str] = None, category_ids: Optional[List[int]] = None) -> Optional[Dict]:
+    @staticmethod
+    def _select_price(prices_list, missing_trade_type=0) -> Tuple[Optional[dict], Optional[int]]:
+        """
+        Выбирает цену SKU по приоритету типов (PRICE_TYPE_PRIORITY) за один проход
+        
+        Для type=2 берется первая цена с быстрой доставкой (timeDelivery.max <= 4),
+        для остальных типов - первая цена этого типа. Если первая найденная цена
+        типа пустая ({}), выбор переходит к следующему по приоритету типу.
+        
+        Args:
+            prices_list: Список цен SKU (priceInfo или price.prices)
+            missing_trade_type: Тип цены без поля tradeType
+                (0 для priceInfo, None для price.prices - там такая цена не подходит)
+            
+        Returns:
+            Tuple[Optional[dict], Optional[int]]: (цена, ее тип) или (None, None)
+        """
+        first_by_type = {}
+        for price_obj in prices_list:
+            if not isinstance(price_obj, dict):
+                continue
+            
+            trade_type = price_obj.get('tradeType', missing_trade_type)
+            # Срок доставки проверяется у каждой цены до первой подходящей type=2
+            max_delivery = price_obj.get('timeDelivery', _NO_DELIVERY).get('max', 999)
+            is_fast = max_delivery <= 4 and trade_type != 95
+            
+            if trade_type == 2 and is_fast:
+                return price_obj, 2
+            
+            try:
+                if trade_type in FALLBACK_PRICE_TYPES_SET and trade_type not in first_by_type:
+                    first_by_type[trade_type] = price_obj
+            except TypeError:
+                # Нехэшируемый tradeType (список, словарь) не совпадает ни с одним типом
+                continue
+        
+        for price_type in FALLBACK_PRICE_TYPES:
+            price_obj = first_by_type.get(price_type)
+            if price_obj:
+                return price_obj, price_type
+        
+        return None, None
+    
+    @staticmethod
+    def _scan_sku_properties(properties, property_to_size: Dict) -> Tuple[Optional[int], Optional[str]]:
+        """
+        Находит цвет и размер SKU за один проход по его properties
+        
+        Args:
+            properties: properties SKU
+            property_to_size: Маппинг propertyValueId → размер из saleProperties
+            
+        Returns:
+            Tuple: (propertyValueId первого свойства level=1, размер из маппинга или None)
+        """
+        color_id = None
+        color_found = False
+        size_eu = None
+        
+        for prop in properties:
+            if not isinstance(prop, dict):
+                continue
+            
+            if not color_found and prop.get('level') == 1:
+                color_id = prop.get('propertyValueId')
+                color_found = True
+            
+            # Размер: обычно level=2, но иногда level=1
+            if size_eu is None:
+                prop_value_id = prop.get('propertyValueId')
+                if prop_value_id in property_to_size and prop.get('level', 0) in (1, 2):
+                    size_eu = property_to_size[prop_value_id]
+            
+            if color_found and size_eu is not None:
+                break
+        
+        return color_id, size_eu
+    
+    def parse_product_detail(self, product_data: dict, reference_sku_id: Optional[str] = None, category_ids: Optional[List[int]] = None,
+                             formula_set: Optional[FormulaSet] = None) -> Optional[Dict]:
         """
         Парсит детали товара и извлекает нужную информацию
         
@@ -146,6 +260,7 @@ class ProductProcessor:
             product_data: Данные товара от API
             reference_sku_id: Опциональный SKU ID для определения правильного цвета
             category_ids: Опциональный список ID категорий WooCommerce для определения типа товара
+            formula_set: Набор формул для CalculatorFormula (по умолчанию текущий набор price_calculator)
             
         Returns:
             Optional[Dict]: Обработанные данные или None
@@ -166,48 +281,13 @@ class ProductProcessor:
             
             logger.debug(f"🔍 Обработка SPU {spu_id}...")
             
-            # ДИАГНОСТИКА: Выводим все ключи данных товара
-            logger.info(f"🔍 Товар {spu_id} - доступные поля: {list(product_data.keys())}")
-            
-            # Извлекаем основную информацию - пробуем разные варианты
-            title = None
-            
-            # Вариант 1: Прямые поля
-            title = (product_data.get('title') or 
-                    product_data.get('name') or 
-                    product_data.get('productName') or 
-                    product_data.get('spuName'))
-            
-            # Вариант 2: Поле detail
-            if not title and 'detail' in product_data:
-                detail = product_data['detail']
-                if isinstance(detail, dict):
-                    title = (detail.get('title') or 
-                            detail.get('name') or 
-                            detail.get('productName') or
-                            detail.get('spuName') or
-                            detail.get('desc') or
-                            detail.get('description'))
-                    logger.info(f"🔍 Проверяем detail: {list(detail.keys())[:10]}")
-            
-            # Вариант 3: Поле basicParam
-            if not title and 'basicParam' in product_data:
-                basic = product_data['basicParam']
-                if isinstance(basic, dict):
-                    title = (basic.get('title') or 
-                            basic.get('name') or
-                            basic.get('productName') or
-                            basic.get('spuName'))
-                    logger.info(f"🔍 Проверяем basicParam: {list(basic.keys())[:10]}")
-            
-            # Вариант 4: Поле detailModel
-            if not title and 'detailModel' in product_data:
-                detail_model = product_data['detailModel']
-                if isinstance(detail_model, dict):
-                    title = (detail_model.get('title') or 
-                            detail_model.get('name') or
-                            detail_model.get('productName'))
-                    logger.info(f"🔍 Проверяем detailModel: {list(detail_model.keys())[:10]}")
+            # ДИАГНОСТИКА: ключи данных товара (только в debug - список ключей строится на каждый товар)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"🔍 Товар {spu_id} - доступные поля: {list(product_data.keys())}")
+            
+            # Извлекаем основную информацию по схеме (title, name, ... в product_data, detail,
+            # basicParam, detailModel - см. payload_schema.PRODUCT_SCHEMA)
+            title = self._extract('title', product_data)
             
             # Очищаем название от китайских символов
             if title:
@@ -246,25 +326,21 @@ class ProductProcessor:
             
             # ПРИОРИТЕТ 2: Если не нашли SKU-специфичное изображение - берем из detail.logoUrl
             if not logo_url:
-                if 'detail' in product_data and isinstance(product_data['detail'], dict):
-                    logo_url = product_data['detail'].get('logoUrl')
-                    logger.info(f"🖼️ Основное изображение из detail.logoUrl: {bool(logo_url)}")
+                logo_url = self._extract('logo_url', product_data)
+                logger.info(f"🖼️ Основное изображение из detail.logoUrl: {bool(logo_url)}")
             
             # Из image.spuImage.images - дополнительные изображения (согласно документации)
-            if 'image' in product_data and isinstance(product_data['image'], dict):
-                spu_image = product_data['image'].get('spuImage', {})
-                if isinstance(spu_image, dict):
-                    images_list = spu_image.get('images', [])
-                    if isinstance(images_list, list):
-                        # Изображения - это объекты с полем 'url'
-                        for img in images_list:
-                            if isinstance(img, dict):
-                                img_url = img.get('url')
-                                if img_url:
-                                    images.append(img_url)
-                            elif isinstance(img, str):
-                                images.append(img)
-                        logger.info(f"🖼️ Дополнительные изображения из image.spuImage.images: {len(images)}")
+            images_list = self._extract('images', product_data)
+            if isinstance(images_list, list) and images_list:
+                # Изображения - это объекты с полем 'url'
+                for img in images_list:
+                    if isinstance(img, dict):
+                        img_url = img.get('url')
+                        if img_url:
+                            images.append(img_url)
+                    elif isinstance(img, str):
+                        images.append(img)
+                logger.info(f"🖼️ Дополнительные изображения из image.spuImage.images: {len(images)}")
             
             # Собираем все изображения
             all_images = []
@@ -280,29 +356,14 @@ class ProductProcessor:
             
             logger.info(f"✅ Всего изображений: {len(all_images)}")
             
-            # Бренд - из brandRootInfo или detail
-            brand = ''
-            if 'brandRootInfo' in product_data:
-                brand_root = product_data['brandRootInfo']
-                if isinstance(brand_root, dict):
-                    brand_items = brand_root.get('brandItemList', [])
-                    if brand_items and isinstance(brand_items, list) and len(brand_items) > 0:
-                        raw_brand = brand_items[0].get('brandName', '')
-                        # Валидация: оставляем только английские буквы, цифры и пробелы
-                        brand = self._sanitize_brand_name(raw_brand)
-            
-            # Артикул - из detail
-            article_number = ''
-            if 'detail' in product_data and isinstance(product_data['detail'], dict):
-                article_number = product_data['detail'].get('articleNumber', '')
-            
-            # Категория Dewu - из detail
-            category_id = None
-            category_name = ''
-            if 'detail' in product_data and isinstance(product_data['detail'], dict):
-                detail = product_data['detail']
-                category_id = detail.get('categoryId')
-                category_name = detail.get('categoryName', '')
+            # Бренд - из brandRootInfo
+            # Валидация: оставляем только английские буквы, цифры и пробелы
+            brand = self._sanitize_brand_name(self._extract('brand', product_data))
+            
+            # Артикул и категория Dewu - из detail
+            article_number = self._extract('article_number', product_data)
+            category_id = self._extract('category_id', product_data)
+            category_name = self._extract('category_name', product_data)
             
             logger.info(f"🏷️  Бренд: {brand}, Артикул: {article_number}")
             if category_id:
@@ -390,7 +451,7 @@ class ProductProcessor:
             # Извлекаем данные из priceInfo если есть
             price_info_data = product_data.get('priceInfo', {})
             price_info_skus = {}
-
+            
             if price_info_data:
                 # priceInfo возвращает {"skus": {skuId: {...}, ...}}
                 price_info_skus = price_info_data.get('skus', {})
@@ -454,22 +515,31 @@ class ProductProcessor:
             variants = []
             found_one_size_variant = False  # Флаг для аксессуаров с ONE SIZE
             
+            # Набор формул фиксируется один раз на товар: по нему считаются все цены
+            # и его версией они помечаются (формулы могут перечитаться в фоне во время разбора).
+            # У произвольной price_formula версии нет - такие цены пересчитает reprice
+            calculator_formula = isinstance(self.price_formula, CalculatorFormula)
+            formula_set = formula_set or price_calculator.formula_set
+            formula_version = formula_set.version if calculator_formula else None
+            price_category_id = category_ids[0] if category_ids else None
+            
             for i, sku in enumerate(skus):
                 if not isinstance(sku, dict):
                     continue
                 
                 sku_id = sku.get('skuId', 0)
+                sku_id_str = str(sku_id)
                 
                 # ПРАВИЛЬНАЯ ЛОГИКА: Берём размер из properties SKU!
                 # properties содержит propertyValueId который соответствует размеру
                 properties = sku.get('properties', [])
-                size_eu = None
-                sku_color_id = None
+                # Цвет (первое свойство level=1) и размер из маппинга - за один проход
+                sku_color_id, size_eu = self._scan_sku_properties(properties, property_to_size)
                 
                 # ===== ФИЛЬТР ПО SKU/ЦВЕТУ =====
                 # ДЛЯ АКСЕССУАРОВ: Если указан reference_sku_id - загружаем ТОЛЬКО этот SKU
                 if size_type == 'accessories' and reference_sku_id:
-                    if str(sku_id) != str(reference_sku_id):
+                    if sku_id_str != str(reference_sku_id):
                         logger.debug(f"   ⏭️  SKU {sku_id}: не совпадает с reference_sku_id {reference_sku_id}, пропускаем")
                         continue
                     logger.debug(f"   ✅ SKU {sku_id}: совпадает с reference_sku_id, загружаем")
@@ -480,31 +550,14 @@ class ProductProcessor:
                 # 2. Нужно загрузить ВСЕ размеры этого ЦВЕТА, а не только один SKU!
                 # 3. Поэтому фильтруем по primary_color_id для обуви/одежды
                 elif size_type != 'accessories' and primary_color_id:
-                    for prop in properties:
-                        if isinstance(prop, dict) and prop.get('level') == 1:
-                            sku_color_id = prop.get('propertyValueId')
-                            break
-                    
                     # Если это SKU другого цвета - пропускаем
                     if sku_color_id and sku_color_id != primary_color_id:
                         logger.debug(f"   ⏭️  SKU {sku_id}: другой цвет (ID {sku_color_id}), пропускаем")
                         continue
                 
-                # Ищем размер в properties (обычно level=2, но иногда level=1)
-                for prop in properties:
-                    if isinstance(prop, dict):
-                        level = prop.get('level', 0)
-                        prop_value_id = prop.get('propertyValueId')
-                        # Проверяем и level=2 и level=1
-                        if prop_value_id in property_to_size and level in [1, 2]:
-                            size_eu = property_to_size[prop_value_id]
-                            break
-                
                 # FALLBACK: Если размер не найден в маппинге, пробуем другие способы
                 if not size_eu:
                     # Способ 1: Ищем prop с level=2 (обычно размер), НО пропускаем ширину обуви
-                    width_indicators = ['D', 'E', 'W', 'EE', 'EEE', '2E', '3E', '4E', 'D宽', 'E宽', '2E宽', '宽', '窄']
-                    
                     for prop in properties:
                         if isinstance(prop, dict) and prop.get('level') == 2:
                             prop_value = prop.get('propertyValue')
@@ -512,14 +565,9 @@ class ProductProcessor:
                                 prop_value_str = str(prop_value).strip()
                                 
                                 # КРИТИЧЕСКИ ВАЖНО: Пропускаем обозначения ширины обуви!
-                                is_width = False
-                                for indicator in width_indicators:
-                                    if indicator in prop_value_str or prop_value_str.upper() == indicator:
-                                        is_width = True
-                                        logger.debug(f"   ⏭️  level=2: пропускаем ширину обуви '{prop_value_str}'")
-                                        break
-                                
-                                if not is_width:
+                                if SHOE_WIDTH_CHARS.search(prop_value_str) or prop_value_str.upper() in SHOE_WIDTH_INDICATORS:
+                                    logger.debug(f"   ⏭️  level=2: пропускаем ширину обуви '{prop_value_str}'")
+                                else:
                                     size_eu = prop_value_str
                                     logger.debug(f"   📏 Размер из level=2: {size_eu} (fallback 1)")
                                     break
@@ -553,8 +601,8 @@ class ProductProcessor:
                                 # ВАЖНО: Пропускаем обозначения ширины обуви (D, E, 2E, 3E, W и т.д.)
                                 # Ширина обуви: обычно одна-две буквы, иногда с цифрой впереди
                                 # Примеры: D, E, 2E, 3E, W, EE, EEE
-                                width_indicators = ['D', 'E', 'W', 'EE', 'EEE', '2E', '3E', '4E', 'D宽', 'E宽', '2E宽']
-                                if prop_value_str.upper() in width_indicators or prop_value_str.upper().endswith('宽'):
+                                prop_value_upper = prop_value_str.upper()
+                                if prop_value_upper in FALLBACK_WIDTH_VALUES or prop_value_upper.endswith('宽'):
                                     logger.debug(f"   ⏭️  Пропускаем обозначение ширины обуви: {prop_value_str}")
                                     continue
                                 
@@ -596,9 +644,7 @@ class ProductProcessor:
                 # Иногда SKU ID сам по себе содержит информацию о размере
                 if not size_eu and size_type == 'shoes':
                     # Извлекаем числа из SKU ID
-                    sku_id_str = str(sku_id)
                     # Проверяем есть ли в конце SKU ID что-то похожее на размер (35-50)
-                    import re
                     # Ищем паттерны типа: 35, 36.5, 40, 42 в конце SKU ID
                     size_match = re.search(r'(\d{2}(?:\.\d)?)\D*$', sku_id_str)
                     if size_match:
@@ -646,10 +692,6 @@ class ProductProcessor:
                     except (ValueError, TypeError):
                         pass  # Оставляем как есть, если не число
                 
-                # Для логирования
-                in_price_info = str(sku_id) in price_info_skus if price_info_skus else False
-                status = sku.get('status', 0)
-                
                 # ========== КРИТИЧЕСКИ ВАЖНАЯ ПРОВЕРКА ==========
                 # НОВЫЙ API: productDetailWithPrice уже содержит только доступные SKU
                 # Старая проверка priceInfo больше не нужна
@@ -672,108 +714,38 @@ class ProductProcessor:
                 price_source = None
                 
                 # Вариант 1: ПРИОРИТЕТ - Цена из priceInfo endpoint
-                if str(sku_id) in price_info_skus:
-                    sku_price_data = price_info_skus[str(sku_id)]
+                if sku_id_str in price_info_skus:
+                    sku_price_data = price_info_skus[sku_id_str]
                     if isinstance(sku_price_data, dict):
                         prices_list = sku_price_data.get('prices', [])
                         if prices_list and len(prices_list) > 0:
-                            # ВАЖНО: Загружаем размеры с ДОПУСТИМЫМИ типами цен
-                            # ПРИОРИТЕТ 1: type=2 - обычная цена
-                            # ПРИОРИТЕТ 2: type=12 - спец. цена
-                            # ПРИОРИТЕТ 3: type=0 - неизвестный тип (цены нормальные)
-                            # ПРИОРИТЕТ 4: type=8 - скидочная цена (со скидками 20-60%)
-                            # ПРИОРИТЕТ 5: type=11 - новинка/спец. предложение
-                            # Остальные типы (3, 4, 95 и др.) - пропускаем
-                            
-                            ALLOWED_PRICE_TYPES = [2, 12, 0, 8, 11]  # Разрешенные типы цен
-                            
-                            selected_price_obj = None
-                            selected_type = None
-                            
-                            # ПРИОРИТЕТ 1: Ищем обычную цену (type=2)
-                            for price_obj in prices_list:
-                                if isinstance(price_obj, dict):
-                                    trade_type = price_obj.get('tradeType', 0)
-                                    time_delivery = price_obj.get('timeDelivery', {})
-                                    max_delivery = time_delivery.get('max', 999)
-                                    is_fast = max_delivery <= 4 and trade_type != 95
-                                    
-                                    if trade_type == 2 and is_fast:
-                                        selected_price_obj = price_obj
-                                        selected_type = 2
-                                        logger.debug(f"   💰 {size_eu}: найдена обычная цена (type=2)")
-                                        break
-                            
-                            # ПРИОРИТЕТ 2: Если type=2 не найдена, ищем type=12
-                            if not selected_price_obj:
-                                for price_obj in prices_list:
-                                    if isinstance(price_obj, dict):
-                                        trade_type = price_obj.get('tradeType', 0)
-                                        
-                                        if trade_type == 12:
-                                            selected_price_obj = price_obj
-                                            selected_type = 12
-                                            logger.debug(f"   💰 {size_eu}: найдена спец. цена (type=12)")
-                                            break
-                            
-                            # ПРИОРИТЕТ 3: Если type=2 и type=12 не найдены, ищем type=0
-                            if not selected_price_obj:
-                                for price_obj in prices_list:
-                                    if isinstance(price_obj, dict):
-                                        trade_type = price_obj.get('tradeType', 0)
-                                        
-                                        if trade_type == 0:
-                                            selected_price_obj = price_obj
-                                            selected_type = 0
-                                            logger.debug(f"   💰 {size_eu}: найдена цена type=0 (неизвестный тип)")
-                                            break
-                            
-                            # ПРИОРИТЕТ 4: Если type=0 не найдена, ищем type=8 (скидочная)
-                            if not selected_price_obj:
-                                for price_obj in prices_list:
-                                    if isinstance(price_obj, dict):
-                                        trade_type = price_obj.get('tradeType', 0)
-                                        
-                                        if trade_type == 8:
-                                            selected_price_obj = price_obj
-                                            selected_type = 8
-                                            logger.debug(f"   💰 {size_eu}: найдена скидочная цена (type=8)")
-                                            break
-                            
-                            # ПРИОРИТЕТ 5: Если type=8 не найдена, ищем type=11 (новинка)
-                            if not selected_price_obj:
-                                for price_obj in prices_list:
-                                    if isinstance(price_obj, dict):
-                                        trade_type = price_obj.get('tradeType', 0)
-                                        
-                                        if trade_type == 11:
-                                            selected_price_obj = price_obj
-                                            selected_type = 11
-                                            logger.debug(f"   💰 {size_eu}: найдена цена новинки (type=11)")
-                                            break
+                            # ВАЖНО: Загружаем размеры только с ДОПУСТИМЫМИ типами цен
+                            # (PRICE_TYPE_PRIORITY: 2, 12, 0, 8, 11; цена без tradeType считается type=0)
+                            selected_price_obj, selected_type = self._select_price(prices_list)
                             
                             # Если нет допустимых цен - пропускаем этот размер!
                             if not selected_price_obj:
                                 logger.debug(f"   ⏭️  {size_eu} EU (SKU {sku_id}): НЕТ допустимых цен (type=2, 12, 0, 8, 11), пропускаем")
                                 continue
                             
-                            if isinstance(selected_price_obj, dict):
-                                # КРИТИЧЕСКИ ВАЖНО: Используем activePrice (активная/скидочная цена)
-                                # Это та цена, которая реально отображается пользователю на сайте!
-                                price_raw = selected_price_obj.get('activePrice')
-                                
-                                # Если activePrice отсутствует - используем обычную price
-                                if not price_raw or price_raw <= 0:
-                                    price_raw = selected_price_obj.get('price', 0)
-                                    logger.debug(f"   💰 {size_eu}: используем price (activePrice отсутствует)")
-                                else:
-                                    logger.debug(f"   💰 {size_eu}: используем activePrice (скидочная цена)")
-                                
-                                if price_raw > 0:
-                                    # API ВСЕГДА возвращает цены в фенях (1/100 юаня)
-                                    price_cny = price_raw / 100
-                                    price_source = "priceInfo"
-                                    logger.debug(f"   💰 {size_eu} EU: цена из priceInfo = {price_cny} CNY (было {price_raw} феней)")
+                            logger.debug(f"   💰 {size_eu}: {PRICE_TYPE_LOG[selected_type]}")
+                            
+                            # КРИТИЧЕСКИ ВАЖНО: Используем activePrice (активная/скидочная цена)
+                            # Это та цена, которая реально отображается пользователю на сайте!
+                            price_raw = selected_price_obj.get('activePrice')
+                            
+                            # Если activePrice отсутствует - используем обычную price
+                            if not price_raw or price_raw <= 0:
+                                price_raw = selected_price_obj.get('price', 0)
+                                logger.debug(f"   💰 {size_eu}: используем price (activePrice отсутствует)")
+                            else:
+                                logger.debug(f"   💰 {size_eu}: используем activePrice (скидочная цена)")
+                            
+                            if price_raw > 0:
+                                # API ВСЕГДА возвращает цены в фенях (1/100 юаня)
+                                price_cny = price_raw / 100
+                                price_source = "priceInfo"
+                                logger.debug(f"   💰 {size_eu} EU: цена из priceInfo = {price_cny} CNY (было {price_raw} феней)")
                 
                 # Вариант 2: Детальная цена из price.prices[] (productDetailWithPrice)
                 # ⚠️ ВАЖНО: Применяем ту же фильтрацию по типам цен!
@@ -782,56 +754,9 @@ class ProductProcessor:
                     if isinstance(price_obj, dict):
                         prices_list = price_obj.get('prices', [])
                         if prices_list and len(prices_list) > 0:
-                            # КРИТИЧНО: Фильтруем по допустимым типам цен (как в Варианте 1)
-                            ALLOWED_PRICE_TYPES = [2, 12, 0, 8, 11]
-                            
-                            selected_price_obj = None
-                            selected_type = None
-                            
-                            # ПРИОРИТЕТ 1: Ищем type=2 (обычная цена)
-                            for price_obj_item in prices_list:
-                                if isinstance(price_obj_item, dict):
-                                    trade_type = price_obj_item.get('tradeType', 0)
-                                    time_delivery = price_obj_item.get('timeDelivery', {})
-                                    max_delivery = time_delivery.get('max', 999)
-                                    is_fast = max_delivery <= 4 and trade_type != 95
-                                    
-                                    if trade_type == 2 and is_fast:
-                                        selected_price_obj = price_obj_item
-                                        selected_type = 2
-                                        break
-                            
-                            # ПРИОРИТЕТ 2: type=12
-                            if not selected_price_obj:
-                                for price_obj_item in prices_list:
-                                    if isinstance(price_obj_item, dict) and price_obj_item.get('tradeType') == 12:
-                                        selected_price_obj = price_obj_item
-                                        selected_type = 12
-                                        break
-                            
-                            # ПРИОРИТЕТ 3: type=0
-                            if not selected_price_obj:
-                                for price_obj_item in prices_list:
-                                    if isinstance(price_obj_item, dict) and price_obj_item.get('tradeType') == 0:
-                                        selected_price_obj = price_obj_item
-                                        selected_type = 0
-                                        break
-                            
-                            # ПРИОРИТЕТ 4: type=8
-                            if not selected_price_obj:
-                                for price_obj_item in prices_list:
-                                    if isinstance(price_obj_item, dict) and price_obj_item.get('tradeType') == 8:
-                                        selected_price_obj = price_obj_item
-                                        selected_type = 8
-                                        break
-                            
-                            # ПРИОРИТЕТ 5: type=11
-                            if not selected_price_obj:
-                                for price_obj_item in prices_list:
-                                    if isinstance(price_obj_item, dict) and price_obj_item.get('tradeType') == 11:
-                                        selected_price_obj = price_obj_item
-                                        selected_type = 11
-                                        break
+                            # КРИТИЧНО: Фильтруем по допустимым типам цен (как в Варианте 1,
+                            # но цена без tradeType здесь не подходит)
+                            selected_price_obj, selected_type = self._select_price(prices_list, missing_trade_type=None)
                             
                             # Если нашли подходящую цену
                             if selected_price_obj:
@@ -859,7 +784,9 @@ class ProductProcessor:
                 
                 # Применяем формулу цены
                 price_rub = price_cny
-                if self.price_formula:
+                if calculator_formula:
+                    price_rub = self.price_formula(price_cny, formula_set, price_category_id)
+                elif self.price_formula:
                     price_rub = self.price_formula(price_cny)
                 
                 variants.append({
@@ -868,6 +795,7 @@ class ProductProcessor:
                     'size_type': size_type,
                     'price_cny': float(price_cny),
                     'price_rub': float(price_rub),
+                    'formula_version': formula_version,
                     'is_available': True,
                     'stock_status': status,
                     'price_source': price_source  # Для отладки
@@ -987,6 +915,23 @@ class ProductProcessor:
         
         return True, "Valid"
     
+    def _extract(self, name: str, product_data: dict) -> Any:
+        """
+        Извлекает поле товара по схеме payload_schema и учитывает сработавший путь
+        
+        Args:
+            name: Имя поля в PRODUCT_SCHEMA
+            product_data: Данные товара от API
+            
+        Returns:
+            Any: Значение поля (или значение по умолчанию из схемы)
+        """
+        value, index = product_schema.extract(name, product_data)
+        field_stats = self.field_paths.setdefault(name, {})
+        label = product_schema.path_label(name, index)
+        field_stats[label] = field_stats.get(label, 0) + 1
+        return value
+    
     def _log_invalid(self, reason: str):
         """Логирует причину невалидности товара"""
         self.invalid_reasons[reason] = self.invalid_reasons.get(reason, 0) + 1
@@ -1000,9 +945,31 @@ class ProductProcessor:
             "valid_count": self.valid_count,
             "invalid_count": self.processed_count - self.valid_count,
             "efficiency_percent": efficiency,
-            "invalid_reasons": self.invalid_reasons
+            "invalid_reasons": self.invalid_reasons,
+            "field_paths": self.field_paths
         }
     
+    def merge_stats(self, stats: Dict):
+        """
+        Добавляет к счетчикам статистику другого процессора
+        (например, разбора в процессе-воркере, см. parse_pool)
+        
+        Args:
+            stats: Результат get_stats() другого процессора
+        """
+        self.processed_count += stats.get("processed_count", 0)
+        self.valid_count += stats.get("valid_count", 0)
+        for reason, count in stats.get("invalid_reasons", {}).items():
+            self.invalid_reasons[reason] = self.invalid_reasons.get(reason, 0) + count
+        merge_path_stats(self.field_paths, stats.get("field_paths", {}))
+    
+    def reset_stats(self):
+        """Обнуляет счетчики обработки"""
+        self.processed_count = 0
+        self.valid_count = 0
+        self.invalid_reasons = {}
+        self.field_paths = {}
+    
     def get_top_invalid_reasons(self, top_n: int = 5) -> List[Tuple[str, int]]:
         """Возвращает топ причин невалидности"""
         sorted_reasons = sorted(self.invalid_reasons.items(), key=lambda x: x[1], reverse=True)
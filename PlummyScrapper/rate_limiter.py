@@ -2,74 +2,514 @@
 Централизованный Rate Limiter для соблюдения лимитов API
 """
 import asyncio
+import json
+import os
+import sqlite3
+import threading
 import time
 import logging
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
 
+# Имя корзины по умолчанию (используется для всех ненастроенных имен)
+DEFAULT_BUCKET = 'default'
+
+# Backend'ы корзин: memory - внутри процесса, sqlite - общий для всех процессов на хосте
+BACKEND_MEMORY = 'memory'
+BACKEND_SQLITE = 'sqlite'
+
+# Адаптивная скорость (AIMD): +STEP req/sec после WINDOW успешных ответов подряд,
+# умножение на FACTOR при 429 (не чаще одного раза за COOLDOWN секунд)
+AIMD_INCREASE_STEP = 0.05
+AIMD_SUCCESS_WINDOW = 10
+AIMD_DECREASE_FACTOR = 0.5
+AIMD_DECREASE_COOLDOWN = 5.0
+
+
+class TokenBucket:
+    """
+    Корзина токенов (token bucket)
+    
+    Токены пополняются со скоростью rate в секунду, но не больше capacity (burst).
+    Резервирование может уводить баланс в минус: каждый следующий запрос
+    получает свой слот в будущем, и ждать он может вне блокировки.
+    """
+    
+    def __init__(self, name: str, rate: float, capacity: float):
+        """
+        Args:
+            name: Имя корзины
+            rate: Скорость пополнения (токенов в секунду)
+            capacity: Максимальное количество накопленных токенов (burst)
+        """
+        self.name = name
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.total_reservations = 0
+    
+    def _refill(self, now: float):
+        """Пополняет корзину за прошедшее время"""
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated_at = now
+    
+    def available(self, now: float) -> float:
+        """Возвращает текущий баланс токенов (может быть отрицательным)"""
+        self._refill(now)
+        return self.tokens
+    
+    def reserve(self, now: float) -> float:
+        """
+        Резервирует один токен
+        
+        Args:
+            now: Текущее время (time.monotonic())
+        
+        Returns:
+            float: Сколько секунд нужно подождать до своего слота (0 - сразу)
+        """
+        self._refill(now)
+        self.tokens -= 1
+        self.total_reservations += 1
+        
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+    
+    def drain(self, now: float):
+        """Обнуляет накопленные токены (после 429 - не даем сразу burst)"""
+        self._refill(now)
+        self.tokens = min(self.tokens, 0.0)
+    
+    def set_rate(self, rate: float, now: float):
+        """Меняет скорость пополнения (накопленное до этого момента считается по старой)"""
+        self._refill(now)
+        self.rate = rate
+
+
+class SqliteTokenBucket:
+    """
+    Корзина токенов, общая для нескольких процессов
+    
+    Состояние (баланс и время пополнения) хранится в SQLite и изменяется
+    в транзакции BEGIN IMMEDIATE, поэтому параллельно запущенные команды
+    (например, update-prices-db и add-articles) делят одну квоту API.
+    Используется настенное время (time.time()), т.к. monotonic у разных процессов свой.
+    """
+    
+    def __init__(self, name: str, rate: float, capacity: float, db_path: str):
+        """
+        Args:
+            name: Имя корзины
+            rate: Скорость пополнения (токенов в секунду)
+            capacity: Максимальное количество накопленных токенов (burst)
+            db_path: Путь к файлу SQLite с состоянием корзин
+        """
+        self.name = name
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.db_path = db_path
+        self.total_reservations = 0
+        self._conn: Optional[sqlite3.Connection] = None
+    
+    def _get_connection(self) -> sqlite3.Connection:
+        """Открывает соединение при первом обращении"""
+        if self._conn is None:
+            # isolation_level=None - транзакциями управляем вручную
+            self._conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None,
+                                         check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS buckets (
+                    name TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+        return self._conn
+    
+    def _update(self, consume: float, drain: bool = False) -> float:
+        """
+        Атомарно пополняет корзину и списывает токены
+        
+        Args:
+            consume: Сколько токенов списать
+            drain: Обнулить накопленные токены
+        
+        Returns:
+            float: Баланс после списания
+        """
+        conn = self._get_connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = conn.execute(
+                "SELECT tokens, updated_at FROM buckets WHERE name = ?", (self.name,)
+            ).fetchone()
+            
+            if row is None:
+                tokens = self.capacity
+            else:
+                tokens, updated_at = row
+                if now > updated_at:
+                    tokens = min(self.capacity, tokens + (now - updated_at) * self.rate)
+            
+            tokens -= consume
+            if drain:
+                tokens = min(tokens, 0.0)
+            
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (name, tokens, updated_at) VALUES (?, ?, ?)",
+                (self.name, tokens, now)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return tokens
+    
+    def available(self, now: float) -> float:
+        """Возвращает текущий баланс общей корзины (может быть отрицательным)"""
+        row = self._get_connection().execute(
+            "SELECT tokens, updated_at FROM buckets WHERE name = ?", (self.name,)
+        ).fetchone()
+        if row is None:
+            return self.capacity
+        tokens, updated_at = row
+        return min(self.capacity, tokens + max(0.0, time.time() - updated_at) * self.rate)
+    
+    def reserve(self, now: float) -> float:
+        """
+        Резервирует один токен в общей корзине
+        
+        Args:
+            now: Не используется (время берется внутри транзакции)
+        
+        Returns:
+            float: Сколько секунд нужно подождать до своего слота (0 - сразу)
+        """
+        tokens = self._update(1)
+        self.total_reservations += 1
+        
+        if tokens >= 0:
+            return 0.0
+        return -tokens / self.rate
+    
+    def drain(self, now: float):
+        """Обнуляет накопленные токены (после 429 - не даем сразу burst)"""
+        self._update(0, drain=True)
+    
+    def set_rate(self, rate: float, now: float):
+        """Меняет скорость пополнения"""
+        self.rate = rate
+
+
 class RateLimiter:
     """
     Централизованный rate limiter для API запросов
     
     Обеспечивает:
-    - Строгое соблюдение лимита (0.5 req/sec = 2 сек между запросами)
-    - Адаптивный backoff при 429 ошибках
+    - Среднюю скорость requests_per_second (0.5 req/sec = 2 сек между запросами)
+    - Burst: до burst запросов подряд без ожидания после простоя
+    - Резервирование слота под блокировкой, ожидание - без блокировки
+    - Именованные корзины (например, отдельная для каждого endpoint'а)
+    - Общую квоту для нескольких процессов (backend='sqlite')
+    - Адаптивную скорость (adaptive=True): рост при успехах, снижение при 429
     - Thread-safe операции
     """
     
-    def __init__(self, requests_per_second: float = 0.5):
+    def __init__(self, requests_per_second: float = 0.5, burst: int = 1,
+                 backend: str = BACKEND_MEMORY, db_path: str = 'poizon_rate_limiter.db',
+                 adaptive: bool = False, min_rate: Optional[float] = None,
+                 max_rate: Optional[float] = None, state_file: str = 'rate_limiter_state.json'):
         """
         Args:
             requests_per_second: Максимальное количество запросов в секунду
+                (при adaptive=True - начальная скорость, если нет сохраненной)
+            burst: Сколько запросов можно выполнить подряд без ожидания
+            backend: 'memory' (квота процесса) или 'sqlite' (квота общая для процессов)
+            db_path: Файл состояния корзин для backend='sqlite'
+            adaptive: Подстраивать скорость по ответам API (AIMD)
+            min_rate: Нижняя граница адаптивной скорости (по умолчанию 1/4 от начальной)
+            max_rate: Верхняя граница адаптивной скорости (по умолчанию 4x от начальной)
+            state_file: Файл, где сохраняется найденная безопасная скорость
         """
+        if backend not in (BACKEND_MEMORY, BACKEND_SQLITE):
+            raise ValueError(f"Неизвестный backend rate limiter: {backend}")
+        
+        self.backend = backend
+        self.db_path = db_path
         self.requests_per_second = requests_per_second
         self.min_interval = 1.0 / requests_per_second  # 2.0 секунды для 0.5 req/sec
+        self.burst = burst
         self.last_request_time: Optional[float] = None
         self.total_requests = 0
         self.rate_limit_errors = 0
-        self._lock = asyncio.Lock()
+        self._lock = threading.Lock()
+        
+        self.adaptive = adaptive
+        self.min_rate = min_rate or requests_per_second / 4
+        self.max_rate = max_rate or requests_per_second * 4
+        self.state_file = state_file
+        self.rate_increases = 0
+        self.rate_decreases = 0
+        self._success_streak: Dict[str, int] = {}
+        self._last_decrease: Dict[str, float] = {}
+        self._saved_rates: Dict[str, float] = self._load_rates() if adaptive else {}
+        
+        self._buckets: Dict[str, TokenBucket] = {
+            DEFAULT_BUCKET: self._create_bucket(DEFAULT_BUCKET, requests_per_second, burst)
+        }
+        self._apply_default_rate(self._buckets[DEFAULT_BUCKET].rate)
+        
+        logger.info(f"🚦 RateLimiter инициализирован: {self.requests_per_second} req/sec "
+                    f"(интервал {self.min_interval} сек, burst {burst}, backend {backend}"
+                    f"{', adaptive' if adaptive else ''})")
+    
+    def _load_rates(self) -> Dict[str, float]:
+        """Загружает сохраненные скорости корзин (результат прошлых запусков)"""
+        if not os.path.exists(self.state_file):
+            return {}
+        
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            rates = {name: float(rate) for name, rate in data.get('rates', {}).items()}
+            logger.info(f"📂 Загружена сохраненная скорость API: {rates}")
+            return rates
+        except Exception as e:
+            logger.error(f"Ошибка загрузки состояния rate limiter: {e}")
+            return {}
+    
+    def _save_rates(self):
+        """Сохраняет текущие скорости корзин для следующих запусков"""
+        with self._lock:
+            rates = {name: b.rate for name, b in self._buckets.items()}
         
-        logger.info(f"🚦 RateLimiter инициализирован: {requests_per_second} req/sec (интервал {self.min_interval} сек)")
+        try:
+            with open(self.state_file, 'w', encoding='utf-8') as f:
+                json.dump({'rates': rates, 'timestamp': time.strftime('%Y-%m-%d %H:%M:%S')},
+                          f, indent=2, ensure_ascii=False)
+        except Exception as e:
+            logger.error(f"Ошибка сохранения состояния rate limiter: {e}")
+    
+    def _apply_default_rate(self, rate: float):
+        """Обновляет публичные поля скорости по корзине по умолчанию"""
+        self.requests_per_second = rate
+        self.min_interval = 1.0 / rate
     
-    async def acquire(self):
+    def _create_bucket(self, name: str, requests_per_second: float, burst: int):
+        """Создает корзину для текущего backend'а"""
+        if name in self._saved_rates:
+            requests_per_second = min(self.max_rate, max(self.min_rate, self._saved_rates[name]))
+        
+        if self.backend == BACKEND_SQLITE:
+            return SqliteTokenBucket(name, requests_per_second, burst, self.db_path)
+        return TokenBucket(name, requests_per_second, burst)
+    
+    def configure_bucket(self, name: str, requests_per_second: float, burst: int = 1):
         """
-        Ожидает разрешение на выполнение запроса
-        Автоматически добавляет задержку если нужно
+        Создает (или перенастраивает) отдельную корзину
+        
+        Запросы с bucket=name будут ограничиваться только этой корзиной.
+        Ненастроенные имена используют корзину по умолчанию.
+        
+        Args:
+            name: Имя корзины (например, "priceInfo")
+            requests_per_second: Скорость для этой корзины
+            burst: Размер burst для этой корзины
         """
-        async with self._lock:
-            current_time = time.time()
-            
-            if self.last_request_time is not None:
-                elapsed = current_time - self.last_request_time
-                wait_time = self.min_interval - elapsed
-                
-                if wait_time > 0:
-                    logger.debug(f"⏳ Rate limit: ожидание {wait_time:.2f} сек")
-                    await asyncio.sleep(wait_time)
-                    current_time = time.time()
-            
-            self.last_request_time = current_time
+        with self._lock:
+            self._buckets[name] = self._create_bucket(name, requests_per_second, burst)
+        logger.info(f"🚦 Корзина '{name}': {requests_per_second} req/sec (burst {burst})")
+    
+    def has_bucket(self, name: str) -> bool:
+        """Настроена ли отдельная корзина с таким именем"""
+        with self._lock:
+            return name in self._buckets
+    
+    def _get_bucket(self, name: Optional[str]) -> TokenBucket:
+        """Возвращает корзину по имени (или корзину по умолчанию)"""
+        return self._buckets.get(name or DEFAULT_BUCKET) or self._buckets[DEFAULT_BUCKET]
+    
+    def reserve(self, bucket: Optional[str] = None) -> float:
+        """
+        Неблокирующее резервирование слота
+        
+        Args:
+            bucket: Имя корзины (None - корзина по умолчанию)
+        
+        Returns:
+            float: Через сколько секунд можно выполнить запрос
+        """
+        with self._lock:
+            wait_time = self._get_bucket(bucket).reserve(time.monotonic())
+            self.last_request_time = time.time() + wait_time
             self.total_requests += 1
-            
-            if self.total_requests % 100 == 0:
-                logger.info(f"📊 API запросов выполнено: {self.total_requests}")
+            total = self.total_requests
+        
+        if total % 100 == 0:
+            logger.info(f"📊 API запросов выполнено: {total}")
+        
+        return wait_time
+    
+    def reserve_best(self, buckets: List[str]) -> Tuple[str, float]:
+        """
+        Резервирует слот в корзине с наибольшим остатком токенов
+        
+        Выбор и резервирование выполняются под одной блокировкой, поэтому
+        параллельные запросы распределяются по корзинам равномерно.
+        
+        Args:
+            buckets: Имена корзин-кандидатов (например, корзины API ключей)
+        
+        Returns:
+            Tuple[str, float]: Имя выбранной корзины и время ожидания в секундах
+        """
+        with self._lock:
+            now = time.monotonic()
+            best = max(buckets, key=lambda name: self._get_bucket(name).available(now))
+            wait_time = self._get_bucket(best).reserve(now)
+            self.last_request_time = time.time() + wait_time
+            self.total_requests += 1
+            total = self.total_requests
+        
+        if total % 100 == 0:
+            logger.info(f"📊 API запросов выполнено: {total}")
+        
+        return best, wait_time
+    
+    async def acquire_best(self, buckets: List[str]) -> str:
+        """
+        Ожидает слот в корзине с наибольшим остатком токенов (см. reserve_best)
+        
+        Args:
+            buckets: Имена корзин-кандидатов
+        
+        Returns:
+            str: Имя выбранной корзины
+        """
+        if self.backend == BACKEND_SQLITE:
+            name, wait_time = await asyncio.to_thread(self.reserve_best, buckets)
+        else:
+            name, wait_time = self.reserve_best(buckets)
+        
+        if wait_time > 0:
+            logger.debug(f"⏳ Rate limit ({name}): ожидание {wait_time:.2f} сек")
+            await asyncio.sleep(wait_time)
+        
+        return name
+    
+    async def acquire(self, bucket: Optional[str] = None):
+        """
+        Ожидает разрешение на выполнение запроса
+        Слот резервируется сразу, ожидание идет без удержания блокировки
+        
+        Args:
+            bucket: Имя корзины (None - корзина по умолчанию)
+        """
+        if self.backend == BACKEND_SQLITE:
+            # Транзакция SQLite может ждать другой процесс - не блокируем event loop
+            wait_time = await asyncio.to_thread(self.reserve, bucket)
+        else:
+            wait_time = self.reserve(bucket)
+        
+        if wait_time > 0:
+            logger.debug(f"⏳ Rate limit: ожидание {wait_time:.2f} сек")
+            await asyncio.sleep(wait_time)
+    
+    def _set_bucket_rate(self, bucket: TokenBucket, rate: float):
+        """Меняет скорость корзины (вызывается под блокировкой)"""
+        rate = round(rate, 4)
+        bucket.set_rate(rate, time.monotonic())
+        if bucket.name == DEFAULT_BUCKET:
+            self._apply_default_rate(rate)
+    
+    def record_success(self, bucket: Optional[str] = None):
+        """
+        Учитывает успешный ответ API (аддитивное увеличение скорости)
+        
+        Args:
+            bucket: Имя корзины, через которую шел запрос
+        """
+        if not self.adaptive:
+            return
+        
+        new_rate = None
+        with self._lock:
+            b = self._get_bucket(bucket)
+            streak = self._success_streak.get(b.name, 0) + 1
+            if streak >= AIMD_SUCCESS_WINDOW:
+                streak = 0
+                rate = min(self.max_rate, b.rate + AIMD_INCREASE_STEP)
+                if rate > b.rate:
+                    self._set_bucket_rate(b, rate)
+                    self.rate_increases += 1
+                    new_rate = rate
+            self._success_streak[b.name] = streak
+        
+        if new_rate is not None:
+            logger.debug(f"📈 Скорость API '{b.name}' увеличена до {new_rate:.2f} req/sec")
+            self._save_rates()
+    
+    def record_rate_limit(self, bucket: Optional[str] = None):
+        """
+        Учитывает ответ 429 (мультипликативное снижение скорости)
+        
+        Несколько 429 подряд из одного burst'а снижают скорость только один раз.
+        
+        Args:
+            bucket: Имя корзины, через которую шел запрос
+        """
+        self.rate_limit_errors += 1
+        if not self.adaptive:
+            return
+        
+        new_rate = None
+        now = time.monotonic()
+        with self._lock:
+            b = self._get_bucket(bucket)
+            self._success_streak[b.name] = 0
+            if now - self._last_decrease.get(b.name, float('-inf')) >= AIMD_DECREASE_COOLDOWN:
+                self._last_decrease[b.name] = now
+                rate = max(self.min_rate, b.rate * AIMD_DECREASE_FACTOR)
+                if rate < b.rate:
+                    self._set_bucket_rate(b, rate)
+                    self.rate_decreases += 1
+                    new_rate = rate
+        
+        if new_rate is not None:
+            logger.warning(f"📉 Скорость API '{b.name}' снижена до {new_rate:.2f} req/sec после 429")
+            self._save_rates()
     
-    async def handle_rate_limit_error(self, wait_time: int = 30):
+    async def handle_rate_limit_error(self, wait_time: int = 30, bucket: Optional[str] = None):
         """
         Обработка 429 ошибки (rate limit exceeded)
         
         Args:
             wait_time: Время ожидания в секундах (по умолчанию 30)
+            bucket: Имя корзины, получившей 429
         """
-        self.rate_limit_errors += 1
+        self.record_rate_limit(bucket)
         logger.warning(f"⚠️  429 Rate Limit Error #{self.rate_limit_errors}")
         logger.info(f"⏳ Ожидание {wait_time} секунд перед продолжением...")
         
         await asyncio.sleep(wait_time)
         
-        # Сбрасываем счетчик для нового отсчета
+        # Сбрасываем накопленные токены, чтобы не отправить burst сразу после паузы
+        def drain():
+            with self._lock:
+                self._get_bucket(bucket).drain(time.monotonic())
+        
+        if self.backend == BACKEND_SQLITE:
+            await asyncio.to_thread(drain)
+        else:
+            drain()
         self.last_request_time = time.time()
     
     def get_stats(self) -> dict:
@@ -78,20 +518,35 @@ class RateLimiter:
             'total_requests': self.total_requests,
             'rate_limit_errors': self.rate_limit_errors,
             'requests_per_second': self.requests_per_second,
-            'min_interval': self.min_interval
+            'min_interval': self.min_interval,
+            'burst': self.burst,
+            'backend': self.backend,
+            'adaptive': self.adaptive,
+            'current_rate': self.requests_per_second,
+            'rate_increases': self.rate_increases,
+            'rate_decreases': self.rate_decreases,
+            'buckets': {
+                name: {
+                    'requests_per_second': b.rate,
+                    'burst': b.capacity,
+                    'reservations': b.total_reservations
+                }
+                for name, b in self._buckets.items()
+            }
         }
     
     def estimate_time(self, num_requests: int) -> float:
         """
         Оценивает время выполнения для заданного количества запросов
+        (по текущей скорости - при adaptive=True она меняется по ходу работы)
         
         Args:
             num_requests: Количество запросов
-            
+        
         Returns:
             Оценка времени в секундах
         """
-        return num_requests * self.min_interval
+        return max(0, num_requests - self.burst) * self.min_interval
     
     def format_eta(self, num_requests: int) -> str:
         """
@@ -99,7 +554,7 @@ class RateLimiter:
         
         Args:
             num_requests: Количество запросов
-            
+        
         Returns:
             Строка вида "2ч 15мин" или "45мин" или "30сек"
         """
@@ -117,17 +572,37 @@ class RateLimiter:
             return f"{seconds}сек"
 
 
-# Глобальный экземпляр rate limiter
-rate_limiter = RateLimiter(requests_per_second=0.5)
-
-
-async def with_rate_limit(func, *args, **kwargs):
+def configure_buckets_from_string(limiter: RateLimiter, spec: str):
     """
-    Декоратор-хелпер для выполнения функции с rate limiting
+    Настраивает именованные корзины из строки вида "priceInfo=1.0:2,productDetail=0.5"
+    
+    Формат элемента: имя=req_per_sec[:burst]
     
-    Пример:
-        result = await with_rate_limit(scraper.get_product_detail, session, spu_id)
+    Args:
+        limiter: Rate limiter для настройки
+        spec: Строка с описанием корзин
     """
-    await rate_limiter.acquire()
-    return await func(*args, **kwargs)
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            name, value = item.split('=', 1)
+            rate, _, burst = value.partition(':')
+            limiter.configure_bucket(name.strip(), float(rate), int(burst or 1))
+        except ValueError:
+            logger.error(f"❌ Некорректное описание корзины rate limiter: '{item}'")
 
+
+# Глобальный экземпляр rate limiter
+rate_limiter = RateLimiter(
+    requests_per_second=float(os.getenv('POIZON_RATE_LIMIT', '0.5')),
+    burst=int(os.getenv('POIZON_RATE_BURST', '1')),
+    backend=os.getenv('POIZON_RATE_LIMITER_BACKEND', BACKEND_MEMORY),
+    db_path=os.getenv('POIZON_RATE_LIMITER_DB', 'poizon_rate_limiter.db'),
+    adaptive=os.getenv('POIZON_RATE_ADAPTIVE', '0').lower() in ('1', 'true', 'yes'),
+    min_rate=float(os.getenv('POIZON_RATE_MIN', '0')) or None,
+    max_rate=float(os.getenv('POIZON_RATE_MAX', '0')) or None,
+    state_file=os.getenv('POIZON_RATE_STATE_FILE', 'rate_limiter_state.json')
+)
+configure_buckets_from_string(rate_limiter, os.getenv('POIZON_RATE_BUCKETS', ''))
@@ -0,0 +1,298 @@
+"""
+Инкрементальный пересчет цен после изменения price_formulas.json
+Пересчитываются только товары категорий, формулы которых действительно изменились,
+а на сайт отправляются только изменившиеся цены вариаций
+"""
+import asyncio
+import json
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+
+from database import db, Product, ProductVariant, ProductWpMapping
+from price_calculator import FormulaDiff, FormulaError, FormulaSet, price_calculator, reload_config
+
+logger = logging.getLogger(__name__)
+
+
+# Набор формул, по которому посчитаны текущие цены в БД и на сайте
+APPLIED_FORMULAS_FILE = os.getenv('PRICE_FORMULAS_APPLIED_FILE', 'price_formulas.applied.json')
+
+# price_rub в БД считается по этому сроку доставки (см. update_product_prices_only)
+DB_DELIVERY = "21-26 дней"
+
+# Размер пачки при чтении вариантов и обновлении БД
+CHUNK_SIZE = 500
+
+# Сколько товаров обновляем на сайте параллельно
+WP_CONCURRENCY = 4
+
+
+def load_applied_formula_set(path: str = APPLIED_FORMULAS_FILE) -> Optional[FormulaSet]:
+    """
+    Загружает набор формул, который был применен последним
+    
+    Returns:
+        Optional[FormulaSet]: Набор или None, если файла нет или он некорректен
+    """
+    if not os.path.exists(path):
+        return None
+    
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return FormulaSet.from_config(json.load(f))
+    except (FormulaError, ValueError, OSError) as e:
+        logger.error(f"❌ Ошибка загрузки примененных формул {path}: {e}")
+        return None
+
+
+def save_applied_formula_set(formula_set: FormulaSet, path: str = APPLIED_FORMULAS_FILE):
+    """Сохраняет набор формул как примененный"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(formula_set.to_config(), f, indent=2, ensure_ascii=False)
+
+
+def db_price_category(category_ids: Optional[list]):
+    """Категория для price_rub в БД (первая категория товара, как в update_product_prices_only)"""
+    return category_ids[0] if category_ids else None
+
+
+def wp_price_category(category_ids: Optional[list], category_id: Optional[int], size_type) -> int:
+    """Категория для цен вариаций на сайте (как в WordPressSync.update_product_in_wp)"""
+    if category_ids:
+        return int(category_ids[0])
+    return category_id or (103 if size_type is None or size_type.value == 'shoes' else 105)
+
+
+class RepricingPlan:
+    """План пересчета: изменения цен в БД и на сайте"""
+    
+    def __init__(self):
+        self.products_checked = 0
+        self.products_affected = 0
+        # [{'id': variant_id, 'price_rub': новая цена, 'formula_version': версия}]
+        self.db_updates: List[Dict] = []
+        # wp_product_id -> {(size_eu, срок_доставки): новая цена строкой}
+        self.wp_updates: Dict[int, Dict[Tuple[str, str], str]] = {}
+    
+    @property
+    def wp_variations_count(self) -> int:
+        return sum(len(prices) for prices in self.wp_updates.values())
+
+
+def _load_wp_ids(session) -> Dict[int, int]:
+    """Возвращает product_id -> wp_product_id по последней успешной синхронизации"""
+    rows = session.query(ProductWpMapping.product_id, ProductWpMapping.wp_product_id).filter(
+        ProductWpMapping.wp_product_id.isnot(None)
+    ).all()
+    return {product_id: wp_product_id for product_id, wp_product_id in rows}
+
+
+def plan_repricing(diff: FormulaDiff) -> RepricingPlan:
+    """
+    Находит варианты, цены которых меняются при переходе на новый набор формул
+    
+    Args:
+        diff: Разница между примененным и новым набором формул
+    
+    Returns:
+        RepricingPlan: Минимальный набор изменений для БД и сайта
+    """
+    plan = RepricingPlan()
+    session = db.get_session()
+    try:
+        products = session.query(Product.id, Product.category_ids, Product.category_id).filter(
+            Product.is_active == True
+        ).all()
+        plan.products_checked = len(products)
+        
+        # Отбираем товары затронутых категорий, не загружая их варианты
+        affected = {}
+        for product_id, category_ids, category_id in products:
+            wp_candidates = [int(category_ids[0])] if category_ids else [category_id or 103, category_id or 105]
+            if diff.is_affected(db_price_category(category_ids), DB_DELIVERY) or \
+                    any(diff.is_affected(c) for c in wp_candidates):
+                affected[product_id] = (category_ids, category_id)
+        
+        plan.products_affected = len(affected)
+        if not affected:
+            return plan
+        
+        wp_ids = _load_wp_ids(session)
+        product_ids = list(affected)
+        
+        for start in range(0, len(product_ids), CHUNK_SIZE):
+            chunk = product_ids[start:start + CHUNK_SIZE]
+            variants = session.query(
+                ProductVariant.id, ProductVariant.product_id, ProductVariant.size_eu,
+                ProductVariant.size_type, ProductVariant.price_cny, ProductVariant.price_rub,
+                ProductVariant.formula_version
+            ).filter(
+                ProductVariant.product_id.in_(chunk),
+                ProductVariant.price_cny.isnot(None)
+            ).order_by(ProductVariant.product_id, ProductVariant.id).all()
+            
+            _plan_db_updates(plan, diff, affected, variants)
+            _plan_wp_updates(plan, diff, affected, wp_ids, variants)
+        
+        return plan
+    finally:
+        session.close()
+
+
+def _plan_db_updates(plan: RepricingPlan, diff: FormulaDiff, affected: Dict, variants: list):
+    """Пересчитывает price_rub вариантов затронутых категорий"""
+    # Варианты, уже посчитанные по новому набору формул, пропускаем
+    rows = [v for v in variants
+            if v.formula_version != diff.new.version
+            and diff.is_affected(db_price_category(affected[v.product_id][0]), DB_DELIVERY)]
+    if not rows:
+        return
+    
+    new_prices = diff.new.calculate_prices_batch(
+        [v.price_cny for v in rows],
+        [db_price_category(affected[v.product_id][0]) for v in rows],
+        DB_DELIVERY
+    )
+    for variant, price_rub in zip(rows, new_prices):
+        if variant.price_rub is None or float(variant.price_rub) != price_rub:
+            plan.db_updates.append({'id': variant.id, 'price_rub': price_rub,
+                                    'formula_version': diff.new.version})
+
+
+def _plan_wp_updates(plan: RepricingPlan, diff: FormulaDiff, affected: Dict,
+                     wp_ids: Dict[int, int], variants: list):
+    """Находит вариации на сайте, у которых меняется отображаемая цена"""
+    # Тип размера первого варианта нужен только для товаров без category_ids
+    first_size_type = {}
+    for v in variants:
+        first_size_type.setdefault(v.product_id, v.size_type)
+    
+    for delivery_days in price_calculator.get_delivery_options():
+        rows, categories = [], []
+        for v in variants:
+            wp_product_id = wp_ids.get(v.product_id)
+            if wp_product_id is None:
+                continue
+            category_ids, category_id = affected[v.product_id]
+            category = wp_price_category(category_ids, category_id, first_size_type[v.product_id])
+            if diff.is_affected(category, delivery_days):
+                rows.append((wp_product_id, v))
+                categories.append(category)
+        
+        if not rows:
+            continue
+        
+        prices_cny = [v.price_cny for _, v in rows]
+        old_prices = diff.old.calculate_prices_batch(prices_cny, categories, delivery_days)
+        new_prices = diff.new.calculate_prices_batch(prices_cny, categories, delivery_days)
+        
+        for (wp_product_id, v), old_price, new_price in zip(rows, old_prices, new_prices):
+            # На сайт уходит целая часть цены (см. create_variations)
+            if int(old_price) != int(new_price):
+                plan.wp_updates.setdefault(wp_product_id, {})[(v.size_eu, delivery_days)] = str(int(new_price))
+
+
+def apply_db_updates(plan: RepricingPlan) -> int:
+    """
+    Записывает новые price_rub в БД пачками
+    
+    Returns:
+        int: Количество обновленных вариантов
+    """
+    session = db.get_session()
+    try:
+        for start in range(0, len(plan.db_updates), CHUNK_SIZE):
+            session.bulk_update_mappings(ProductVariant, plan.db_updates[start:start + CHUNK_SIZE])
+            session.commit()
+        return len(plan.db_updates)
+    except Exception as e:
+        session.rollback()
+        logger.error(f"❌ Ошибка обновления цен в БД: {e}")
+        raise
+    finally:
+        session.close()
+
+
+async def push_wp_updates(session: aiohttp.ClientSession, wp_sync, plan: RepricingPlan) -> Dict:
+    """
+    Отправляет изменившиеся цены вариаций на сайт
+    
+    Args:
+        session: aiohttp сессия
+        wp_sync: Экземпляр WordPressSync
+        plan: План пересчета
+    
+    Returns:
+        Dict: {'products': int, 'variations': int, 'failed': int}
+    """
+    semaphore = asyncio.Semaphore(WP_CONCURRENCY)
+    stats = {'products': 0, 'variations': 0, 'failed': 0}
+    
+    async def push(wp_product_id: int, prices: Dict[Tuple[str, str], str]):
+        async with semaphore:
+            updated = await wp_sync.update_variation_prices(session, wp_product_id, prices)
+        if updated is None:
+            stats['failed'] += 1
+        else:
+            stats['products'] += 1
+            stats['variations'] += updated
+    
+    await asyncio.gather(*(push(wp_id, prices) for wp_id, prices in plan.wp_updates.items()))
+    return stats
+
+
+def run_reprice():
+    """
+    Команда reprice: перечитывает price_formulas.json и применяет только изменения
+    
+    Сравнивает новый набор формул с последним примененным, обновляет price_rub
+    в БД и цены вариаций на сайте только для затронутых категорий.
+    """
+    reload_config()
+    new_set = price_calculator.formula_set
+    old_set = load_applied_formula_set()
+    
+    if old_set is None:
+        save_applied_formula_set(new_set)
+        print(f"ℹ️  Нет сохраненного набора примененных формул - текущий сохранен в {APPLIED_FORMULAS_FILE}")
+        print("   Если формулы менялись после последнего update-prices-full, запустите его один раз")
+        return
+    
+    diff = FormulaDiff(old_set, new_set)
+    if diff.is_empty:
+        print("✅ Формулы не изменились - пересчет не нужен")
+        return
+    
+    print("📝 Изменились формулы:")
+    for category, options in diff.changed_categories().items():
+        print(f"   {category}: {', '.join(options)}")
+    
+    plan = plan_repricing(diff)
+    print(f"🔍 Проверено товаров: {plan.products_checked}, затронуто: {plan.products_affected}")
+    
+    updated = apply_db_updates(plan)
+    print(f"💾 Обновлено цен в БД: {updated}")
+    
+    failed = 0
+    if plan.wp_updates:
+        from wordpress_sync import WordPressSync
+        wp_sync = WordPressSync(os.getenv('WOO_SITE_URL', ''), os.getenv('WOO_API_KEY', ''),
+                                os.getenv('WOO_API_SECRET', ''))
+        
+        async def push_all():
+            async with aiohttp.ClientSession() as session:
+                return await push_wp_updates(session, wp_sync, plan)
+        
+        stats = asyncio.run(push_all())
+        failed = stats['failed']
+        print(f"🌐 Сайт: товаров {stats['products']}, вариаций {stats['variations']}, ошибок {failed}")
+    
+    if failed:
+        print("⚠️  Не все товары обновлены на сайте - повторите reprice")
+        return
+    
+    save_applied_formula_set(new_set)
+    print("✅ Пересчет завершен")
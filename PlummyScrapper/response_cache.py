@@ -0,0 +1,191 @@
+"""
+Постоянный кэш ответов Poizon API на диске
+Хранит сжатые JSON ответы в SQLite с отдельным TTL для каждого endpoint'а
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+# TTL по умолчанию (секунды) для каждого endpoint'а. 0 = не кэшировать
+# Названия, картинки и размерные сетки меняются редко, цены - часто
+DEFAULT_TTLS = {
+    "productDetail": 7 * 24 * 3600,         # 7 дней
+    "productDetailWithPrice": 30 * 60,      # 30 минут (содержит цены)
+    "priceInfo": 30 * 60,                   # 30 минут
+    "searchProducts": 0,                    # Поиск не кэшируем
+}
+
+
+class ResponseCache:
+    """
+    Кэш ответов API в SQLite
+    
+    Ключ записи - хэш от (endpoint, spuId), значение - JSON сжатый zlib.
+    Устаревшие записи не возвращаются и перезаписываются при следующем запросе.
+    """
+    
+    def __init__(self, db_path: str = 'poizon_cache.db', ttls: Optional[Dict[str, int]] = None):
+        """
+        Args:
+            db_path: Путь к файлу кэша
+            ttls: TTL по endpoint'ам в секундах (переопределяет DEFAULT_TTLS)
+        """
+        self.db_path = db_path
+        self.ttls = dict(DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.writes = 0
+        
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+    
+    def _get_connection(self) -> sqlite3.Connection:
+        """Открывает соединение с файлом кэша при первом обращении"""
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    endpoint TEXT NOT NULL,
+                    spu_id TEXT NOT NULL,
+                    payload BLOB NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_created ON responses(created_at)")
+            self._conn.commit()
+            logger.info(f"🗄️  Кэш ответов API: {self.db_path}")
+        return self._conn
+    
+    @staticmethod
+    def make_key(endpoint: str, spu_id: str) -> str:
+        """Возвращает ключ записи для пары (endpoint, spuId)"""
+        return hashlib.sha256(f"{endpoint}:{spu_id}".encode('utf-8')).hexdigest()
+    
+    def get_ttl(self, endpoint: str) -> int:
+        """Возвращает TTL endpoint'а в секундах (0 - не кэшируется)"""
+        return self.ttls.get(endpoint, 0)
+    
+    def get(self, endpoint: str, spu_id: str) -> Optional[Dict]:
+        """
+        Возвращает ответ из кэша, если он есть и не устарел
+        
+        Args:
+            endpoint: Имя endpoint'а
+            spu_id: ID товара (SPU)
+        
+        Returns:
+            Optional[Dict]: Ответ API или None
+        """
+        ttl = self.get_ttl(endpoint)
+        if ttl <= 0:
+            return None
+        
+        try:
+            with self._lock:
+                row = self._get_connection().execute(
+                    "SELECT payload, created_at FROM responses WHERE key = ?",
+                    (self.make_key(endpoint, str(spu_id)),)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Ошибка чтения кэша: {e}")
+            return None
+        
+        if row is None:
+            self.misses += 1
+            return None
+        
+        payload, created_at = row
+        if time.time() - created_at > ttl:
+            self.expired += 1
+            self.misses += 1
+            return None
+        
+        self.hits += 1
+        logger.debug(f"🗄️  Кэш: {endpoint} spuId={spu_id}")
+        return json.loads(zlib.decompress(payload))
+    
+    def set(self, endpoint: str, spu_id: str, data: Dict):
+        """
+        Сохраняет ответ API в кэш
+        
+        Args:
+            endpoint: Имя endpoint'а
+            spu_id: ID товара (SPU)
+            data: Ответ API
+        """
+        if self.get_ttl(endpoint) <= 0:
+            return
+        
+        payload = zlib.compress(json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+        
+        try:
+            with self._lock:
+                conn = self._get_connection()
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, endpoint, spu_id, payload, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (self.make_key(endpoint, str(spu_id)), endpoint, str(spu_id), payload, time.time())
+                )
+                conn.commit()
+            self.writes += 1
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Ошибка записи в кэш: {e}")
+    
+    def purge_expired(self) -> int:
+        """
+        Удаляет устаревшие записи
+        
+        Returns:
+            int: Количество удаленных записей
+        """
+        removed = 0
+        now = time.time()
+        with self._lock:
+            conn = self._get_connection()
+            for endpoint, ttl in self.ttls.items():
+                cursor = conn.execute(
+                    "DELETE FROM responses WHERE endpoint = ? AND created_at < ?",
+                    (endpoint, now - ttl)
+                )
+                removed += cursor.rowcount
+            conn.commit()
+        
+        logger.info(f"🧹 Удалено устаревших записей кэша: {removed}")
+        return removed
+    
+    def clear(self):
+        """Полностью очищает кэш"""
+        with self._lock:
+            conn = self._get_connection()
+            conn.execute("DELETE FROM responses")
+            conn.commit()
+        logger.info("🧹 Кэш ответов API очищен")
+    
+    def get_stats(self) -> Dict:
+        """Возвращает статистику кэша"""
+        lookups = self.hits + self.misses
+        return {
+            "cache_hits": self.hits,
+            "cache_misses": self.misses,
+            "cache_expired": self.expired,
+            "cache_writes": self.writes,
+            "cache_hit_rate_percent": (self.hits / lookups * 100) if lookups else 0.0
+        }
+
+
+# Глобальный экземпляр кэша
+response_cache = ResponseCache(db_path=os.getenv('POIZON_CACHE_DB', 'poizon_cache.db'))
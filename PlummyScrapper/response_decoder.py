@@ -0,0 +1,249 @@
+"""
+Быстрое декодирование ответов Poizon API
+Ответы productDetail, productDetailWithPrice и priceInfo декодируются из байтов
+сразу в типизированные структуры (msgspec): неизвестные поля пропускаются без
+создания объектов, а несовпадение типов фиксируется как изменение формата API.
+Без msgspec используется orjson, без обоих - стандартный json
+"""
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional, TypedDict, Union
+
+try:
+    import msgspec
+except ImportError:  # msgspec необязателен
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+
+Number = Union[int, float]
+
+
+# ===== Структуры ответов (только поля, которые читают ProductProcessor и database) =====
+
+class TimeDelivery(TypedDict, total=False):
+    max: Optional[Number]
+    min: Optional[Number]
+
+
+class Price(TypedDict, total=False):
+    tradeType: Optional[int]
+    price: Optional[Number]
+    activePrice: Optional[Number]
+    timeDelivery: Optional[TimeDelivery]
+
+
+class SkuPrice(TypedDict, total=False):
+    prices: List[Price]
+
+
+class SkuProperty(TypedDict, total=False):
+    level: Optional[int]
+    propertyValueId: Optional[int]
+    propertyValue: Any
+
+
+class Sku(TypedDict, total=False):
+    skuId: Optional[int]
+    status: Optional[int]
+    logoUrl: Optional[str]
+    properties: List[SkuProperty]
+    price: Optional[SkuPrice]
+    size: Any
+    sizeValue: Any
+    sizeName: Any
+    sizeEu: Any
+    sizeUs: Any
+    sizeUk: Any
+
+
+class SaleProperty(TypedDict, total=False):
+    propertyValueId: Optional[int]
+    value: Any
+    name: Optional[str]
+    level: Optional[int]
+
+
+class SaleProperties(TypedDict, total=False):
+    list: List[SaleProperty]
+
+
+class Detail(TypedDict, total=False):
+    spuId: Optional[int]
+    title: Optional[str]
+    name: Optional[str]
+    productName: Optional[str]
+    spuName: Optional[str]
+    desc: Optional[str]
+    description: Optional[str]
+    logoUrl: Optional[str]
+    articleNumber: Optional[str]
+    categoryId: Optional[int]
+    categoryName: Optional[str]
+
+
+class SpuImage(TypedDict, total=False):
+    images: List[Any]
+
+
+class Image(TypedDict, total=False):
+    spuImage: Optional[SpuImage]
+
+
+class BrandItem(TypedDict, total=False):
+    brandName: Optional[str]
+
+
+class BrandRootInfo(TypedDict, total=False):
+    brandItemList: List[BrandItem]
+
+
+class ProductDetailResponse(TypedDict, total=False):
+    spuId: Optional[int]
+    title: Optional[str]
+    name: Optional[str]
+    productName: Optional[str]
+    spuName: Optional[str]
+    detail: Detail
+    basicParam: Dict[str, Any]
+    detailModel: Dict[str, Any]
+    image: Image
+    brandRootInfo: BrandRootInfo
+    skus: List[Sku]
+    saleProperties: SaleProperties
+    sizeDto: Dict[str, Any]
+
+
+class PriceInfoResponse(TypedDict, total=False):
+    skus: Dict[str, SkuPrice]
+
+
+# Типизированные структуры по endpoint'ам (остальные endpoint'ы декодируются как есть)
+RESPONSE_TYPES = {
+    "productDetail": ProductDetailResponse,
+    "productDetailWithPrice": ProductDetailResponse,
+    "priceInfo": PriceInfoResponse,
+}
+
+# Сколько предупреждений об изменении формата писать в лог на каждый endpoint
+MAX_DRIFT_WARNINGS = 5
+
+
+class ResponseDecoder:
+    """
+    Декодер ответов API
+    
+    Если ответ не соответствует структуре (изменился тип поля), он декодируется
+    целиком без схемы, а случай учитывается в статистике drift.
+    """
+    
+    def __init__(self, typed: bool = True):
+        """
+        Args:
+            typed: Декодировать известные endpoint'ы в структуры (нужен msgspec)
+        """
+        self._typed_decoders = {}
+        if typed and msgspec is not None:
+            self._typed_decoders = {
+                endpoint: msgspec.json.Decoder(type=response_type)
+                for endpoint, response_type in RESPONSE_TYPES.items()
+            }
+        
+        if msgspec is not None:
+            self._loads = msgspec.json.Decoder().decode
+            self.backend = "msgspec"
+        elif orjson is not None:
+            self._loads = orjson.loads
+            self.backend = "orjson"
+        else:
+            self._loads = json.loads
+            self.backend = "json"
+        
+        self.typed_decodes = 0
+        self.plain_decodes = 0
+        self.drift: Dict[str, int] = {}
+    
+    @property
+    def typed(self) -> bool:
+        """Декодирование в структуры доступно"""
+        return bool(self._typed_decoders)
+    
+    def cache_namespace(self, endpoint: str) -> Optional[str]:
+        """
+        Пространство имен кэша для ответов endpoint'а
+        
+        Типизированный ответ содержит только поля структуры, поэтому кэшируется
+        отдельно от полных ответов и не отдается без POIZON_FAST_DECODE.
+        
+        Args:
+            endpoint: Имя endpoint'а
+        
+        Returns:
+            Optional[str]: "typed" или None (полный ответ)
+        """
+        return "typed" if endpoint in self._typed_decoders else None
+    
+    def decode(self, endpoint: str, raw: bytes) -> Any:
+        """
+        Декодирует тело ответа
+        
+        Args:
+            endpoint: Имя endpoint'а
+            raw: Тело ответа
+        
+        Returns:
+            Any: Декодированный JSON
+        
+        Raises:
+            ValueError: Некорректный JSON
+        """
+        decoder = self._typed_decoders.get(endpoint)
+        if decoder is not None:
+            try:
+                data = decoder.decode(raw)
+                self.typed_decodes += 1
+                return data
+            except msgspec.ValidationError as e:
+                # JSON корректный, но формат поля изменился - декодируем без схемы
+                count = self.drift.get(endpoint, 0) + 1
+                self.drift[endpoint] = count
+                if count <= MAX_DRIFT_WARNINGS:
+                    logger.warning(f"⚠️ Формат ответа {endpoint} изменился: {e}")
+        
+        self.plain_decodes += 1
+        return self._loads(raw)
+    
+    def get_stats(self) -> Dict:
+        """Возвращает статистику декодирования"""
+        return {
+            "decoder_backend": self.backend,
+            "typed_decodes": self.typed_decodes,
+            "plain_decodes": self.plain_decodes,
+            "schema_drift": dict(self.drift)
+        }
+
+
+def decoder_from_env() -> Optional[ResponseDecoder]:
+    """
+    Создает декодер по POIZON_FAST_DECODE
+    
+    Returns:
+        Optional[ResponseDecoder]: Декодер или None (по умолчанию - response.json() aiohttp)
+    """
+    mode = os.getenv('POIZON_FAST_DECODE', '0').strip().lower()
+    if mode in ('', '0', 'false', 'no', 'off'):
+        return None
+    
+    decoder = ResponseDecoder(typed=mode != 'plain')
+    if mode != 'plain' and not decoder.typed:
+        logger.warning("⚠️ msgspec не установлен - ответы декодируются без схемы")
+    logger.info(f"⚡ Быстрое декодирование ответов API: {decoder.backend}"
+                f"{' (типизированное)' if decoder.typed else ''}")
+    return decoder
@@ -0,0 +1,192 @@
+"""
+Хранение и сжатие истории синхронизаций (wp_sync_log)
+Каждый sync-all / sync-prices добавляет по строке на товар, поэтому старые строки
+по политике хранения переносятся в сжатый архив (gzip JSONL) и удаляются из БД
+небольшими пачками - без долгих блокировок на запись. Текущий WP ID товара
+хранится в product_wp_mapping и от истории не зависит
+"""
+import gzip
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import and_, delete, func, not_, select
+
+from database import db, SyncStatus, WpSyncLog
+
+logger = logging.getLogger(__name__)
+
+
+class RetentionPolicy:
+    """Политика хранения: что из wp_sync_log остается в БД"""
+    
+    def __init__(self, keep_last: int = 20, keep_failed_days: int = 30):
+        """
+        Args:
+            keep_last: Сколько последних записей хранить для каждого товара
+            keep_failed_days: Сколько дней хранить ошибки синхронизации (даже сверх keep_last)
+        """
+        if keep_last < 1:
+            raise ValueError("keep_last должен быть не меньше 1")
+        self.keep_last = keep_last
+        self.keep_failed_days = keep_failed_days
+    
+    @classmethod
+    def from_env(cls) -> 'RetentionPolicy':
+        """Политика из SYNC_LOG_KEEP_LAST и SYNC_LOG_KEEP_FAILED_DAYS"""
+        return cls(
+            keep_last=int(os.getenv('SYNC_LOG_KEEP_LAST', '20')),
+            keep_failed_days=int(os.getenv('SYNC_LOG_KEEP_FAILED_DAYS', '30'))
+        )
+    
+    def __repr__(self):
+        return f"<RetentionPolicy(keep_last={self.keep_last}, keep_failed_days={self.keep_failed_days})>"
+
+
+class SyncLogCompactor:
+    """Архивирует и удаляет записи wp_sync_log, не попадающие под политику хранения"""
+    
+    def __init__(self, policy: Optional[RetentionPolicy] = None, archive_dir: Optional[str] = None,
+                 batch_size: Optional[int] = None, pause: float = 0.05, database=None):
+        """
+        Args:
+            policy: Политика хранения (по умолчанию из окружения)
+            archive_dir: Каталог архивов (по умолчанию SYNC_LOG_ARCHIVE_DIR; пустая строка -
+                удалять без архивации)
+            batch_size: Записей в одной транзакции удаления (по умолчанию SYNC_LOG_BATCH_SIZE)
+            pause: Пауза между пачками в секундах (дает пройти другим записывающим процессам)
+            database: Экземпляр Database (по умолчанию глобальный db)
+        """
+        self.policy = policy or RetentionPolicy.from_env()
+        self.archive_dir = os.getenv('SYNC_LOG_ARCHIVE_DIR', 'sync_log_archive') if archive_dir is None else archive_dir
+        self.batch_size = batch_size or int(os.getenv('SYNC_LOG_BATCH_SIZE', '500'))
+        self.pause = pause
+        self.db = database or db
+    
+    def find_expired_ids(self) -> List[int]:
+        """
+        Находит записи, которые не нужно хранить (одним читающим запросом)
+        
+        Запись хранится, если она среди keep_last последних записей товара
+        или это ошибка моложе keep_failed_days дней.
+        
+        Returns:
+            List[int]: ID записей по возрастанию
+        """
+        cutoff = datetime.utcnow() - timedelta(days=self.policy.keep_failed_days)
+        ranked = select(
+            WpSyncLog.id,
+            WpSyncLog.sync_status,
+            WpSyncLog.synced_at,
+            func.row_number().over(
+                partition_by=WpSyncLog.product_id,
+                order_by=(WpSyncLog.synced_at.desc(), WpSyncLog.id.desc())
+            ).label('position')
+        ).subquery()
+        
+        recent_failure = and_(ranked.c.sync_status == SyncStatus.failed, ranked.c.synced_at >= cutoff)
+        session = self.db.get_session()
+        try:
+            return list(session.execute(
+                select(ranked.c.id)
+                .where(ranked.c.position > self.policy.keep_last, not_(recent_failure))
+                .order_by(ranked.c.id)
+            ).scalars())
+        finally:
+            session.close()
+    
+    def _archive_path(self) -> str:
+        """Файл архива текущего запуска"""
+        os.makedirs(self.archive_dir, exist_ok=True)
+        return os.path.join(self.archive_dir, f"wp_sync_log_{datetime.now():%Y%m%d_%H%M%S}.jsonl.gz")
+    
+    @staticmethod
+    def _to_record(log: WpSyncLog) -> Dict:
+        """Запись лога для архива"""
+        return {
+            'id': log.id,
+            'product_id': log.product_id,
+            'wp_product_id': log.wp_product_id,
+            'action': log.action.value if log.action else None,
+            'sync_status': log.sync_status.value if log.sync_status else None,
+            'error_message': log.error_message,
+            'synced_at': log.synced_at.isoformat() if log.synced_at else None
+        }
+    
+    def compact(self, dry_run: bool = False) -> Dict:
+        """
+        Архивирует и удаляет лишние записи пачками
+        
+        Каждая пачка сначала дописывается в архив, затем удаляется в своей короткой
+        транзакции. При сбое между этими шагами пачка может попасть в архив дважды,
+        но не теряется.
+        
+        Args:
+            dry_run: Только посчитать записи к удалению
+        
+        Returns:
+            Dict: {'expired': int, 'deleted': int, 'archive': путь или None}
+        """
+        expired_ids = self.find_expired_ids()
+        stats = {'expired': len(expired_ids), 'deleted': 0, 'archive': None}
+        if dry_run or not expired_ids:
+            return stats
+        
+        archive = None
+        if self.archive_dir:
+            stats['archive'] = self._archive_path()
+            archive = gzip.open(stats['archive'], 'at', encoding='utf-8')
+        
+        try:
+            for start in range(0, len(expired_ids), self.batch_size):
+                batch = expired_ids[start:start + self.batch_size]
+                session = self.db.get_session()
+                try:
+                    if archive is not None:
+                        logs = session.query(WpSyncLog).filter(WpSyncLog.id.in_(batch)).order_by(WpSyncLog.id).all()
+                        for log in logs:
+                            archive.write(json.dumps(self._to_record(log), ensure_ascii=False) + '\n')
+                        archive.flush()
+                    
+                    result = session.execute(delete(WpSyncLog).where(WpSyncLog.id.in_(batch)))
+                    session.commit()
+                    stats['deleted'] += result.rowcount
+                except Exception:
+                    session.rollback()
+                    raise
+                finally:
+                    session.close()
+                
+                if self.pause:
+                    time.sleep(self.pause)
+        finally:
+            if archive is not None:
+                archive.close()
+        
+        logger.info(f"🗜️  wp_sync_log: удалено {stats['deleted']} записей"
+                    f"{', архив ' + stats['archive'] if stats['archive'] else ''}")
+        return stats
+
+
+def run_compact_sync_log(dry_run: bool = False):
+    """
+    Команда compact-sync-log: сжимает историю синхронизаций по политике хранения
+    
+    Args:
+        dry_run: Только показать, сколько записей будет удалено
+    """
+    compactor = SyncLogCompactor()
+    policy = compactor.policy
+    print(f"📋 Политика: последние {policy.keep_last} записей на товар, ошибки - {policy.keep_failed_days} дней")
+    
+    stats = compactor.compact(dry_run=dry_run)
+    if dry_run:
+        print(f"🔍 К удалению: {stats['expired']} записей (dry-run, ничего не изменено)")
+        return
+    
+    print(f"🗜️  Удалено записей: {stats['deleted']}")
+    if stats['archive']:
+        print(f"📦 Архив: {stats['archive']}")
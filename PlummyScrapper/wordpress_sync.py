@@ -517,6 +517,8 @@ class WordPressSync:
             category_id = category_id_for_price or product.category_id or 103
             
             delivery_options = price_calculator.get_delivery_options()
+            # Один набор формул на весь товар (формулы могут перезагрузиться в фоне)
+            formula_set = price_calculator.formula_set
             
             variations = []
             for variant in product.variants:
@@ -526,7 +528,7 @@ class WordPressSync:
                 # Создаем ДВЕ вариации для каждого размера (разные сроки доставки)
                 for delivery_days in delivery_options:
                     # Рассчитываем цену по формуле для категории и срока доставки
-                    price_rub = price_calculator.calculate_price(
+                    price_rub = formula_set.calculate_price(
                         variant.price_cny,
                         category_id,
                         delivery_days
@@ -856,6 +858,80 @@ class WordPressSync:
         except Exception as e:
             logger.error(f"❌ Ошибка обновления вариаций для товара {parent_id}: {e}")
     
+    async def update_variation_prices(self, session: aiohttp.ClientSession, parent_id: int,
+                                      prices: Dict[tuple, str]) -> Optional[int]:
+        """
+        Точечно обновляет цены вариаций без пересоздания
+        
+        Вариации сопоставляются по атрибутам (размер, pa_days); отправляются
+        только regular_price/sale_price тех вариаций, цена которых изменилась.
+        
+        Args:
+            session: aiohttp сессия
+            parent_id: ID родительского товара в WP
+            prices: {(size_eu, срок_доставки): новая цена строкой}
+            
+        Returns:
+            Optional[int]: Количество обновленных вариаций (None - ошибка)
+        """
+        url = f"{self.wp_url}/wp-json/wc/v3/products/{parent_id}/variations"
+        max_retries = 3
+        base_retry_delay = 3
+        
+        for attempt in range(max_retries):
+            try:
+                # Шаг 1: Получаем вариации, чтобы узнать их ID
+                async with session.get(url, params={"per_page": 100}, auth=self.get_auth(),
+                                      timeout=120) as response:
+                    if response.status != 200:
+                        await self._raise_for_variation_status(response, parent_id)
+                    existing_variations = await response.json()
+                
+                updates = []
+                for variation in existing_variations:
+                    attrs = variation.get('attributes', [])
+                    days = next((a.get('option') for a in attrs if a.get('id') == 6), None)
+                    size = next((a.get('option') for a in attrs if a.get('id') != 6), None)
+                    new_price = prices.get((size, days))
+                    if new_price is not None and variation.get('regular_price') != new_price:
+                        updates.append({"id": variation['id'], "regular_price": new_price, "sale_price": new_price})
+                
+                if not updates:
+                    return 0
+                
+                # Шаг 2: Batch обновление только измененных вариаций
+                async with session.post(f"{url}/batch", json={"update": updates}, auth=self.get_auth(),
+                                       timeout=120) as response:
+                    if response.status != 200:
+                        await self._raise_for_variation_status(response, parent_id)
+                
+                logger.info(f"   💰 Товар {parent_id}: обновлены цены {len(updates)} вариаций")
+                return len(updates)
+            
+            except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+                if attempt < max_retries - 1:
+                    retry_delay = base_retry_delay * (2 ** attempt)
+                    logger.warning(f"⚠️  Ошибка обновления цен вариаций {parent_id}: {e}, повтор через {retry_delay} сек...")
+                    await asyncio.sleep(retry_delay)
+                    continue
+                logger.error(f"❌ Не удалось обновить цены вариаций {parent_id} после {max_retries} попыток: {e}")
+            except ValueError as e:
+                logger.error(f"❌ Ошибка обновления цен вариаций {parent_id}: {e}")
+                return None
+        
+        return None
+    
+    async def _raise_for_variation_status(self, response: aiohttp.ClientResponse, parent_id: int):
+        """
+        Временные ошибки сервера (502/503/504) - ClientResponseError (повторяем),
+        остальные - ValueError (не повторяем)
+        """
+        if response.status in [502, 503, 504]:
+            raise aiohttp.ClientResponseError(response.request_info, response.history,
+                                              status=response.status)
+        error_text = await response.text()
+        raise ValueError(f"HTTP {response.status}: {error_text[:200]}")
+    
     async def delete_product_from_wp(self, session: aiohttp.ClientSession,
                                     wp_product_id: int) -> bool:
         """